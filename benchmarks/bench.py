@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the viewer's hot paths over the synthetic corpora: directory
+scanning, ordering/shuffling, decoding, prefetch throughput and metadata
+extraction. Nothing here needs a window or a GPU, so it runs headless.
+Results go out as JSON, tagged with the git commit, to compare across
+commits:
+
+    python benchmarks/bench.py --quick -o before.json
+    ... change things ...
+    python benchmarks/bench.py --quick -o after.json --compare before.json
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# kivy without a window, and leaving stderr and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoRoot)
+
+import numpy as np
+from PIL import Image as PILImage
+
+from corpus import CORPORA, build_corpus, corpus_files
+from tiviewlib.DirScanner import DirScanner, IMAGE_EXTENSIONS
+from tiviewlib.ImageSet import ImageSet
+from tiviewlib.ImageDecoder import decode_preview, decode_reduced, decode_rgba
+from tiviewlib.MetadataIndex import extract_metadata, read_sort_info
+
+RESULTS_VERSION = 1
+# what display-res decoding fits images into
+DISPLAY_SIZE = (1920, 1080)
+# decode threads ImageCache runs by default (decode-workers)
+DECODE_WORKERS = 4
+# synthetic records for the ordering benchmarks, no files behind them
+ORDER_RECORDS = 200000
+
+def timed(func, repeat):
+    """Run func repeat times, return its timings in seconds and the last result"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+def result(timings, items=None, unit='images', **extra):
+    entry = {'medianMs': statistics.median(timings) * 1000, 'minMs': min(timings) * 1000,
+             'runs': len(timings), **extra}
+    if items:
+        entry['items'] = items
+        entry['unit'] = unit
+        entry['perItemMs'] = entry['medianMs'] / items
+    return entry
+
+
+def bench_scan(corpora, repeat):
+    """DirScanner plus ImageSet.extend, as _get_images does (warm filesystem cache)"""
+    results = {}
+    for name, path in corpora.items():
+        def scan():
+            imageSet = ImageSet()
+            scanner = DirScanner([path], recursive=True, workers=8)
+            while not scanner.finished():
+                for found in scanner.get_batches():
+                    imageSet.extend(found)
+                time.sleep(0.001)
+            for found in scanner.get_batches():
+                imageSet.extend(found)
+            return len(imageSet)
+        timings, count = timed(scan, repeat)
+        results[f"scan/{name}"] = result(timings, count, dirs=sum(1 for _ in os.walk(path)))
+    return results
+
+def bench_order(repeat):
+    """The ImageSet work behind flip_image_changeType and the o key, on synthetic records"""
+    rng = random.Random(1)
+    found = [(f"/bench/dir{i % 500:03d}/img{i:07d}.jpg", rng.randrange(1 << 24), rng.random() * 1e9)
+             for i in range(ORDER_RECORDS)]
+    results = {}
+    timings, imageSet = timed(lambda: _filled(found), repeat)
+    results['order/extend'] = result(timings, ORDER_RECORDS, unit='records')
+    for changeType in ('random', 'shuffled', 'ordered'):
+        other = 'random' if changeType == 'ordered' else 'ordered'
+        cold, warm = [], []
+        for _ in range(repeat):
+            # first time into an order computes it, after that it's cached
+            imageSet.set_order(other)
+            imageSet.orders.clear()
+            start = time.perf_counter()
+            imageSet.set_order(changeType)
+            cold.append(time.perf_counter() - start)
+            imageSet.set_order(other)
+            start = time.perf_counter()
+            imageSet.set_order(changeType)
+            warm.append(time.perf_counter() - start)
+        results[f"order/{changeType}-first"] = result(cold, ORDER_RECORDS, unit='records')
+        results[f"order/{changeType}-again"] = result(warm, ORDER_RECORDS, unit='records')
+    for sortKey in ('size', 'mtime', 'name'):
+        timings, _ = timed(lambda: imageSet.set_sort_key(sortKey), repeat)
+        results[f"order/sort-{sortKey}"] = result(timings, ORDER_RECORDS, unit='records')
+    return results
+
+def _filled(found):
+    imageSet = ImageSet(seed=1)
+    imageSet.extend(found)
+    return imageSet
+
+def bench_decode(corpora, repeat):
+    """Decoding one image at a time, at display size and at full resolution, and previews of it"""
+    results = {}
+    for name, path in corpora.items():
+        files = corpus_files(path, IMAGE_EXTENSIONS)
+        if not files:
+            continue
+        megapixels = 0
+        for f in files:
+            with PILImage.open(f) as img:
+                megapixels += img.size[0] * img.size[1] / 1e6
+        for label, maxSize in (('display', DISPLAY_SIZE), ('full', None)):
+            timings, _ = timed(lambda: [decode_reduced(f, maxSize) for f in files], repeat)
+            results[f"decode-{label}/{name}"] = result(timings, len(files),
+                                                      megapixelsPerSec=megapixels / statistics.median(timings))
+        timings, previews = timed(lambda: [decode_preview(f, DISPLAY_SIZE) for f in files], repeat)
+        results[f"decode-preview/{name}"] = result(timings, len(files),
+                                                   previewed=sum(1 for p in previews if p is not None))
+    return results
+
+def bench_prefetch(corpora, repeat):
+    """Display-res RGBA decodes through as many threads as ImageCache has, what prefetching gets through"""
+    results = {}
+    for name, path in corpora.items():
+        files = corpus_files(path, IMAGE_EXTENSIONS)
+        if not files:
+            continue
+        def prefetch():
+            with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+                list(pool.map(lambda f: decode_rgba(f, DISPLAY_SIZE), files))
+        timings, _ = timed(prefetch, repeat)
+        results[f"prefetch/{name}"] = result(timings, len(files), imagesPerSec=len(files) / statistics.median(timings))
+    return results
+
+def bench_metadata(corpora, repeat):
+    """Header-only reads, for the i key and sorting by capture date/dimensions"""
+    results = {}
+    for name, path in corpora.items():
+        files = corpus_files(path, IMAGE_EXTENSIONS)
+        if not files:
+            continue
+        timings, _ = timed(lambda: [extract_metadata(f) for f in files], repeat)
+        results[f"metadata/{name}"] = result(timings, len(files))
+        timings, _ = timed(lambda: [read_sort_info(f) for f in files], repeat)
+        results[f"sort-info/{name}"] = result(timings, len(files))
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repoRoot, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repoRoot,
+                               capture_output=True, text=True).stdout.strip() != ''
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+def environment():
+    commit, dirty = git_commit()
+    return {'commit': commit, 'dirty': dirty, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'pillow': PILImage.__version__, 'numpy': np.__version__}
+
+def compare(results, baseline):
+    """Table of median times against a baseline run, slower ones flagged"""
+    lines = [f"{'benchmark':36}{'base ms':>12}{'now ms':>12}{'change':>9}"]
+    for name, entry in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            lines.append(f"{name:36}{'-':>12}{entry['medianMs']:12.2f}{'new':>9}")
+            continue
+        change = entry['medianMs'] / base['medianMs'] - 1 if base['medianMs'] else 0
+        flag = '  <-- slower' if change > 0.1 else ''
+        lines.append(f"{name:36}{base['medianMs']:12.2f}{entry['medianMs']:12.2f}{change:+8.0%}{flag}")
+    return '\n'.join(lines)
+
+
+BENCHMARKS = {
+    'scan': lambda corpora, repeat: bench_scan(corpora, repeat),
+    'order': lambda corpora, repeat: bench_order(repeat),
+    'decode': lambda corpora, repeat: bench_decode({k: v for k, v in corpora.items() if k != 'deep-tree'}, repeat),
+    'prefetch': lambda corpora, repeat: bench_prefetch({k: v for k, v in corpora.items() if k != 'deep-tree'}, repeat),
+    'metadata': lambda corpora, repeat: bench_metadata({k: v for k, v in corpora.items() if k != 'deep-tree'}, repeat),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the viewer hot paths on synthetic corpora')
+    parser.add_argument('--quick', action='store_true', help='small corpora and fewer runs')
+    parser.add_argument('--repeat', type=int, help='runs of each benchmark (default 5, 3 with --quick)')
+    parser.add_argument('--root', help='where the corpora live, generated on first use')
+    parser.add_argument('--only', metavar='PATTERN', help='only run benchmarks matching, e.g. "decode*" or "scan"')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write results JSON here (default stdout)')
+    parser.add_argument('--compare', metavar='FILE', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+    repeat = args.repeat or (3 if args.quick else 5)
+
+    corpora = {name: build_corpus(name, args.root, args.quick) for name in CORPORA}
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if args.only and not fnmatch.fnmatch(name, args.only):
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        results.update(bench(corpora, repeat))
+
+    report = {'version': RESULTS_VERSION, 'quick': args.quick, 'repeat': repeat,
+              'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
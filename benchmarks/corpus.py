@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Deterministic synthetic image corpora for the benchmarks. The same spec and
+seed always give the same files (for a given Pillow/libjpeg), and a corpus
+that's already on disk with a matching manifest isn't made again.
+
+    python benchmarks/corpus.py [--quick] [--root DIR]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+# bump when what gets generated changes, so old corpora are rebuilt
+CORPUS_VERSION = 1
+SEED = 20240601
+
+# name -> spec, full size and --quick size
+CORPORA = {
+    # lots of small files, scanning and per-file overhead
+    'small-png': {'full': {'count': 2000, 'size': (64, 256)}, 'quick': {'count': 300, 'size': (64, 256)}},
+    # camera sized JPEGs, decode and display-res reduction
+    'large-jpeg': {'full': {'count': 12, 'size': (6000, 4000)}, 'quick': {'count': 3, 'size': (6000, 4000)}},
+    # directories inside directories, recursive scanning
+    'deep-tree': {'full': {'depth': 6, 'fanout': 3, 'perDir': 5}, 'quick': {'depth': 4, 'fanout': 3, 'perDir': 3}},
+    # everything the viewer has to cope with, and files it should skip
+    'mixed': {'full': {'count': 240}, 'quick': {'count': 48}},
+}
+
+def default_root():
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cacheHome, 'timeless-imgview', 'bench-corpus')
+
+def _pixels(rng, width, height, channels=3):
+    """Smooth gradients plus noise, so files compress like photos rather than flat colour"""
+    x = np.arange(width, dtype=np.float32)[None, :]
+    y = np.arange(height, dtype=np.float32)[:, None]
+    base = np.stack([(x * rng.uniform(0.02, 0.2) + y * rng.uniform(0.02, 0.2) + rng.uniform(0, 255)) % 256
+                     for _ in range(channels)], axis=-1)
+    base += rng.standard_normal(size=(height, width, channels), dtype=np.float32) * 12
+    return np.clip(base, 0, 255).astype(np.uint8)
+
+def _exif(rng):
+    exif = Image.Exif()
+    exif[271] = 'BenchCam'
+    exif[272] = f"Model {int(rng.integers(1, 9))}"
+    exif.get_ifd(0x8769)[36867] = f"20{int(rng.integers(10, 24)):02d}:0{int(rng.integers(1, 9))}:1{int(rng.integers(0, 9))} 12:00:00"
+    return exif
+
+def _small_png(root, spec, rng):
+    low, high = spec['size']
+    for i in range(spec['count']):
+        width, height = (int(v) for v in rng.integers(low, high, size=2))
+        Image.fromarray(_pixels(rng, width, height)).save(os.path.join(root, f"small{i:05d}.png"))
+
+def _large_jpeg(root, spec, rng):
+    width, height = spec['size']
+    for i in range(spec['count']):
+        Image.fromarray(_pixels(rng, width, height)).save(os.path.join(root, f"large{i:03d}.jpg"),
+                                                          quality=92, exif=_exif(rng))
+
+def _deep_tree(root, spec, rng):
+    def fill(path, depth):
+        os.makedirs(path, exist_ok=True)
+        for i in range(spec['perDir']):
+            Image.fromarray(_pixels(rng, 48, 32)).save(os.path.join(path, f"leaf{i}.jpg"), quality=80)
+        if depth > 1:
+            for branch in range(spec['fanout']):
+                fill(os.path.join(path, f"d{branch}"), depth - 1)
+    fill(root, spec['depth'])
+
+def _mixed(root, spec, rng):
+    makers = ['jpeg', 'progressive', 'png-text', 'rgba', 'grey', 'png16', 'tiff', 'skip']
+    for i in range(spec['count']):
+        kind = makers[i % len(makers)]
+        width, height = (int(v) for v in rng.integers(320, 1600, size=2))
+        name = os.path.join(root, f"mixed{i:04d}")
+        if kind == 'jpeg':
+            Image.fromarray(_pixels(rng, width, height)).save(f"{name}.jpg", quality=int(rng.integers(60, 98)), exif=_exif(rng))
+        elif kind == 'progressive':
+            Image.fromarray(_pixels(rng, width, height)).save(f"{name}.jpeg", quality=85, progressive=True)
+        elif kind == 'png-text':
+            info = PngImagePlugin.PngInfo()
+            info.add_text('parameters', f"benchmark prompt {i}, steps {int(rng.integers(10, 50))}")
+            Image.fromarray(_pixels(rng, width, height)).save(f"{name}.png", pnginfo=info)
+        elif kind == 'rgba':
+            Image.fromarray(_pixels(rng, width, height, 4)).save(f"{name}.png")
+        elif kind == 'grey':
+            Image.fromarray(_pixels(rng, width, height, 1)[:, :, 0]).save(f"{name}.jpg", quality=90)
+        elif kind == 'png16':
+            Image.fromarray(_pixels(rng, width, height, 1)[:, :, 0].astype(np.uint16) * 257).save(f"{name}.png")
+        elif kind == 'tiff':
+            Image.fromarray(_pixels(rng, width, height)).save(f"{name}.tif", compression='tiff_lzw')
+        else:
+            # not images, scanning has to pass over them
+            with open(f"{name}.txt", 'w') as f:
+                f.write(f"not an image {i}\n")
+
+MAKERS = {'small-png': _small_png, 'large-jpeg': _large_jpeg, 'deep-tree': _deep_tree, 'mixed': _mixed}
+
+def build_corpus(name, root=None, quick=False):
+    """Directory holding corpus name, generated first unless it's already there"""
+    spec = CORPORA[name]['quick' if quick else 'full']
+    path = os.path.join(root or default_root(), f"{name}-quick" if quick else name)
+    manifest = {'version': CORPUS_VERSION, 'seed': SEED, 'spec': spec, 'pillow': Image.__version__}
+    manifestPath = os.path.join(path, 'manifest.json')
+    try:
+        with open(manifestPath) as f:
+            if json.load(f) == json.loads(json.dumps(manifest)):
+                return path
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    # each corpus gets its own stream, so adding one doesn't change the others
+    rng = np.random.default_rng([SEED, list(CORPORA).index(name)])
+    print(f"generating {name} corpus in {path}", file=sys.stderr)
+    MAKERS[name](path, spec, rng)
+    with open(manifestPath, 'w') as f:
+        json.dump(manifest, f)
+    return path
+
+def corpus_files(path, extensions=None):
+    """Every file in a corpus, sorted, manifest excluded"""
+    found = []
+    for dirPath, dirNames, fileNames in os.walk(path):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            if fileName == 'manifest.json':
+                continue
+            if extensions is None or fileName.lower().endswith(extensions):
+                found.append(os.path.join(dirPath, fileName))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate the benchmark image corpora')
+    parser.add_argument('--quick', action='store_true', help='small versions, for a fast run')
+    parser.add_argument('--root', help=f"where corpora go (default {default_root()})")
+    parser.add_argument('names', nargs='*', metavar='NAME', help=f"corpora to make: {', '.join(CORPORA)} (default all)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in CORPORA:
+            parser.error(f"no corpus called {name}")
+    for name in args.names or CORPORA:
+        print(build_corpus(name, args.root, args.quick))
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import time
+import unittest
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from PIL import Image as PILImage
+
+from tiviewlib.Animation import FRAMES_AHEAD, AnimationPlayer
+
+
+class AnimationPlayerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'anim.gif')
+        frames = [PILImage.new('RGB', (40, 30), (n * 20, 0, 0)) for n in range(10)]
+        frames[0].save(self.path, save_all=True, append_images=frames[1:], duration=50, loop=0)
+
+    def test_memory_used(self):
+        # the clock never ticks here, so frames pile up as far as they're allowed and no textures are made
+        player = AnimationPlayer(self.path, None, lambda texture: None)
+        self.addCleanup(player.stop)
+        deadline = time.monotonic() + 10
+        while not player.frames.full():
+            self.assertLess(time.monotonic(), deadline, "decoder didn't fill the queue")
+            time.sleep(0.01)
+        # the first frame is on screen already, only its duration is queued
+        self.assertEqual(player.memory_used(), (FRAMES_AHEAD - 1) * 40 * 30 * 4)
+        self.assertEqual(player.shrink(0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
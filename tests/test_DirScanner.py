@@ -0,0 +1,140 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from tiviewlib.DirScanner import DirScanner
+
+
+def scan_all(scanner, timeout=10):
+    """Every batch the scanner hands back, once it has finished"""
+    batches = []
+    deadline = time.monotonic() + timeout
+    while not scanner.finished():
+        if time.monotonic() > deadline:
+            raise AssertionError("scan didn't finish")
+        batches.extend(scanner.get_batches())
+        time.sleep(0.01)
+    batches.extend(scanner.get_batches())
+    return batches
+
+
+class DirScannerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name + '/'
+
+    def touch(self, name, data=b'x'):
+        path = self.root + name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_scan_finds_images_only(self):
+        wanted = [self.touch('b.jpg', b'12345'), self.touch('a.PNG'), self.touch('c.tiff')]
+        self.touch('notes.txt')
+        self.touch('sub/d.jpg')
+        batches = scan_all(DirScanner([self.root]))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([path for path, size, mtime in batches[0]], sorted(wanted))
+        sizes = {path: size for path, size, mtime in batches[0]}
+        self.assertEqual(sizes[self.root + 'b.jpg'], 5)
+
+    def test_directory_name_without_slash(self):
+        path = self.touch('a.jpg')
+        batches = scan_all(DirScanner([self.root.rstrip('/')]))
+        self.assertEqual([found[0] for batch in batches for found in batch], [path])
+
+    def test_recursive(self):
+        paths = [self.touch('a.jpg'), self.touch('one/b.jpg'), self.touch('one/two/c.jpg'), self.touch('three/d.png')]
+        batches = scan_all(DirScanner([self.root], recursive=True, workers=3))
+        # a batch per directory, each sorted, in whatever order they finished
+        self.assertEqual(len(batches), 4)
+        for batch in batches:
+            self.assertEqual(batch, sorted(batch))
+        self.assertEqual(sorted(found[0] for batch in batches for found in batch), sorted(paths))
+
+    def test_recursive_skip(self):
+        self.touch('a.jpg')
+        self.touch('Trash/b.jpg')
+        scanner = DirScanner([self.root], recursive=True, skip=[self.root + 'Trash/'])
+        batches = scan_all(scanner)
+        self.assertEqual([found[0] for batch in batches for found in batch], [self.root + 'a.jpg'])
+        self.assertEqual(set(scanner.dirMtimes), {self.root})
+
+    def test_not_recursive_by_default(self):
+        self.touch('one/b.jpg')
+        scanner = DirScanner([self.root])
+        batches = scan_all(scanner)
+        self.assertEqual(batches, [[]])
+        self.assertEqual(scanner.dirsScanned, 1)
+
+    def test_dir_mtimes(self):
+        self.touch('one/b.jpg')
+        scanner = DirScanner([self.root], recursive=True)
+        scan_all(scanner)
+        self.assertEqual(set(scanner.dirMtimes), {self.root, self.root + 'one/'})
+        self.assertEqual(scanner.dirMtimes[self.root + 'one/'], os.stat(self.root + 'one').st_mtime_ns)
+
+    def test_missing_directory(self):
+        scanner = DirScanner([self.root + 'gone'])
+        self.assertEqual(scan_all(scanner), [[]])
+        self.assertEqual(scanner.dirMtimes, {})
+
+    def test_files(self):
+        paths = [self.touch('z.jpg'), self.touch('a.jpg')]
+        batches = scan_all(DirScanner([], files=paths + [self.root + 'gone.jpg']))
+        # one batch, in the order given, without the one that isn't there
+        self.assertEqual([[found[0] for found in batch] for batch in batches], [paths])
+
+    def listed(self, data, separator=b'\n'):
+        """Paths the scanner found from a file list of data, in the order handed back"""
+        batches = scan_all(DirScanner([], fileList=io.BytesIO(data), separator=separator))
+        return [found[0] for batch in batches for found in batch]
+
+    def test_file_list(self):
+        paths = [self.touch('b.jpg'), self.touch('a.jpg'), self.touch('c.png')]
+        self.touch('notes.txt')
+        data = b''.join(os.fsencode(p) + b'\n' for p in paths + [self.root + 'notes.txt', self.root + 'gone.jpg'])
+        self.assertEqual(self.listed(data), paths)
+
+    def test_file_list_crlf_and_no_last_separator(self):
+        paths = [self.touch('a.jpg'), self.touch('b.jpg')]
+        self.assertEqual(self.listed(os.fsencode(paths[0]) + b'\r\n' + os.fsencode(paths[1])), paths)
+
+    def test_file_list_nul_separated(self):
+        # newlines are allowed in names, that's what -print0 is for
+        paths = [self.touch('new\nline.jpg'), self.touch('plain.jpg')]
+        data = b''.join(os.fsencode(p) + b'\0' for p in paths)
+        self.assertEqual(self.listed(data, b'\0'), paths)
+
+    def test_file_list_path_across_chunks(self):
+        # enough entries that one of them straddles the 64k read boundary
+        path = self.touch('a.jpg')
+        line = os.fsencode(path) + b'\n'
+        self.assertNotEqual(65536 % len(line), 0, "no path crosses the boundary, adjust the name")
+        count = 65536 // len(line) + 2
+        # a path cut in two wouldn't stat, and would go missing
+        data = line * count
+        for separator in (b'\n', b'\0'):
+            with self.subTest(separator=separator):
+                listed = self.listed(data.replace(b'\n', separator), separator)
+                self.assertEqual(listed, [path] * count)
+
+    def test_wait_for_first(self):
+        self.touch('one/a.jpg')
+        scanner = DirScanner([self.root], recursive=True)
+        batches = scanner.wait_for_first()
+        self.assertEqual(batches[-1][0][0], self.root + 'one/a.jpg')
+        scan_all(scanner)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import contextlib
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from tiviewlib import DirWatcher as DirWatcherModule
+from tiviewlib.DirWatcher import DirWatcher
+from tiviewlib.ImageSet import ImageSet
+
+BACKENDS = ('inotify', 'polling')
+HAVE_INOTIFY = DirWatcherModule._inotify() is not None
+
+
+class DirWatcherTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name + '/'
+
+    def touch(self, name, old=True):
+        """A file that's been there a while, as far as its mtime goes, unless not old"""
+        path = self.root + name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        if old:
+            os.utime(path, (time.time() - 60, time.time() - 60))
+        return path
+
+    def mtimes(self, *dirs):
+        return {d: os.stat(self.root + d).st_mtime_ns for d in dirs}
+
+    def start(self, backend, dirMtimes, known, recursive=False):
+        """A watcher using backend on dirMtimes, with the viewer knowing of known, both relative to root"""
+        if backend == 'inotify' and not HAVE_INOTIFY:
+            self.skipTest('no inotify here')
+        with mock.patch.object(DirWatcherModule, '_inotify', lambda: None) if backend == 'polling' else contextlib.nullcontext():
+            watcher = DirWatcher({self.root + d: mtime for d, mtime in dirMtimes.items()},
+                                 lambda: {self.root + d: set(names) for d, names in known.items()},
+                                 recursive=recursive, pollSeconds=0.05)
+        self.addCleanup(watcher.thread.join)
+        self.addCleanup(watcher.stop)
+        self.assertEqual(watcher.libc is None, backend == 'polling')
+        return watcher
+
+    def changes(self, watcher, added, removed, timeout=10):
+        """Collect changes until they're at least added and removed, then a little longer for any extra"""
+        seen = {}
+        deadline = time.monotonic() + timeout
+        settleUntil = None
+        while time.monotonic() < deadline:
+            new, gone = watcher.get_changes()
+            for path in gone:
+                seen[path] = 'remove'
+            for path, size, mtime in new:
+                seen[path] = 'add'
+            if settleUntil is None and all(seen.get(p) == 'add' for p in added) \
+                    and all(seen.get(p) == 'remove' for p in removed):
+                settleUntil = time.monotonic() + 0.3
+            if settleUntil is not None and time.monotonic() > settleUntil:
+                break
+            time.sleep(0.02)
+        return ({p for p, kind in seen.items() if kind == 'add'},
+                {p for p, kind in seen.items() if kind == 'remove'})
+
+    def test_create_rename_delete(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.root = tempfile.mkdtemp(dir=self.root) + '/'
+                a, b = self.touch('a.jpg'), self.touch('b.jpg')
+                watcher = self.start(backend, self.mtimes(''), {'': ['a.jpg', 'b.jpg']})
+                # give inotify a moment to get its watch in
+                time.sleep(0.2)
+                c = self.touch('c.jpg')
+                os.rename(a, self.root + 'd.jpg')
+                os.remove(b)
+                self.touch('notes.txt')
+                added, removed = self.changes(watcher, [c, self.root + 'd.jpg'], [a, b])
+                self.assertEqual(added, {c, self.root + 'd.jpg'})
+                self.assertEqual(removed, {a, b})
+
+    def test_changed_before_watching(self):
+        # the first scan and the watch starting don't quite line up, whatever changed in between is read again
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.root = tempfile.mkdtemp(dir=self.root) + '/'
+                a = self.touch('a.jpg')
+                dirMtime = os.stat(self.root).st_mtime_ns
+                b = self.touch('b.jpg')
+                os.remove(a)
+                os.utime(self.root, ns=(dirMtime + 10 ** 9, dirMtime + 10 ** 9))
+                watcher = self.start(backend, {'': dirMtime}, {'': ['a.jpg']})
+                self.assertEqual(self.changes(watcher, [b], [a]), ({b}, {a}))
+
+    def test_recursive(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.root = tempfile.mkdtemp(dir=self.root) + '/'
+                os.mkdir(self.root + 'watched')
+                self.touch('staging/sub/e.jpg')
+                watcher = self.start(backend, self.mtimes('watched/'), {}, recursive=True)
+                time.sleep(0.2)
+                os.rename(self.root + 'staging/sub', self.root + 'watched/sub')
+                e = self.root + 'watched/sub/e.jpg'
+                self.assertEqual(self.changes(watcher, [e], []), ({e}, set()))
+                # and files arriving in the new directory after that
+                f = self.touch('watched/sub/f.jpg')
+                self.assertEqual(self.changes(watcher, [f], []), ({f}, set()))
+                # the whole directory going takes its images with it
+                os.remove(e)
+                os.remove(f)
+                os.rmdir(self.root + 'watched/sub')
+                self.assertEqual(self.changes(watcher, [], [e, f]), (set(), {e, f}))
+
+    def test_polling_waits_for_files_to_settle(self):
+        watcher = self.start('polling', self.mtimes(''), {'': []})
+        with mock.patch.object(DirWatcherModule, 'SETTLE_SECONDS', 0.5):
+            fresh = self.touch('fresh.jpg', old=False)
+            started = time.monotonic()
+            self.assertEqual(self.changes(watcher, [fresh], []), ({fresh}, set()))
+            # not handed back while it might still be being written
+            self.assertGreater(time.monotonic() - started, 0.3)
+
+    def test_changes_applied_to_image_set(self):
+        # what the viewer does with them: same order as reading everything again and sorting
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.root = tempfile.mkdtemp(dir=self.root) + '/'
+                paths = [self.touch(f'{n:03d}.jpg') for n in range(0, 200, 2)]
+                images = ImageSet(seed=1)
+                images.extend((p, 1, 1) for p in paths)
+                images.setPos = 30
+                current = images.current()
+                watcher = self.start(backend, self.mtimes(''), {'': [os.path.basename(p) for p in paths]})
+                time.sleep(0.2)
+                new = [self.touch(f'{n:03d}.jpg') for n in (1, 51, 151, 201)]
+                gone = paths[5:8]
+                for path in gone:
+                    os.remove(path)
+                added, removed = self.changes(watcher, new, gone)
+                images.extend((p, 1, 1) for p in sorted(added))
+                images.discard(removed)
+                self.assertEqual(images.paths(), sorted(set(paths + new) - set(gone)))
+                self.assertIs(images.current(), current)
+
+    def test_get_changes_latest_wins(self):
+        watcher = self.start('polling', self.mtimes(''), {'': []})
+        watcher.stop()
+        watcher.changes.put(('add', ('/x/a.jpg', 1, 1)))
+        watcher.changes.put(('remove', '/x/a.jpg'))
+        watcher.changes.put(('remove', '/x/b.jpg'))
+        watcher.changes.put(('add', ('/x/b.jpg', 2, 2)))
+        self.assertEqual(watcher.get_changes(), ([('/x/b.jpg', 2, 2)], {'/x/a.jpg'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
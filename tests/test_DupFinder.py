@@ -0,0 +1,74 @@
+import os
+import random
+import unittest
+from unittest import mock
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from tiviewlib import DupFinder
+from tiviewlib.DupFinder import DUP_DISTANCE, group_duplicates
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+class GroupDuplicatesTest(unittest.TestCase):
+    # one bit from each of the first DUP_DISTANCE chunks, so only the last chunk still matches
+    SPREAD = [i * 64 // (DUP_DISTANCE + 1) for i in range(DUP_DISTANCE)]
+
+    def test_within_distance_grouped_transitively(self):
+        a = 0x0123456789abcdef
+        b = flip(a, self.SPREAD)
+        # as far from b again, so twice the distance from a
+        c = flip(b, [bit + 1 for bit in self.SPREAD])
+        unrelated = ~a & (2 ** 64 - 1)
+        phashes = [a, unrelated, b, c]
+        self.assertEqual(group_duplicates([0] * 4, phashes), [[0, 2, 3]])
+
+    def test_just_over_distance_kept_apart(self):
+        a = 0x0123456789abcdef
+        over = flip(a, self.SPREAD + [63])
+        self.assertEqual(group_duplicates([0, 0], [a, over]), [])
+        # close pHashes, but dHashes more than twice the distance apart
+        self.assertEqual(group_duplicates([0, (1 << (DUP_DISTANCE * 2 + 1)) - 1], [a, a]), [])
+        self.assertEqual(group_duplicates([0, (1 << (DUP_DISTANCE * 2)) - 1], [a, a]), [[0, 1]])
+
+    def test_random_pairs(self):
+        rng = random.Random(1)
+        phashes, dhashes, expected = [], [], []
+        for n in range(200):
+            base = rng.getrandbits(64)
+            near = flip(base, rng.sample(range(64), rng.randint(0, DUP_DISTANCE)))
+            phashes += [base, near]
+            dhashes += [n, n]
+            expected.append([2 * n, 2 * n + 1])
+        self.assertEqual(group_duplicates(dhashes, phashes), expected)
+
+    def test_identical_hashes_share_no_bucket(self):
+        widest = []
+        popcount = DupFinder._popcount
+
+        def recording(x):
+            widest.append(x.shape[-1])
+            return popcount(x)
+
+        copies = 5000
+        a = 0x0123456789abcdef
+        phashes = [a] * copies + [flip(a, [0]), 0xfedcba9876543210]
+        with mock.patch.object(DupFinder, '_popcount', recording):
+            groups = group_duplicates([0] * len(phashes), phashes)
+        self.assertEqual(groups, [list(range(copies + 1))])
+        # the copies were joined up front, buckets only ever held the two distinct near ones
+        self.assertLessEqual(max(widest), 2)
+
+    def test_empty(self):
+        self.assertEqual(group_duplicates([], []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
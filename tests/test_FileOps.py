@@ -0,0 +1,190 @@
+import errno
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from tiviewlib import FileOps
+from tiviewlib.FileOps import FileOp, FileOpQueue, OpCancelled, copy_file, move_file, rename_noreplace
+
+
+def run_all(ops, timeout=10):
+    """Everything ops.finished() hands back until the queue goes idle"""
+    done = []
+    deadline = time.monotonic() + timeout
+    while not ops.idle():
+        if time.monotonic() > deadline:
+            raise AssertionError("file ops didn't finish")
+        done.extend(ops.finished())
+        time.sleep(0.01)
+    return done
+
+
+class FileOpsTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for name in ('from', 'to'):
+            os.mkdir(os.path.join(self.dir, name))
+
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
+
+    def write(self, data, *names):
+        with open(self.path(*names), 'wb') as f:
+            f.write(data)
+        return self.path(*names)
+
+    def read(self, *names):
+        with open(self.path(*names), 'rb') as f:
+            return f.read()
+
+    def assert_untouched(self):
+        self.assertEqual(self.read('from', 'a.jpg'), b'source')
+        self.assertEqual(self.read('to', 'a.jpg'), b'already there')
+        self.assertEqual(os.listdir(self.path('to')), ['a.jpg'])
+
+    def test_move_onto_existing_fails(self):
+        src = self.write(b'source', 'from', 'a.jpg')
+        dest = self.write(b'already there', 'to', 'a.jpg')
+        # renameat2 where there is one, then without it, a hard link instead
+        for renameat2 in (FileOps._renameat2, None):
+            with self.subTest(renameat2=renameat2), mock.patch.object(FileOps, '_renameat2', renameat2):
+                with self.assertRaises(FileExistsError):
+                    rename_noreplace(src, dest)
+                with self.assertRaises(FileExistsError):
+                    move_file(src, dest)
+                self.assert_untouched()
+        # no hard links either
+        with mock.patch.object(FileOps, '_renameat2', None), \
+                mock.patch('os.link', side_effect=OSError(errno.EPERM, 'no links')):
+            with self.assertRaises(FileExistsError):
+                move_file(src, dest)
+            self.assert_untouched()
+
+    def test_move_onto_existing_across_filesystems_fails(self):
+        src = self.write(b'source', 'from', 'a.jpg')
+        dest = self.write(b'already there', 'to', 'a.jpg')
+        with mock.patch.object(FileOps, 'rename_noreplace', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            with self.assertRaises(FileExistsError):
+                move_file(src, dest)
+        self.assert_untouched()
+
+    def test_queued_move_onto_existing_fails(self):
+        self.write(b'source', 'from', 'a.jpg')
+        self.write(b'already there', 'to', 'a.jpg')
+        ops = FileOpQueue()
+        self.addCleanup(ops.pool.shutdown)
+        op = FileOp('move', self.path('from', 'a.jpg'), self.path('to'))
+        ops.submit(op)
+        self.assertEqual(run_all(ops), [(op, 'do')])
+        self.assertEqual(op.state, 'failed')
+        self.assertIsInstance(op.error, FileExistsError)
+        self.assert_untouched()
+        # nothing to undo
+        self.assertIsNone(ops.undo())
+
+    def test_move_across_filesystems(self):
+        src = self.write(b'x' * 1000, 'from', 'a.jpg')
+        real = rename_noreplace
+        calls = []
+
+        def cross_device(src, dest):
+            calls.append(src)
+            # the final rename of the copy is within one filesystem
+            if len(calls) == 1:
+                raise OSError(errno.EXDEV, 'cross-device')
+            real(src, dest)
+        with mock.patch.object(FileOps, 'rename_noreplace', cross_device), mock.patch.object(FileOps, 'COPY_CHUNK', 64):
+            move_file(src, self.path('to', 'a.jpg'))
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(self.read('to', 'a.jpg'), b'x' * 1000)
+
+    def test_cancelled_copy_leaves_nothing(self):
+        src = self.write(b'x' * 1000, 'from', 'a.jpg')
+        dest = self.path('to', 'a.jpg')
+        asked = []
+
+        def cancelled():
+            # let a couple of chunks through first
+            asked.append(True)
+            return len(asked) > 2
+        with mock.patch.object(FileOps, 'COPY_CHUNK', 64):
+            with self.assertRaises(OpCancelled):
+                copy_file(src, dest, cancelled)
+        self.assertEqual(os.listdir(self.path('to')), [])
+        self.assertEqual(self.read('from', 'a.jpg'), b'x' * 1000)
+
+    def test_failed_copy_leaves_nothing(self):
+        src = self.write(b'x' * 1000, 'from', 'a.jpg')
+        with mock.patch('shutil.copystat', side_effect=OSError(errno.EIO, 'broken')):
+            with self.assertRaises(OSError):
+                copy_file(src, self.path('to', 'a.jpg'))
+        self.assertEqual(os.listdir(self.path('to')), [])
+
+    def test_undo_move(self):
+        src = self.write(b'source', 'from', 'a.jpg')
+        ops = FileOpQueue()
+        self.addCleanup(ops.pool.shutdown)
+        op = FileOp('move', src, self.path('to'), recordIndex=3, pos=7)
+        ops.submit(op)
+        run_all(ops)
+        self.assertEqual(op.state, 'done')
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(self.read('to', 'a.jpg'), b'source')
+        self.assertIs(ops.undo(), op)
+        self.assertEqual(run_all(ops), [(op, 'undo')])
+        self.assertEqual(op.state, 'undone')
+        self.assertEqual(self.read('from', 'a.jpg'), b'source')
+        self.assertEqual(os.listdir(self.path('to')), [])
+
+    def test_undo_copy(self):
+        src = self.write(b'source', 'from', 'a.jpg')
+        ops = FileOpQueue()
+        self.addCleanup(ops.pool.shutdown)
+        op = FileOp('copy', src, self.path('to'))
+        ops.submit(op)
+        run_all(ops)
+        self.assertEqual(op.state, 'done')
+        self.assertEqual(self.read('to', 'a.jpg'), b'source')
+        ops.undo()
+        run_all(ops)
+        self.assertEqual(op.state, 'undone')
+        self.assertEqual(os.listdir(self.path('to')), [])
+        self.assertEqual(self.read('from', 'a.jpg'), b'source')
+
+    def test_undo_newest_first(self):
+        ops = FileOpQueue()
+        self.addCleanup(ops.pool.shutdown)
+        moves = [FileOp('move', self.write(name.encode(), 'from', name), self.path('to')) for name in ('a.jpg', 'b.jpg')]
+        for op in moves:
+            ops.submit(op)
+        run_all(ops)
+        self.assertIs(ops.undo(), moves[1])
+        run_all(ops)
+        self.assertEqual(sorted(os.listdir(self.path('from'))), ['b.jpg'])
+        self.assertEqual(os.listdir(self.path('to')), ['a.jpg'])
+
+    def test_undo_before_it_ran(self):
+        # an undo while the op is still queued cancels it, and the undo has nothing to do
+        src = self.write(b'source', 'from', 'a.jpg')
+        ops = FileOpQueue()
+        self.addCleanup(ops.pool.shutdown)
+        # keep the worker busy so the copy is still queued
+        ops.pool.submit(time.sleep, 0.2)
+        op = FileOp('copy', src, self.path('to'))
+        ops.submit(op)
+        ops.undo()
+        self.assertEqual(run_all(ops), [(op, 'do'), (op, 'undo')])
+        self.assertEqual(op.state, 'cancelled')
+        self.assertEqual(os.listdir(self.path('to')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
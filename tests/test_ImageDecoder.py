@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image as PILImage
+
+from tiviewlib.ImageDecoder import decode_reduced
+
+
+class DecodeReducedTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def grey16_png(self, size):
+        """A 16-bit greyscale PNG of size, dark at the top and bright at the bottom"""
+        path = os.path.join(self.dir, 'grey16.png')
+        img = PILImage.linear_gradient('L').resize(size).convert('I').point(lambda i: i * 257).convert('I;16')
+        img.save(path)
+        with PILImage.open(path) as check:
+            self.assertIn(check.mode, ('I;16', 'I;16B', 'I'))
+        return path
+
+    def test_16bit_png_reduced(self):
+        path = self.grey16_png((3200, 2400))
+        img, fullSize = decode_reduced(path, (800, 600))
+        self.assertEqual(fullSize, (3200, 2400))
+        self.assertEqual(img.size, (800, 600))
+        self.assertIn(img.mode, ('RGB', 'RGBA'))
+        # scaled down to 8 bits rather than clipped to white
+        self.assertLess(img.getpixel((400, 0))[0], 16)
+        self.assertGreater(img.getpixel((400, 599))[0], 240)
+
+    def test_16bit_png_full_size(self):
+        path = self.grey16_png((3200, 2400))
+        img, fullSize = decode_reduced(path, None)
+        self.assertEqual(img.size, fullSize)
+        self.assertGreater(img.getpixel((1600, 2399))[0], 240)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import unittest
+
+import numpy as np
+
+from tiviewlib.ImageSet import ImageSet, INSERT_FRACTION
+
+
+def found(names, dir='/pics/'):
+    """(path, size, mtime) for names, sizes and mtimes counting down so they don't sort like the names"""
+    return [(dir + name, 1000 - n, 1000 - n) for n, name in enumerate(names)]
+
+
+NAMES = [f'{n:04d}.jpg' for n in range(500)]
+
+
+class ImageSetTest(unittest.TestCase):
+    def setUp(self):
+        self.images = ImageSet(seed=1)
+        # found out of order, the way a scan does
+        self.images.extend(found(NAMES[1::2] + NAMES[::2]))
+
+    def assert_consistent(self, images):
+        """Positions agree with the order, and the order holds each live record once"""
+        self.assertEqual(len(set(images.order.tolist())), len(images))
+        self.assertFalse(images.removed[images.order].any())
+        for pos, record in enumerate(images):
+            self.assertEqual(images.position(record.path), pos)
+
+    def test_extend_sorted(self):
+        self.assertEqual(self.images.paths(), ['/pics/' + name for name in NAMES])
+        # already there, so not added twice
+        self.assertEqual(self.images.extend(found(NAMES[:10])), 0)
+        self.assertEqual(len(self.images), len(NAMES))
+        self.assert_consistent(self.images)
+
+    def test_extend_small_batch_same_as_full_sort(self):
+        extra = [f'{n:04d}.5.jpg' for n in range(0, 500, 50)] + ['0000.jpg.extra', 'zzzz.jpg']
+        self.assertLess(len(extra) * INSERT_FRACTION, len(self.images))
+        for sortKey in ('name', 'size'):
+            with self.subTest(sortKey=sortKey):
+                images = ImageSet(sortKey=sortKey, seed=1)
+                images.extend(found(NAMES))
+                # keys made, so the batch gets binary searched in
+                images.set_sort_key(sortKey)
+                images.setPos = 123
+                current = images.current()
+                images.extend(found(extra, '/pics/'))
+                everything = ImageSet(sortKey=sortKey, seed=1)
+                everything.extend(found(NAMES) + found(extra, '/pics/'))
+                self.assertEqual(images.paths(), everything.paths())
+                self.assertIs(images.current(), current)
+                self.assert_consistent(images)
+
+    def test_extend_unsorted(self):
+        images = ImageSet(seed=1)
+        images.extend(found(['b.jpg', 'a.jpg']), keepSorted=False)
+        images.extend(found(['c.jpg', '0.jpg']), keepSorted=False)
+        self.assertEqual(images.paths(), ['/pics/b.jpg', '/pics/a.jpg', '/pics/c.jpg', '/pics/0.jpg'])
+
+    def test_set_order_keeps_current(self):
+        self.images.setPos = 321
+        current = self.images.current()
+        seen = {}
+        for changeType in ('random', 'shuffled', 'ordered', 'shuffled', 'random', 'ordered'):
+            with self.subTest(changeType=changeType):
+                self.images.set_order(changeType)
+                self.assertEqual(self.images.changeType, changeType)
+                self.assertIs(self.images.current(), current)
+                self.assertEqual(sorted(self.images.paths()), ['/pics/' + name for name in NAMES])
+                # the same permutation coming back to it
+                paths = self.images.paths()
+                self.assertEqual(seen.setdefault(changeType, paths), paths)
+                self.assert_consistent(self.images)
+        self.assertNotEqual(seen['random'], seen['ordered'])
+
+    def test_shuffled_stays_near(self):
+        self.images.set_order('shuffled')
+        moved = [abs(pos - NAMES.index(record.name)) for pos, record in enumerate(self.images)]
+        self.assertLess(max(moved), 20)
+        self.assertNotEqual(self.images.paths(), ['/pics/' + name for name in NAMES])
+
+    def test_set_sort_key(self):
+        self.images.setPos = 10
+        current = self.images.current()
+        self.images.set_sort_key('size')
+        sizes = [record.size for record in self.images]
+        self.assertEqual(sizes, sorted(sizes))
+        self.assertIs(self.images.current(), current)
+
+    def test_remove_reinsert_same_order(self):
+        for changeType in ('ordered', 'random'):
+            with self.subTest(changeType=changeType):
+                self.images.set_order(changeType)
+                before = self.images.paths()
+                record = self.images[42]
+                i = self.images.remove(record)
+                self.assertIsNone(self.images.position(record.path))
+                self.assertEqual(self.images.path_at(42), before[43])
+                self.assertEqual(self.images.reinsert(i, 42), 42)
+                self.assertEqual(self.images.paths(), before)
+                self.assert_consistent(self.images)
+                # and the remembered orders have it back where it was
+                self.images.set_order('shuffled')
+                self.images.set_order(changeType)
+                self.assertEqual(self.images.paths(), before)
+
+    def test_filter_leaves_no_dead_records(self):
+        self.images.set_order('random')
+        self.images.set_order('shuffled')
+        self.images.set_order('ordered')
+        self.images.setPos = 7
+        current = self.images.current()
+        self.images.filter(lambda record: record.name < '0100')
+        kept = ['/pics/' + name for name in NAMES[:100]]
+        self.assertIs(self.images.current(), current)
+        for changeType, order in self.images.orders.items():
+            self.assertFalse(self.images.removed[order].any(), changeType)
+        for changeType in ('random', 'shuffled', 'ordered'):
+            with self.subTest(changeType=changeType):
+                self.images.set_order(changeType)
+                self.assertEqual(sorted(self.images.paths()), kept)
+                self.assertIs(self.images.current(), current)
+                self.assert_consistent(self.images)
+        # filtering out the current one goes back to the start
+        self.images.filter(lambda record: record is not current)
+        self.assertEqual(self.images.setPos, 0)
+        self.assertIsNone(self.images.position(current.path))
+
+    def test_discard(self):
+        self.images.setPos = 100
+        current = self.images.current()
+        before = self.images.paths()
+        gone = [before[5], before[200], '/pics/not-there.jpg']
+        self.assertEqual(self.images.discard(gone), (2, False))
+        self.assertIs(self.images.current(), current)
+        self.assertEqual(self.images.setPos, 99)
+        # the current one going, the next one takes its place
+        self.assertEqual(self.images.discard([current.path, before[0]]), (2, True))
+        self.assertEqual(self.images.path_at(self.images.setPos), before[101])
+        self.assertEqual(self.images.discard([current.path]), (0, False))
+        self.assertEqual(self.images.paths(), [p for p in before if p not in (before[0], before[5], before[200], current.path)])
+        self.assert_consistent(self.images)
+        self.assertEqual(self.images.names_by_dir()['/pics/'], {p[len('/pics/'):] for p in self.images.paths()})
+
+    def test_position(self):
+        for pos in (0, 250, 499):
+            self.assertEqual(self.images.position(self.images.path_at(pos)), pos)
+        self.assertIsNone(self.images.position('/pics/not-there.jpg'))
+        self.images.set_order('random')
+        self.assert_consistent(self.images)
+
+    def test_records_share_directory(self):
+        a, b = self.images[0], self.images[1]
+        self.assertIs(a.dir, b.dir)
+
+    def test_snapshot_restore(self):
+        self.images.remove(self.images[3])
+        self.images.set_order('random')
+        records, order = self.images.snapshot()
+        self.assertEqual(len(records), len(NAMES) - 1)
+        self.assertEqual([records[i].path for i in order.tolist()], self.images.paths())
+
+        dirNames = sorted({record.dir for record in records})
+        dirIndex = np.array([dirNames.index(record.dir) for record in records])
+        restored = ImageSet(seed=1)
+        restored.restore(dirNames, dirIndex, [record.name for record in records],
+                         np.array([record.size for record in records]),
+                         np.array([record.mtime for record in records]),
+                         order, changeType='random', setPos=17)
+        self.assertEqual(restored.paths(), self.images.paths())
+        self.assertEqual(restored.setPos, 17)
+        self.assertEqual(restored.changeType, 'random')
+        self.assertEqual([(r.size, r.mtime) for r in restored], [(r.size, r.mtime) for r in self.images])
+        self.assert_consistent(restored)
+        # carries on like any other set
+        restored.extend(found(['new.jpg']))
+        self.assertEqual(restored.path_at(len(restored) - 1), '/pics/new.jpg')
+
+    def test_restore_clamps_position(self):
+        restored = ImageSet()
+        restored.restore(['/pics/'], np.array([0]), ['a.jpg'], np.array([1]), np.array([1]), [0], setPos=5)
+        self.assertEqual(restored.setPos, 0)
+
+    def test_empty(self):
+        images = ImageSet()
+        self.assertIsNone(images.current())
+        images.set_order('random')
+        self.assertEqual(images.discard(['/x.jpg']), (0, False))
+        self.assertEqual(images.extend([]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from PIL import Image as PILImage
+
+from tiviewlib.JpegQuality import file_quality, read_qtables
+
+
+class JpegQualityTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.image = PILImage.effect_noise((64, 48), 40).convert('RGB')
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def jpeg(self, quality, mode='RGB'):
+        data = io.BytesIO()
+        self.image.convert(mode).save(data, 'JPEG', quality=quality)
+        return data.getvalue()
+
+    def quality_within(self, path, seconds=5):
+        """file_quality(path), failing rather than hanging if it doesn't come back"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(file_quality(path)), daemon=True)
+        thread.start()
+        thread.join(seconds)
+        self.assertFalse(thread.is_alive(), f"file_quality didn't return for {path}")
+        return result[0]
+
+    def test_every_quality(self):
+        for quality in range(1, 101):
+            with self.subTest(quality=quality):
+                self.assertEqual(file_quality(self.write('q.jpg', self.jpeg(quality))), quality)
+
+    def test_greyscale(self):
+        # one table, no chrominance
+        for quality in (30, 75, 95):
+            with self.subTest(quality=quality):
+                path = self.write('grey.jpg', self.jpeg(quality, 'L'))
+                self.assertEqual(len(read_qtables(path)), 1)
+                self.assertEqual(file_quality(path), quality)
+
+    def test_not_a_jpeg(self):
+        data = io.BytesIO()
+        self.image.save(data, 'PNG')
+        self.assertIsNone(file_quality(self.write('a.png', data.getvalue())))
+        self.assertIsNone(file_quality(self.write('empty.jpg', b'')))
+        self.assertIsNone(file_quality(os.path.join(self.dir, 'missing.jpg')))
+
+    def test_truncated(self):
+        whole = self.jpeg(80)
+        dqt = whole.index(b'\xff\xdb')
+        cuts = {
+            'after a marker': b'\xff\xd8\xff\xe0',
+            'half a length': b'\xff\xd8\xff\xe0\x00',
+            'inside a segment being skipped': b'\xff\xd8\xff\xe0\x00\x10JFIF',
+            'inside a DQT segment': whole[:dqt + 20],
+            'inside the image data': whole[:len(whole) // 2],
+        }
+        for name, data in cuts.items():
+            with self.subTest(name):
+                quality = self.quality_within(self.write('cut.jpg', data))
+                if name == 'inside the image data':
+                    # the tables all came before it
+                    self.assertEqual(quality, 80)
+                else:
+                    self.assertIsNone(quality)
+
+    def test_bad_segment_lengths(self):
+        whole = self.jpeg(80)
+        for name, segment in (('zero-length', b'\xff\xe0\x00\x02'),
+                              ('length 0', b'\xff\xe0\x00\x00'), ('length 1', b'\xff\xe0\x00\x01')):
+            with self.subTest(name):
+                path = self.write('bad.jpg', whole[:2] + segment + whole[2:])
+                quality = self.quality_within(path)
+                if name == 'zero-length':
+                    # nothing in it, but a proper segment - reading carries on past it
+                    self.assertEqual(quality, 80)
+                else:
+                    self.assertIsNone(quality)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from tiviewlib.ImageSet import ImageSet
+from tiviewlib.SessionSnapshot import SessionSnapshot
+
+
+class SessionSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name + '/'
+        os.mkdir(self.root + 'sessions')
+        self.session = SessionSnapshot(['/somewhere', False, 'name', None, '.'], rootDir=self.root + 'sessions')
+
+    def image_set(self, sortKey='name'):
+        images = ImageSet(sortKey=sortKey, seed=1)
+        # sizes running the other way to names, and a directory with a non-UTF-8 name
+        images.extend((f'/pics/{dir}/{n:03d}.jpg', 1000 - n, 500 + n) for dir in ('a', 'b', '\udcff') for n in range(100))
+        return images
+
+    def test_save_restore(self):
+        for changeType in ('ordered', 'shuffled', 'random'):
+            with self.subTest(changeType=changeType):
+                images = self.image_set()
+                images.remove(images[10])
+                images.set_order(changeType)
+                images.setPos = 123
+                self.session.save(images, {'/pics/a/': (1, 'scan')}, scanSorted=False)
+                restored = ImageSet(seed=1)
+                header = self.session.load(restored)
+                self.assertEqual(header['dirs'], [['/pics/a/', 1, 'scan']])
+                self.assertIs(header['scanSorted'], False)
+                self.assertEqual(restored.paths(), images.paths())
+                self.assertEqual(restored.setPos, 123)
+                self.assertEqual(restored.changeType, changeType)
+                self.assertEqual([(r.size, r.mtime) for r in restored], [(r.size, r.mtime) for r in images])
+
+    def test_other_signature_not_loaded(self):
+        self.session.save(self.image_set(), {})
+        other = SessionSnapshot(['/somewhere', True, 'name', None, '.'], rootDir=self.root + 'sessions')
+        self.assertIsNone(other.load(ImageSet()))
+        self.assertIsNotNone(self.session.load(ImageSet()))
+
+    def test_unreadable_not_loaded(self):
+        with open(self.session.path, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertIsNone(self.session.load(ImageSet()))
+
+    def test_resorted_by_signature_key(self):
+        # sorted by size with o after starting, the merge later on goes by name
+        images = self.image_set()
+        images.setPos = 42
+        current = images.current().path
+        images.set_sort_key('size')
+        self.session.save(images, {})
+        restored = ImageSet(sortKey='name', seed=1)
+        self.session.load(restored)
+        self.assertEqual(restored.paths(), sorted(images.paths()))
+        self.assertEqual(restored.path_at(restored.setPos), current)
+        self.assertEqual(restored.sortKey, 'name')
+        # so images found later go where a full sort would put them
+        restored.extend([('/pics/a/050.5.jpg', 1, 1)])
+        self.assertEqual(restored.paths(), sorted(restored.paths()))
+
+    def test_check_dirs(self):
+        for name in ('same', 'changed', 'listed', 'listed-changed', 'gone'):
+            os.mkdir(self.root + name)
+        mtimes = {name: os.stat(self.root + name).st_mtime_ns
+                  for name in ('same', 'changed', 'listed', 'listed-changed', 'gone')}
+        header = {'dirs': [[self.root + 'same/', mtimes['same'], 'scan'],
+                           [self.root + 'changed/', mtimes['changed'], 'scan'],
+                           [self.root + 'listed/', mtimes['listed'], 'files'],
+                           [self.root + 'listed-changed/', mtimes['listed-changed'], 'files'],
+                           [self.root + 'gone/', mtimes['gone'], 'scan']]}
+        # mtimes can be coarse, make sure they move
+        time.sleep(0.01)
+        for name in ('changed', 'listed-changed'):
+            with open(self.root + name + '/new.jpg', 'wb'):
+                pass
+            os.utime(self.root + name, ns=(mtimes[name] + 10 ** 9, mtimes[name] + 10 ** 9))
+        os.rmdir(self.root + 'gone')
+
+        unchanged, rescan, refresh, gone = SessionSnapshot.check_dirs(header)
+        self.assertEqual(unchanged, {self.root + 'same/': (mtimes['same'], 'scan'),
+                                     self.root + 'listed/': (mtimes['listed'], 'files')})
+        self.assertEqual(rescan, [self.root + 'changed/'])
+        self.assertEqual(refresh, {self.root + 'listed-changed/': (mtimes['listed-changed'] + 10 ** 9, 'files')})
+        self.assertEqual(gone, {self.root + 'gone/'})
+
+    def test_trim(self):
+        for n in range(3):
+            old = SessionSnapshot([n], rootDir=self.root + 'sessions')
+            old.save(self.image_set(), {})
+            os.utime(old.path, (n, n))
+        with mock.patch('tiviewlib.SessionSnapshot.MAX_SNAPSHOTS', 2):
+            self.session.save(self.image_set(), {})
+        self.assertEqual(len(os.listdir(self.root + 'sessions')), 2)
+        self.assertTrue(os.path.exists(self.session.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
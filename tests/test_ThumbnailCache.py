@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+# kivy without a window, and leaving argv and logging alone, before anything imports it
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_LOG_MODE', 'PYTHON')
+
+from PIL import Image as PILImage
+
+from tiviewlib.ThumbnailCache import ThumbnailCache
+
+
+def open_files():
+    """Files this process has open, where /proc says"""
+    return set(os.path.realpath(f'/proc/self/fd/{fd}') for fd in os.listdir('/proc/self/fd'))
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.cache = ThumbnailCache(cacheDir=os.path.join(self.dir, 'thumbs'), thumbSize=64, workers=1)
+        self.addCleanup(self.cache.pool.shutdown)
+
+    def test_16bit_grey_not_clipped(self):
+        path = os.path.join(self.dir, 'grey16.png')
+        # dark at the top, bright at the bottom
+        img = PILImage.linear_gradient('L').resize((800, 600)).convert('I').point(lambda i: i * 257).convert('I;16')
+        img.save(path)
+        for source in ('generated', 'from the cache'):
+            with self.subTest(source=source):
+                width, height, pixels = self.cache.load(path)
+                thumb = PILImage.frombytes('RGBA', (width, height), pixels)
+                self.assertEqual((width, height), (64, 48))
+                self.assertLess(thumb.getpixel((32, 0))[0], 32)
+                self.assertGreater(thumb.getpixel((32, 47))[0], 200)
+
+    def test_rgba_and_grey(self):
+        for mode in ('RGBA', 'L', 'P'):
+            with self.subTest(mode=mode):
+                path = os.path.join(self.dir, f'{mode}.png')
+                PILImage.new(mode, (100, 200)).save(path)
+                width, height, pixels = self.cache.load(path)
+                self.assertEqual((width, height), (32, 64))
+                self.assertEqual(len(pixels), 32 * 64 * 4)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_files_closed(self):
+        path = os.path.join(self.dir, 'a.jpg')
+        PILImage.new('RGB', (300, 200)).save(path)
+        before = open_files()
+        # generating, then reading back the cached one
+        self.cache.load(path)
+        self.cache.load(path)
+        self.assertEqual(open_files() - before, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
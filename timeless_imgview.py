@@ -1,18 +1,119 @@
 #!/usr/bin/env python
 
+import time
+startupMarks = [('start', time.perf_counter())]
+
+import argparse
 import configparser
-#import logging
+import logging
 import os
-import re
-import subprocess
+import sys
+
+# our own options come out of argv before kivy's parser sees it, what's left is images
+parser = argparse.ArgumentParser(usage='%(prog)s [options] [file|dir ...]', allow_abbrev=False)
+parser.add_argument('-R', '--recursive', action='store_true',
+                    help='also collect images from subdirectories of directories given')
+parser.add_argument('--max-quality', type=int, metavar='Q',
+                    help='only view JPEGs with estimated quality Q or lower, lowest first')
+parser.add_argument('--sort', choices=['name', 'size', 'mtime', 'created', 'dimensions'], default='name',
+                    help='order images by filename (default), file size, modification time, '
+                         'capture date or pixel dimensions')
+parser.add_argument('--files-from', metavar='FILE',
+                    help='also view the images listed in FILE, one per line, in the order listed '
+                         '(- or a lone - argument for stdin). Read while the first ones are already showing')
+parser.add_argument('-0', '--null', action='store_true',
+                    help='paths in --files-from are NUL-separated, as from find -print0')
+parser.add_argument('--startup-timing', action='store_true',
+                    help='print how long each part of startup took, up to the first image on screen, then quit')
+parser.add_argument('--trace', metavar='FILE',
+                    help='on exit, write timings of scanning, reading, decoding, uploading and '
+                         'key-to-image latency to FILE')
+parser.add_argument('--trace-format', choices=['chrome', 'json'], default='chrome',
+                    help='--trace as a Chrome trace (chrome://tracing, ui.perfetto.dev, the default) '
+                         'or plain JSON with a per-stage summary')
+montageArgs = parser.add_argument_group('contact sheets', 'with --montage, no window is opened')
+montageArgs.add_argument('--montage', metavar='FILE',
+                         help='write contact sheets of the images to FILE (.png written a row at a time, '
+                              'or .jpg etc), numbered FILE-001.png... when they take more than one sheet')
+montageArgs.add_argument('--montage-grid', default='8x10', metavar='COLSxROWS',
+                         help='tiles across and down each sheet (default 8x10)')
+montageArgs.add_argument('--montage-tile', type=int, default=256, metavar='PX',
+                         help='size of the square each image is fit into (default 256)')
+montageArgs.add_argument('--montage-workers', type=int, metavar='N',
+                         help='decoding threads (default one per core)')
+montageArgs.add_argument('--no-labels', action='store_true', help='leave filenames off the sheets')
+args, sys.argv[1:] = parser.parse_known_args()
+
+# tiv - is tiv --files-from -
+if '-' in sys.argv[1:]:
+    sys.argv.remove('-')
+    args.files_from = args.files_from or '-'
+fileList = None
+if args.files_from == '-':
+    fileList = sys.stdin.buffer
+elif args.files_from:
+    try:
+        fileList = open(args.files_from, 'rb')
+    except OSError as e:
+        parser.error(f"can't read --files-from {args.files_from}: {e}")
+fileListSeparator = b'\0' if args.null else b'\n'
+
+if args.montage:
+    # before anything imports kivy.core.window, which would open one
+    try:
+        columns, rows = (int(n) for n in args.montage_grid.lower().split('x'))
+    except ValueError:
+        parser.error(f"--montage-grid wants COLSxROWS, like 8x10, not {args.montage_grid}")
+    from kivy.logger import Logger, LOG_LEVELS
+    from tiviewlib.Montage import Montage, collect_images
+    Logger.setLevel(LOG_LEVELS[os.getenv('LOG_LEVEL', 'info')])
+    # Pillow logs every PNG chunk it reads at debug
+    logging.getLogger('PIL').setLevel(Logger.level)
+    paths = collect_images(sys.argv[1:], recursive=args.recursive, sortKey=args.sort, maxQuality=args.max_quality,
+                           fileList=fileList, separator=fileListSeparator)
+    if not paths:
+        sys.exit("No images found")
+    Montage(args.montage, columns, rows, args.montage_tile, labels=not args.no_labels,
+            workers=args.montage_workers).make(paths)
+    sys.exit(0)
+
+def startup_mark(name):
+    startupMarks.append((name, time.perf_counter()))
+
+def process_age():
+    """Seconds since this process was started, None where we can't tell"""
+    try:
+        with open('/proc/self/stat') as f:
+            startTicks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - startTicks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def startup_report():
+    """Where the time went between starting up and the first image on screen"""
+    lines = ["Startup timing:"]
+    age = process_age()
+    if age is not None:
+        # interpreter startup, before our first line ran
+        before = age - (startupMarks[-1][1] - startupMarks[0][1])
+        lines.append(f"{before * 1000:8.0f} ms  python startup")
+    for (name, t), (_, prev) in zip(startupMarks[1:], startupMarks):
+        lines.append(f"{(t - prev) * 1000:8.0f} ms  {name}")
+    total = age if age is not None else startupMarks[-1][1] - startupMarks[0][1]
+    lines.append(f"{total * 1000:8.0f} ms  total to first image")
+    return '\n'.join(lines)
+
 from kivy.app import App
 from kivy.logger import Logger, LOG_LEVELS
 from kivy.core.window import Window
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.floatlayout import FloatLayout
-from kivy.utils import platform
 from tiviewlib.ImageViewer import ImageViewer
+from tiviewlib.DisplayInfo import desktop_size
+from tiviewlib.Trace import trace
 from kivy.config import Config
+startup_mark('imports and window')
 
 # stop the annoying red dot on right-click
 Config.set('input', 'mouse', 'mouse,multitouch_on_demand')
@@ -21,25 +122,6 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
 Logger.setLevel(LOG_LEVELS[LOG_LEVEL])
 Logger.info(f"LOG_LEVEL={LOG_LEVEL}, to force to some level, export LOG_LEVEL=info (or debug,..) before starting.")
 
-deviceRes = [3456, 2234]
-resStr = None
-if platform == 'linux':
-    subProcessCmd = "xdpyinfo  | grep -oP 'dimensions:\s+\K\S+'"
-    ps = subprocess.Popen(subProcessCmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    deviceRes = [int(r) for r in ps.communicate()[0].decode().split('x')]
-elif platform == 'macosx':
-    subProcessCmd = "system_profiler SPDisplaysDataType | grep Resolution | xargs"
-    ps = subprocess.Popen(subProcessCmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    resStr = ps.communicate()[0].decode()
-    resBits = re.findall(r'\d\d\d+', resStr)
-    if (len(resBits) == 0):
-        # for some reason sometimes I don't get a res?
-        deviceRes = [1920,1080]
-    else:
-        deviceRes = [int(resBits[0]), int(resBits[1])]
-
-Logger.debug(f"Got deviceRes={deviceRes}")
-
 # pull this from settings file to keep track of preference from run-to-run
 # TODO: if we pass in --size, don't override that
 config_filename = os.path.expanduser('~/.tiviewrc')
@@ -58,6 +140,30 @@ if config.read(config_filename) == []:
     f.write("feedback-bg = 0.05,0.05,0.05,0.3\n")
     f.write("feedback-fontsize = 32\n")
     f.write("slideshow-interval = 20\n")
+    f.write("pan-speed = 1500\n")
+    f.write("pan-accel = 3000\n")
+    f.write("pan-max-speed = 12000\n")
+    f.write("\n")
+    f.write("[Performance]\n")
+    f.write("image-cache-mb = 1024\n")
+    f.write("prefetch-count = 3\n")
+    f.write("display-res-decode = yes\n")
+    f.write("decode-workers = 4\n")
+    f.write("previews = yes\n")
+    f.write("scan-workers = 8\n")
+    f.write("thumb-size = 256\n")
+    f.write("thumb-cache-mb = 512\n")
+    f.write("thumb-workers = 4\n")
+    f.write("index-workers = 4\n")
+    f.write("tile-cache-mb = 256\n")
+    f.write("tile-disk-mb = 4096\n")
+    f.write("tile-threshold-mp = 32\n")
+    f.write("memory-limit-mb = 2048\n")
+    f.write("low-memory-mb = 512\n")
+    f.write("session-snapshot = yes\n")
+    f.write("undo-history = 50\n")
+    f.write("watch-dirs = yes\n")
+    f.write("watch-poll-seconds = 5\n")
     f.write("\n")
     f.write("[LastRun]\n")
     f.write("lastgeom = 1920x1080+0,0\n")
@@ -65,6 +171,15 @@ if config.read(config_filename) == []:
 config.read(config_filename)
 Logger.debug(f"Got config={config}")
 
+# ask SDL, which has the window up already, else whatever it said last time
+deviceRes = desktop_size(Window)
+if deviceRes is None:
+    try:
+        deviceRes = [int(n) for n in config.get('LastRun', 'device-res').split('x')]
+    except:
+        deviceRes = [1920, 1080]
+Logger.debug(f"Got deviceRes={deviceRes}")
+
 # read size from directory
 try:
     window_geom = config.get('LastRun', f'{os.getcwd()}--geom')
@@ -81,6 +196,7 @@ except:
     Window.size = [1920, 1080]
     Window.left = 0
     Window.top = 0
+startup_mark('config and window geometry')
 
 # hide cursur unless move mouse
 def on_motion(self, etype, me):
@@ -88,23 +204,17 @@ def on_motion(self, etype, me):
     Window.show_cursor = True
 Window.bind(on_motion=on_motion)
 
-# doesn't do anything, but i guess for thumbnails
-class AlbumView(GridLayout):
-    """
-    One day this will be for thumbnails
-    """
-    def __int__(self, **kwargs):
-        super().__init__(**kwargs)
-
-
 class MainWindow(FloatLayout):
     """
     This makes the window
     """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.image_view = ImageViewer(appConfig=config, deviceRes=deviceRes)
+        self.image_view = ImageViewer(appConfig=config, deviceRes=deviceRes, recursive=args.recursive,
+                                      maxQuality=args.max_quality, sortKey=args.sort,
+                                      fileList=fileList, fileListSeparator=fileListSeparator)
         self.add_widget(self.image_view)
+        startup_mark('image list')
 
     def on_enter(self):
         Window.show_cursor = True
@@ -122,16 +232,33 @@ class TimelessImageView(App):
     def build(self):
         return MainWindow()
 
+    def on_start(self):
+        if args.startup_timing:
+            Window.bind(on_flip=self._first_frame)
+        if args.trace:
+            trace.watch_frames(True)
+
+    def on_stop(self):
+        self.root.image_view.save_session()
+
+    def _first_frame(self, window):
+        if self.root.image_view.image.shown is None:
+            # window's up, first image still decoding
+            return
+        Window.unbind(on_flip=self._first_frame)
+        startup_mark('first decode and frame')
+        print(startup_report())
+        self.stop()
+
 
 if __name__ == '__main__':
     TimelessImageView().run()
+    if args.trace:
+        trace.dump(args.trace, args.trace_format)
     Logger.info(f'Writing Configuration into {config_filename}!')
-    if "Retina" in resStr:
-        # iMac27in Retina and mbp16in
-        # for some reason you have to divide window width/height by two, but not the location
-        output_geom = f"{str(int(Window.size[0]/2))}x{str(int(Window.size[1]/2))}+{str(int(Window.left))},{str(int(Window.top))}"
-    else:
-        output_geom = f"{str(Window.size[0])}x{str(Window.size[1])}+{str(Window.left)},{str(Window.top)}"
+    # system_size is in the same units Window.size gets set in at startup, which on
+    # retina macs is half the pixels
+    output_geom = f"{int(Window.system_size[0])}x{int(Window.system_size[1])}+{int(Window.left)},{int(Window.top)}"
     # re-read in case another version overwrote - use fresh ConfigParser to avoid order issues
     fresh_config = configparser.ConfigParser()
     fresh_config.read(config_filename)
@@ -152,19 +279,20 @@ if __name__ == '__main__':
     fresh_config.remove_section('LastRun')
     fresh_config.add_section('LastRun')
 
-    # 1. Always add 'lastgeom' first (the fallback default)
+    # 1. Always add 'lastgeom' first (the fallback default), and the display it was on
     fresh_config.set('LastRun', 'lastgeom', output_geom)
+    fresh_config.set('LastRun', 'device-res', f"{deviceRes[0]}x{deviceRes[1]}")
 
-    # 2. Add the current CWD at the top of the list (after lastgeom)
+    # 2. Add the current CWD at the top of the list (after lastgeom and device-res)
     fresh_config.set('LastRun', current_cwd_key, output_geom)
 
-    # 3. Add remaining entries (up to 48 more to reach max of 50 total)
-    # Skip the current CWD key and 'lastgeom' if they exist in old entries
-    entries_added = 2  # lastgeom and current_cwd_key
+    # 3. Add remaining entries (up to 47 more to reach max of 50 total)
+    # Skip the current CWD key, 'lastgeom' and 'device-res' if they exist in old entries
+    entries_added = 3  # lastgeom, device-res and current_cwd_key
     for key, value in existing_entries:
         if entries_added >= 50:
             break
-        if key != current_cwd_key and key != 'lastgeom':
+        if key not in (current_cwd_key, 'lastgeom', 'device-res'):
             fresh_config.set('LastRun', key, value)
             entries_added += 1
 
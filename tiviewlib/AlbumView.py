@@ -0,0 +1,194 @@
+import math
+import queue
+from collections import OrderedDict
+
+from kivy.clock import Clock
+from kivy.graphics import Color, Line, Rectangle
+from kivy.graphics.texture import Texture
+from kivy.uix.image import Image
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recyclegridlayout import RecycleGridLayout
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+class AlbumCell(RecycleDataViewBehavior, Image):
+    """
+    One thumbnail in the grid. Only as many exist as fit on screen, they
+    get handed new paths as the grid scrolls.
+    """
+
+    def __init__(self, **kwargs):
+        self.album = None
+        self.index = 0
+        self.path = None
+        super().__init__(**kwargs)
+        self.fit_mode = 'contain'
+        with self.canvas.after:
+            self.highlightColor = Color(0.9, 0.9, 0.2, 0)
+            self.highlight = Line(rectangle=(0, 0, 0, 0), width=2)
+        self.bind(pos=self._update_highlight, size=self._update_highlight)
+
+    def _update_highlight(self, *args):
+        self.highlight.rectangle = (self.x + 2, self.y + 2, self.width - 4, self.height - 4)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.album = rv
+        self.index = index
+        self.highlightColor.a = 1 if index == rv.selected else 0
+        super().refresh_view_attrs(rv, index, data)
+        self.texture = rv.thumbnail(self.path)
+
+    def on_touch_down(self, touch):
+        if self.collide_point(*touch.pos) and not touch.is_mouse_scrolling and self.album:
+            self.album.select(self.index)
+            return True
+        return super().on_touch_down(touch)
+
+
+class AlbumView(RecycleView):
+    """
+    Thumbnail grid of the whole image set. Widgets and textures only exist
+    for visible cells; thumbnails come from the on-disk ThumbnailCache.
+    """
+
+    def __init__(self, imageSet=None, thumbnailCache=None, on_select=None, textureCount=512, **kwargs):
+        super().__init__(**kwargs)
+        self.imageSet = imageSet
+        self.thumbnailCache = thumbnailCache
+        self.on_select = on_select
+        self.selected = 0
+        # path -> texture of recently seen thumbnails
+        self.textures = OrderedDict()
+        self.textureCount = textureCount
+        # paths a cell is waiting on
+        self.wanted = set()
+        self.requested = set()
+        # (path, result) from thumbnail workers
+        self.loaded = queue.Queue()
+
+        cellSize = thumbnailCache.thumbSize
+        self.layout = RecycleGridLayout(cols=1, spacing=4, padding=4,
+                                        default_size=(cellSize, cellSize),
+                                        default_size_hint=(None, None),
+                                        size_hint=(1, None))
+        self.layout.bind(minimum_height=self.layout.setter('height'))
+        self.add_widget(self.layout)
+        # goes to the layout manager, so only once it's there
+        self.viewclass = AlbumCell
+        self.bind(width=self._update_cols)
+        self.uploadEvent = None
+
+        # hide the main image underneath
+        with self.canvas.before:
+            Color(0, 0, 0, 1)
+            self.background = Rectangle(pos=self.pos, size=self.size)
+        self.bind(pos=lambda *x: setattr(self.background, 'pos', self.pos),
+                  size=lambda *x: setattr(self.background, 'size', self.size))
+
+    def _update_cols(self, *args):
+        cellSize = self.thumbnailCache.thumbSize + self.layout.spacing[0]
+        self.layout.cols = max(1, int(self.width // cellSize))
+
+    def refresh(self):
+        """Pick up the current order of the image set and jump to the current image"""
+        self.data = [{'path': path} for path in self.imageSet.paths()]
+        self.selected = self.imageSet.setPos
+        self.wanted.clear()
+        if self.uploadEvent is None:
+            self.uploadEvent = Clock.schedule_interval(self._upload_thumbnails, 0)
+        Clock.schedule_once(lambda dt: self.scroll_to_index(self.selected))
+
+    def thumbnail(self, path):
+        """Texture for path if we have one, otherwise ask for it and return None"""
+        texture = self.textures.get(path)
+        if texture is not None:
+            self.textures.move_to_end(path)
+            return texture
+        self.wanted.add(path)
+        if path not in self.requested:
+            self.requested.add(path)
+            self.thumbnailCache.submit(path, self._thumbnail_done, isWanted=lambda p: p in self.wanted)
+        return None
+
+    def _thumbnail_done(self, path, result):
+        # worker thread - just queue it up for the main thread
+        self.loaded.put((path, result))
+
+    def _upload_thumbnails(self, dt):
+        uploaded = {}
+        while True:
+            try:
+                path, result = self.loaded.get_nowait()
+            except queue.Empty:
+                break
+            self.requested.discard(path)
+            if result is None or path not in self.wanted:
+                continue
+            width, height, pixels = result
+            texture = Texture.create(size=(width, height), colorfmt='rgba')
+            texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
+            texture.flip_vertical()
+            self.textures[path] = texture
+            uploaded[path] = texture
+        if not uploaded:
+            return
+        while len(self.textures) > self.textureCount:
+            self.textures.popitem(last=False)
+        for cell in self.layout.children:
+            if cell.path in uploaded:
+                cell.texture = uploaded[cell.path]
+                self.wanted.discard(cell.path)
+        # anything scrolled past before it arrived isn't wanted any more
+        self.wanted = {cell.path for cell in self.layout.children if cell.texture is None}
+
+    def scroll_to_index(self, index):
+        cols = self.layout.cols
+        rows = math.ceil(len(self.data) / cols)
+        if rows <= 1 or self.layout.height <= self.height:
+            return
+        rowHeight = self.layout.height / rows
+        rowTop = (index // cols) * rowHeight
+        # keep the selected row roughly in the middle of the view
+        scrollable = self.layout.height - self.height
+        self.scroll_y = min(1, max(0, 1 - (rowTop - (self.height - rowHeight) / 2) / scrollable))
+
+    def move_selection(self, delta):
+        if not self.data:
+            return
+        self.selected = min(len(self.data) - 1, max(0, self.selected + delta))
+        self.refresh_from_data()
+        self.scroll_to_index(self.selected)
+
+    def move_selection_rows(self, rows):
+        self.move_selection(rows * self.layout.cols)
+
+    def select(self, index=None):
+        """Open the selected (or given) image in the main view"""
+        if index is not None:
+            self.selected = index
+        if self.on_select and 0 <= self.selected < len(self.data):
+            self.on_select(self.data[self.selected]['path'])
+
+    def memory_used(self):
+        """Bytes of thumbnail textures held"""
+        return sum(texture.width * texture.height * 4 for texture in self.textures.values())
+
+    def shrink(self, target):
+        """Drop least recently seen thumbnails, never those on show, until down to target bytes. Returns bytes freed."""
+        freed = 0
+        used = self.memory_used()
+        showing = {cell.path for cell in self.layout.children}
+        for path in list(self.textures):
+            if used - freed <= target:
+                break
+            if path not in showing:
+                texture = self.textures.pop(path)
+                freed += texture.width * texture.height * 4
+        return freed
+
+    def close(self):
+        """Stop loading and let go of the textures while hidden"""
+        if self.uploadEvent is not None:
+            Clock.unschedule(self.uploadEvent)
+            self.uploadEvent = None
+        self.textures.clear()
+        self.wanted.clear()
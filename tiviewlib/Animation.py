@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+
+from PIL import Image as PILImage
+
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from tiviewlib.ImageDecoder import fit_size, to_8bit
+from tiviewlib.Trace import trace
+
+# decoded frames waiting to go up - all the memory an animation holds on to,
+# however many frames the file has
+FRAMES_AHEAD = 4
+# textures taken in turn, so the one being written is never the one on screen
+TEXTURE_RING = 3
+# browsers show frames of 10ms or less (usually meaning 'as fast as you can') at 100ms, so do we
+FAST_FRAME_MS = 10
+DEFAULT_FRAME_MS = 100
+# further behind than this and the timing starts over from now, rather than skipping frames to catch up
+MAX_BEHIND = 0.25
+
+def frame_duration(img):
+    """Seconds the frame img is on should be shown for"""
+    duration = img.info.get('duration') or 0
+    return (duration if duration > FAST_FRAME_MS else DEFAULT_FRAME_MS) / 1000
+
+
+class AnimationPlayer:
+    """
+    Plays an animated GIF, WebP or PNG by calling show(texture) for each
+    frame as it comes due. Frames are decoded one at a time on a thread of
+    its own, only FRAMES_AHEAD ahead of playback, and go up into a small ring
+    of textures. Frame times are kept against the clock rather than added up
+    from when each frame happened to show, so they don't drift, and a frame
+    whose time has passed before it could go up is skipped. The first
+    frame is expected to be on screen already (it's what the cache decoded),
+    so playback starts with it.
+    """
+
+    def __init__(self, path, maxSize, show):
+        self.path = path
+        self.maxSize = maxSize
+        self.show = show
+        self.frames = queue.Queue(maxsize=FRAMES_AHEAD)
+        self.textures = []
+        self.nextTexture = 0
+        # when the next frame is due on the perf_counter clock
+        self.due = time.perf_counter()
+        self.stopping = threading.Event()
+        self.event = Clock.schedule_once(self._tick, 0)
+        threading.Thread(target=self._decode, name='Animation', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+        # let go of waiting frames, and of the decoder if it's blocked putting one
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                break
+        self.textures = []
+
+    def memory_used(self):
+        """Bytes of decoded frames waiting to go up, and of the texture ring"""
+        with self.frames.mutex:
+            queued = sum(len(data[1]) for data, duration in self.frames.queue if data is not None)
+        return queued + sum(texture.width * texture.height * 4 for texture in self.textures)
+
+    def shrink(self, target):
+        """
+        Nothing to give up, FRAMES_AHEAD frames and the ring are what playing
+        takes and they're bounded already. Returns bytes freed.
+        """
+        return 0
+
+    def _put(self, frame):
+        while not self.stopping.is_set():
+            try:
+                self.frames.put(frame, timeout=0.25)
+                return
+            except queue.Full:
+                pass
+
+    def _decode(self):
+        # decoder thread, round the frames until stopped
+        try:
+            with PILImage.open(self.path) as img:
+                frameNum = 0
+                firstPass = True
+                while not self.stopping.is_set():
+                    try:
+                        img.seek(frameNum)
+                    except EOFError:
+                        if frameNum == 0:
+                            return
+                        frameNum = 0
+                        firstPass = False
+                        continue
+                    if firstPass and frameNum == 0:
+                        # showing already, only how long for is wanted
+                        self._put((None, frame_duration(img)))
+                        frameNum += 1
+                        continue
+                    with trace.span('frame decode', frameNum):
+                        # PIL gives each frame with the ones before composited in
+                        frame = to_8bit(img)
+                        if self.maxSize:
+                            target = fit_size(frame.size, self.maxSize)
+                            factor = min(frame.size[0] // target[0], frame.size[1] // target[1])
+                            if factor >= 2:
+                                frame = frame.reduce(factor)
+                        if frame.mode != 'RGBA':
+                            frame = frame.convert('RGBA')
+                        data = (frame.size, frame.tobytes())
+                    self._put((data, frame_duration(img)))
+                    frameNum += 1
+        except Exception as e:
+            Logger.warning(f"Animation: stopped playing {self.path} - {e}")
+
+    def _texture(self, size):
+        if len(self.textures) < TEXTURE_RING or tuple(self.textures[self.nextTexture].size) != size:
+            texture = Texture.create(size=size, colorfmt='rgba')
+            texture.flip_vertical()
+            if len(self.textures) < TEXTURE_RING:
+                self.textures.append(texture)
+            else:
+                self.textures[self.nextTexture] = texture
+        texture = self.textures[self.nextTexture]
+        self.nextTexture = (self.nextTexture + 1) % TEXTURE_RING
+        return texture
+
+    def _tick(self, dt):
+        self.event = None
+        now = time.perf_counter()
+        if now - self.due > MAX_BEHIND:
+            # held up a while (decoder or window busy), carry on from here rather than race to catch up
+            self.due = now
+        # the frame that should be up now, skipping any whose time has been and gone
+        data = None
+        while self.due <= now:
+            try:
+                frame, duration = self.frames.get_nowait()
+            except queue.Empty:
+                # decoder's behind, look again next frame
+                trace.count('animation stall')
+                break
+            if data is not None:
+                trace.count('animation frames skipped')
+            data = frame or data
+            self.due += duration
+        if data is not None:
+            size, pixels = data
+            with trace.span('frame upload', self.path):
+                texture = self._texture(size)
+                texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
+            self.show(texture)
+            trace.count('animation frames')
+        self.event = Clock.schedule_once(self._tick, max(0, self.due - time.perf_counter()))
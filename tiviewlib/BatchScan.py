@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+def worker_pool(workers=None, name='Worker'):
+    """
+    Pool for per-file work over a whole set of images - decoding, hashing,
+    reading headers - one thread per core by default. Threads rather than
+    processes: Pillow and numpy let go of the GIL while they work, and by
+    the time the viewer wants a pool it has decode, scan and watcher threads
+    running, which a forked child could inherit held locks from.
+    """
+    return ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix=name)
+
+class BatchScan:
+    """
+    Runs work(path) over a whole list of paths in a worker_pool, using
+    (and filling) the per-file cache in the metadata index under kind.
+    Poll progress/finished from the main thread; results maps path to
+    whatever work returned. Subclasses set kind, and work as a module-level
+    function wrapped in staticmethod. It runs on several threads at once.
+    """
+    kind = None
+    work = None
+
+    def __init__(self, paths, metadataIndex, workers=None):
+        self.paths = list(paths)
+        self.metadataIndex = metadataIndex
+        self.workers = workers
+        self.results = {}
+        self.progress = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f'BatchScan-{self.kind}', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            stats = {}
+            for path in self.paths:
+                try:
+                    st = os.stat(path)
+                    stats[path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    self.results[path] = None
+            self.results.update(self.metadataIndex.cached_values(self.kind, stats))
+            self.progress = len(self.results)
+
+            todo = [path for path in stats if path not in self.results]
+            Logger.info(f"BatchScan: {self.kind} - {len(self.results)} cached, {len(todo)} to read")
+            if todo:
+                rows = []
+                with worker_pool(self.workers, f'BatchScan-{self.kind}') as pool:
+                    for path, value in zip(todo, pool.map(self.work, todo)):
+                        self.results[path] = value
+                        rows.append((path, *stats[path], value))
+                        self.progress += 1
+                self.metadataIndex.store_values(self.kind, rows)
+        except Exception as e:
+            Logger.error(f"BatchScan: {self.kind} failed - {e}")
+        finally:
+            self.done.set()
+
+    def finished(self):
+        return self.done.is_set()
@@ -0,0 +1,193 @@
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+from tiviewlib.Trace import trace
+
+# animations (gif, webp, apng as png) play a frame at a time, see Animation
+IMAGE_EXTENSIONS = ("jpeg", "jpg", "png", "tif", "tiff", "gif", "webp", "jp2", "j2k")
+
+class DirScanner:
+    """
+    Scans directories for images with os.scandir in a thread pool, handing
+    back each directory's (sorted) images as soon as it is read, as
+    (path, size, mtime) from the entry's stat. With recursive,
+    subdirectories are queued into the same pool as found, except those in
+    skip. files are stat'ed in the pool too and come back as one batch.
+    fileList is a binary stream of separator-terminated paths (find -print
+    or -print0), read a chunk at a time as it arrives. Its images are stat'ed
+    in the pool but handed back in the order listed.
+    """
+
+    def __init__(self, dirs, recursive=False, workers=8, extensions=IMAGE_EXTENSIONS, skip=(), files=(),
+                 fileList=None, separator=b'\n'):
+        self.recursive = recursive
+        self.extensions = extensions
+        self.skip = set(skip)
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='DirScanner')
+        # lists of (path, size, mtime), one per directory scanned
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        # hold one count ourselves so fast scans can't finish before all are submitted
+        self.outstanding = 1
+        self.dirsScanned = 0
+        # dir/ -> its mtime_ns from just before it was read
+        self.dirMtimes = {}
+        self.done = threading.Event()
+        for dirName in dirs:
+            self._submit(dirName)
+        if files:
+            with self.lock:
+                self.outstanding += 1
+            self.pool.submit(self._stat_files, list(files))
+        # paths read from fileList so far, and its stat batches finished out of order
+        self.listed = 0
+        self.listBatches = {}
+        self.nextListBatch = 0
+        if fileList is not None:
+            with self.lock:
+                self.outstanding += 1
+            # its own thread, it can sit waiting on a slow pipe for as long as it likes
+            threading.Thread(target=self._read_list, args=(fileList, separator), name='DirScanner-list',
+                             daemon=True).start()
+        self._release()
+
+    def _submit(self, dirName):
+        # append a / for dirName
+        if dirName[-1] != '/':
+            dirName += '/'
+        with self.lock:
+            self.outstanding += 1
+        self.pool.submit(self._scan, dirName)
+
+    def _scan(self, dirName):
+        start = time.perf_counter()
+        found = []
+        try:
+            # taken first, so anything changing while we read shows as changed next time
+            mtime = os.stat(dirName).st_mtime_ns
+            with os.scandir(dirName) as it:
+                for entry in it:
+                    # endswith can be a string or tuple of strings
+                    if entry.name.lower().endswith(self.extensions):
+                        try:
+                            st = entry.stat()
+                            found.append((dirName + entry.name, st.st_size, st.st_mtime))
+                        except OSError:
+                            # dangling symlink and the like
+                            continue
+                    elif self.recursive and entry.is_dir(follow_symlinks=False) \
+                            and dirName + entry.name + '/' not in self.skip:
+                        self._submit(dirName + entry.name)
+        except OSError as e:
+            Logger.error(f"Couldn't collect images from {dirName} - {e}")
+        else:
+            self.dirMtimes[dirName] = mtime
+        found.sort()
+        trace.add('scan', start, time.perf_counter() - start, dirName)
+        self.results.put(found)
+        with self.lock:
+            self.dirsScanned += 1
+        self._release()
+
+    def _stat(self, paths):
+        start = time.perf_counter()
+        found = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                found.append((path, st.st_size, st.st_mtime))
+            except OSError:
+                continue
+        trace.add('stat files', start, time.perf_counter() - start, f"{len(paths)} files")
+        return found
+
+    def _stat_files(self, paths):
+        self.results.put(self._stat(paths))
+        self._release()
+
+    def _read_list(self, fileList, separator):
+        # a few batches in the pool at once, not the whole list's worth
+        slots = threading.Semaphore(self.workers * 2)
+        rest = b''
+        batchNum = 0
+        try:
+            while True:
+                # whatever has arrived, up to 64k, rather than waiting for a full buffer
+                chunk = fileList.read1(65536) if hasattr(fileList, 'read1') else fileList.read(65536)
+                if not chunk:
+                    lines = [rest] if rest else []
+                else:
+                    lines = (rest + chunk).split(separator)
+                    rest = lines.pop()
+                paths = [os.fsdecode(line.rstrip(b'\r') if separator == b'\n' else line) for line in lines]
+                paths = [path for path in paths if path.lower().endswith(self.extensions)]
+                if paths:
+                    self.listed += len(paths)
+                    slots.acquire()
+                    with self.lock:
+                        self.outstanding += 1
+                    future = self.pool.submit(self._stat, paths)
+                    future.add_done_callback(lambda f, n=batchNum: self._list_batch_done(n, f, slots))
+                    batchNum += 1
+                if not chunk:
+                    break
+        except (OSError, ValueError) as e:
+            Logger.error(f"Couldn't read the list of images - {e}")
+        finally:
+            if fileList is not sys.stdin.buffer:
+                fileList.close()
+            self._release()
+
+    def _list_batch_done(self, batchNum, future, slots):
+        slots.release()
+        try:
+            found = future.result()
+        except Exception as e:
+            Logger.error(f"Couldn't stat listed images - {e}")
+            found = []
+        with self.lock:
+            # keep to list order, however the pool finished them
+            self.listBatches[batchNum] = found
+            while self.nextListBatch in self.listBatches:
+                self.results.put(self.listBatches.pop(self.nextListBatch))
+                self.nextListBatch += 1
+        self._release()
+
+    def _release(self):
+        with self.lock:
+            self.outstanding -= 1
+            finished = self.outstanding == 0
+        if finished:
+            self.done.set()
+            self.pool.shutdown(wait=False)
+
+    def wait_for_first(self):
+        """Block until some directory had images (or everything is scanned)"""
+        batches = []
+        while not self.done.is_set() or not self.results.empty():
+            try:
+                found = self.results.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            batches.append(found)
+            if found:
+                break
+        return batches
+
+    def get_batches(self):
+        """Everything scanned since last asked, without blocking"""
+        batches = []
+        while True:
+            try:
+                batches.append(self.results.get_nowait())
+            except queue.Empty:
+                return batches
+
+    def finished(self):
+        return self.done.is_set() and self.results.empty()
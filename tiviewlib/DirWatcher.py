@@ -0,0 +1,247 @@
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+from kivy.logger import Logger
+from tiviewlib.DirScanner import IMAGE_EXTENSIONS
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+# files show up once they're finished being written, or renamed into place
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+# a file modified this recently may still be being written, polling leaves it for next time
+SETTLE_SECONDS = 2
+
+def _inotify():
+    """libc with the inotify calls, None where there isn't one"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirWatcher:
+    """
+    Watches directories for images arriving and going, with inotify where
+    there is one and by polling directory mtimes every pollSeconds where there
+    isn't (or a directory couldn't get a watch). With recursive, directories
+    created below are watched and read too. Changes come back from
+    get_changes() on the main thread as (added [(path, size, mtime)],
+    removed {path}); applying the same change twice is harmless, so races
+    with the viewer's own moves and with the first scan don't matter.
+
+    dirMtimes is {dir/: mtime_ns from just before it was scanned}. Directories
+    that changed since then are read again once watched, and knownNames()
+    gives what was in them - it's called from the watcher thread.
+    """
+
+    def __init__(self, dirMtimes, knownNames, recursive=False, pollSeconds=5, extensions=IMAGE_EXTENSIONS):
+        self.dirMtimes = dict(dirMtimes)
+        self.knownNames = knownNames
+        self.recursive = recursive
+        self.pollSeconds = pollSeconds
+        self.extensions = extensions
+        # dir/ -> image names in it, only kept for directories we've had to read
+        self.names = None
+        self.changes = queue.Queue()
+        self.libc = _inotify()
+        self.fd = None
+        # watch descriptor -> dir/, and dir/ -> watch descriptor
+        self.wdDirs = {}
+        self.dirWds = {}
+        # directories without a watch, and their mtime when last read
+        self.polled = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='DirWatcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def get_changes(self):
+        """Everything noticed since last asked, without blocking, latest news about a path winning"""
+        added = {}
+        removed = set()
+        while True:
+            try:
+                kind, item = self.changes.get_nowait()
+            except queue.Empty:
+                return list(added.values()), removed
+            if kind == 'add':
+                removed.discard(item[0])
+                added[item[0]] = item
+            else:
+                added.pop(item, None)
+                removed.add(item)
+
+    def _run(self):
+        try:
+            if self.libc is not None:
+                self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+                if self.fd < 0:
+                    Logger.warning(f"DirWatcher: no inotify ({os.strerror(ctypes.get_errno())}), polling instead")
+                    self.fd = None
+            for dirName, mtime in self.dirMtimes.items():
+                self._watch(dirName, mtime)
+            Logger.info(f"DirWatcher: watching {len(self.dirWds)} directories, polling {len(self.polled)}")
+            nextPoll = time.monotonic() + self.pollSeconds
+            while not self.stopping.is_set():
+                if self.fd is not None:
+                    if select.select([self.fd], [], [], self.pollSeconds)[0]:
+                        self._read_events()
+                else:
+                    self.stopping.wait(self.pollSeconds)
+                if self.polled and time.monotonic() >= nextPoll:
+                    self._poll()
+                    nextPoll = time.monotonic() + self.pollSeconds
+        except Exception as e:
+            Logger.error(f"DirWatcher: stopped watching - {e}")
+        finally:
+            if self.fd is not None:
+                os.close(self.fd)
+
+    def _watch(self, dirName, mtime=None):
+        """Start watching dirName, reading it again if it isn't as it was at mtime"""
+        if dirName in self.dirWds or dirName in self.polled:
+            return
+        if self.fd is not None:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirName), WATCH_MASK)
+            if wd >= 0:
+                self.wdDirs[wd] = dirName
+                self.dirWds[dirName] = wd
+            else:
+                # usually fs.inotify.max_user_watches used up
+                Logger.warning(f"DirWatcher: can't watch {dirName} ({os.strerror(ctypes.get_errno())}), polling it")
+        try:
+            current = os.stat(dirName).st_mtime_ns
+        except OSError:
+            current = None
+        if dirName not in self.dirWds:
+            self.polled[dirName] = mtime
+        if current != mtime:
+            self._resync(dirName)
+
+    def _forget(self, dirName):
+        """dirName (and with it everything below) is gone, and so are its images"""
+        for gone in [d for d in list(self.dirWds) + list(self.polled) if d.startswith(dirName)]:
+            wd = self.dirWds.pop(gone, None)
+            if wd is not None:
+                self.wdDirs.pop(wd, None)
+                self.libc.inotify_rm_watch(self.fd, wd)
+            self.polled.pop(gone, None)
+            for name in self._names(gone):
+                self.changes.put(('remove', gone + name))
+            self.names.pop(gone, None)
+
+    def _names(self, dirName):
+        if self.names is None:
+            # what the viewer has, once we first need to tell what's new
+            self.names = self.knownNames()
+        return self.names.setdefault(dirName, set())
+
+    def _resync(self, dirName):
+        """Read dirName again and report the difference. False if some files were too new to trust yet."""
+        settled = True
+        names = self._names(dirName)
+        found = {}
+        subDirs = []
+        try:
+            with os.scandir(dirName) as it:
+                for entry in it:
+                    if entry.name.lower().endswith(self.extensions):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        if entry.name not in names and dirName in self.polled \
+                                and time.time() - st.st_mtime < SETTLE_SECONDS:
+                            settled = False
+                            continue
+                        found[entry.name] = (dirName + entry.name, st.st_size, st.st_mtime)
+                    elif self.recursive and entry.is_dir(follow_symlinks=False):
+                        subDirs.append(dirName + entry.name + '/')
+        except OSError:
+            self._forget(dirName)
+            return True
+        for name in names.difference(found):
+            self.changes.put(('remove', dirName + name))
+        for name in found.keys() - names:
+            self.changes.put(('add', found[name]))
+        names.clear()
+        names.update(found)
+        for subDir in subDirs:
+            self._watch(subDir)
+        return settled
+
+    def _poll(self):
+        for dirName, mtime in list(self.polled.items()):
+            try:
+                current = os.stat(dirName).st_mtime_ns
+            except OSError:
+                self._forget(dirName)
+                continue
+            if current != mtime and self._resync(dirName) and dirName in self.polled:
+                self.polled[dirName] = current
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # lost track, so read everything again
+                Logger.warning("DirWatcher: too many changes at once, re-reading watched directories")
+                for dirName in list(self.dirWds):
+                    self._resync(dirName)
+                continue
+            dirName = self.wdDirs.get(wd)
+            if dirName is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self._forget(dirName)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                    self._watch(dirName + name + '/')
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget(dirName + name + '/')
+            elif not name.lower().endswith(self.extensions):
+                continue
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                try:
+                    st = os.stat(dirName + name)
+                except OSError:
+                    continue
+                if self.names is not None:
+                    self._names(dirName).add(name)
+                self.changes.put(('add', (dirName + name, st.st_size, st.st_mtime)))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if self.names is not None:
+                    self._names(dirName).discard(name)
+                self.changes.put(('remove', dirName + name))
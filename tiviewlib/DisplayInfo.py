@@ -0,0 +1,42 @@
+import ctypes
+import ctypes.util
+import os
+import sys
+
+from kivy.logger import Logger
+
+class _SDLDisplayMode(ctypes.Structure):
+    _fields_ = [('format', ctypes.c_uint32), ('w', ctypes.c_int), ('h', ctypes.c_int),
+                ('refresh_rate', ctypes.c_int), ('driverdata', ctypes.c_void_p)]
+
+def _sdl_library():
+    """The SDL2 library kivy's window runs on, None if we can't find it"""
+    if sys.platform == 'linux':
+        # kivy's wheels bundle a renamed copy, so ask what's actually mapped in
+        with open('/proc/self/maps') as maps:
+            for line in maps:
+                fields = line.split(None, 5)
+                if len(fields) == 6 and os.path.basename(fields[5].strip()).startswith('libSDL2-'):
+                    return ctypes.CDLL(fields[5].strip())
+        return None
+    path = ctypes.util.find_library('SDL2')
+    return ctypes.CDLL(path) if path else None
+
+def desktop_size(window):
+    """
+    Desktop resolution of the main display in pixels, from the SDL2 kivy
+    has already initialised - no subprocesses. None if it can't say.
+    """
+    try:
+        sdl = _sdl_library()
+        if sdl is None:
+            return None
+        mode = _SDLDisplayMode()
+        if sdl.SDL_GetDesktopDisplayMode(0, ctypes.byref(mode)) != 0 or mode.w <= 0:
+            return None
+        # SDL counts in points on high-dpi macs, the window knows the pixels per point
+        density = window.size[0] / window.system_size[0] if window.system_size[0] else 1
+        return [int(mode.w * density), int(mode.h * density)]
+    except Exception as e:
+        Logger.debug(f"DisplayInfo: no desktop size from SDL - {e}")
+        return None
@@ -0,0 +1,111 @@
+import numpy as np
+from PIL import Image as PILImage
+from tiviewlib.BatchScan import BatchScan
+from tiviewlib.ImageDecoder import to_8bit
+
+# near-duplicate when pHashes are at most this many bits apart (and dHashes twice that)
+DUP_DISTANCE = 4
+
+# DCT-II basis for the 32x32 pHash transform
+_N = 32
+DCT_MATRIX = np.cos(np.pi * (2 * np.arange(_N)[None, :] + 1) * np.arange(_N)[:, None] / (2 * _N))
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def image_hashes(path):
+    """
+    [dHash, pHash] of an image as 64 bit ints, from a decode only a few
+    times bigger than the 32x32 the hashes need. None if unreadable.
+    """
+    try:
+        with PILImage.open(path) as img:
+            if img.mode.startswith('I'):
+                img = to_8bit(img)
+            # draft()s JPEGs down to 1/8 scale straight out of the DCT, reduce()s the rest
+            img.thumbnail((_N * 2, _N * 2))
+            img = img.convert('L')
+            small = np.asarray(img.resize((_N, _N), PILImage.BILINEAR), dtype=np.float64)
+            grad = np.asarray(img.resize((9, 8), PILImage.BILINEAR), dtype=np.int16)
+    except Exception:
+        return None
+    # dHash: is each pixel brighter than its left neighbour
+    dhash = _bits_to_int(grad[:, 1:] > grad[:, :-1])
+    # pHash: lowest 8x8 frequencies against their median, DC term left out of the median
+    low = (DCT_MATRIX @ small @ DCT_MATRIX.T)[:8, :8].ravel()
+    phash = _bits_to_int(low > np.median(low[1:]))
+    return [dhash, phash]
+
+
+class HashScan(BatchScan):
+    """Perceptual hashes of every path, for finding duplicates"""
+    kind = 'hashes'
+    work = staticmethod(image_hashes)
+
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(x):
+        return _POPCOUNT8[x.view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1)
+
+def group_duplicates(dhashes, phashes, maxDistance=DUP_DISTANCE):
+    """
+    Lists of indexes whose hashes are near-duplicates of each other, two or
+    more to a group, groups in order of their first member.
+
+    Multi-index hamming lookup: the 64 bits are cut into maxDistance + 1
+    chunks, and any two hashes within maxDistance bits must agree exactly
+    on at least one chunk. So only hashes sharing a chunk value get
+    compared, and those comparisons are vectorized per bucket.
+    """
+    dhashes = np.asarray(dhashes, dtype=np.uint64)
+    phashes = np.asarray(phashes, dtype=np.uint64)
+    parent = list(range(len(phashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    # identical hashes (straight copies, blank frames...) get joined up front,
+    # so the buckets below only ever see one of each
+    pairs = np.stack([dhashes, phashes], axis=1)
+    unique, first, inverse = np.unique(pairs, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    for i, u in enumerate(inverse):
+        if first[u] != i:
+            union(first[u], i)
+    dUnique, pUnique = unique[:, 0], unique[:, 1]
+
+    bounds = np.linspace(0, 64, maxDistance + 2).astype(int)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        keys = (pUnique >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(keys, kind='stable')
+        sortedKeys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        shared = ends - starts > 1
+        for start, end in zip(starts[shared], ends[shared]):
+            members = order[start:end]
+            # in blocks so one huge bucket can't build a huge matrix
+            for block in range(0, len(members), 512):
+                rows = members[block:block + 512]
+                close = (_popcount(pUnique[rows, None] ^ pUnique[None, members]) <= maxDistance) & \
+                        (_popcount(dUnique[rows, None] ^ dUnique[None, members]) <= maxDistance * 2)
+                for i, j in zip(*np.nonzero(close)):
+                    if rows[i] < members[j]:
+                        union(first[rows[i]], first[members[j]])
+
+    groups = {}
+    for i in range(len(parent)):
+        groups.setdefault(find(i), []).append(i)
+    return [members for root, members in sorted(groups.items()) if len(members) > 1]
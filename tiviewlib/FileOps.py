@@ -0,0 +1,193 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import shutil
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+# cross-device moves and copies go this much at a time, checking for undo in between
+COPY_CHUNK = 8 * 1024 * 1024
+
+# renameat2(2) arguments
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+class OpCancelled(Exception):
+    pass
+
+def _find_renameat2():
+    """libc's renameat2, None where there isn't one"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+
+_renameat2 = _find_renameat2()
+
+def rename_noreplace(src, dest):
+    """
+    os.rename(), but raising FileExistsError rather than replacing dest if
+    something is already there, however late it turned up
+    """
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dest), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        # EINVAL is a filesystem without RENAME_NOREPLACE
+        if err not in (errno.EINVAL, errno.ENOSYS):
+            raise OSError(err, os.strerror(err), src, None, dest)
+    # a link can't replace anything either, but not every filesystem has them
+    try:
+        os.link(src, dest, follow_symlinks=False)
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS):
+            raise
+    else:
+        os.remove(src)
+        return
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, "already exists", dest)
+    os.rename(src, dest)
+
+
+def copy_file(src, dest, cancelled=None):
+    """
+    Copy src to dest a chunk at a time. dest only appears once complete, so
+    nothing ever sees half a file. Raises OpCancelled if cancelled() says so.
+    """
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, "already exists", dest)
+    tmpPath = f"{dest}.tiv-part"
+    try:
+        with open(src, 'rb') as fin, open(tmpPath, 'xb') as fout:
+            while True:
+                if cancelled is not None and cancelled():
+                    raise OpCancelled()
+                chunk = fin.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                fout.write(chunk)
+        shutil.copystat(src, tmpPath)
+        rename_noreplace(tmpPath, dest)
+    except BaseException:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+def move_file(src, dest, cancelled=None):
+    """rename() if src and dest are on the same filesystem, else copy then remove src. Never replaces dest."""
+    try:
+        rename_noreplace(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file(src, dest, cancelled)
+        os.remove(src)
+
+
+class FileOp:
+    """
+    A move or copy of src into destDir. recordIndex and pos say where a
+    moved image was in the ImageSet, to put it back on failure or undo.
+    state goes queued -> done/failed/cancelled, then undone or undo-failed.
+    """
+    __slots__ = ('kind', 'src', 'destDir', 'dest', 'recordIndex', 'pos', 'state', 'error', 'cancelled')
+
+    def __init__(self, kind, src, destDir, recordIndex=None, pos=0):
+        self.kind = kind
+        self.src = src
+        self.destDir = destDir
+        self.dest = os.path.join(destDir, os.path.basename(src))
+        self.recordIndex = recordIndex
+        self.pos = pos
+        self.state = 'queued'
+        self.error = None
+        self.cancelled = False
+
+
+class FileOpQueue:
+    """
+    Runs FileOps one at a time, in the order given, on a worker thread so the
+    viewer never waits on the disk. Poll finished() from the main thread for
+    (op, 'do' or 'undo') as they complete. The last history ops can be
+    undone, newest first.
+    """
+
+    def __init__(self, history=50):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='FileOps')
+        self.history = deque(maxlen=history)
+        self.completed = queue.Queue()
+        # submitted but not yet handed back by finished(), main thread only
+        self.outstanding = 0
+
+    def submit(self, op):
+        self.history.append(op)
+        self.outstanding += 1
+        self.pool.submit(self._do, op)
+
+    def undo(self):
+        """Take back the newest op that can be. Returns it, or None if there's nothing to undo."""
+        while self.history:
+            op = self.history.pop()
+            if op.state in ('failed', 'cancelled'):
+                continue
+            # one still queued or mid-copy stops where it is, then the undo runs after it
+            op.cancelled = True
+            self.outstanding += 1
+            self.pool.submit(self._undo, op)
+            return op
+        return None
+
+    def _do(self, op):
+        if op.cancelled:
+            op.state = 'cancelled'
+        else:
+            try:
+                if op.kind == 'move':
+                    move_file(op.src, op.dest, lambda: op.cancelled)
+                else:
+                    copy_file(op.src, op.dest, lambda: op.cancelled)
+                op.state = 'done'
+            except OpCancelled:
+                op.state = 'cancelled'
+            except Exception as e:
+                Logger.error(f"FileOps: couldn't {op.kind} {op.src} to {op.destDir} - {e}")
+                op.error = e
+                op.state = 'failed'
+        self.completed.put((op, 'do'))
+
+    def _undo(self, op):
+        if op.state == 'done':
+            try:
+                if op.kind == 'move':
+                    move_file(op.dest, op.src)
+                else:
+                    os.remove(op.dest)
+                op.state = 'undone'
+            except Exception as e:
+                Logger.error(f"FileOps: couldn't undo {op.kind} of {op.src} - {e}")
+                op.error = e
+                op.state = 'undo-failed'
+        self.completed.put((op, 'undo'))
+
+    def finished(self):
+        """(op, action) for everything completed since last asked, without blocking"""
+        done = []
+        while True:
+            try:
+                done.append(self.completed.get_nowait())
+            except queue.Empty:
+                self.outstanding -= len(done)
+                return done
+
+    def idle(self):
+        return self.outstanding == 0
@@ -0,0 +1,325 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from tiviewlib.ImageDecoder import decode_preview, decode_rgba
+from tiviewlib.Trace import trace
+
+# the image wanted on screen now goes ahead of anything being read ahead,
+# and a quick preview of it ahead of that
+PREVIEW, WANTED, PREFETCH = -1, 0, 1
+
+class CacheEntry:
+    """
+    A decoded texture, and the size of the file it came from. For an
+    animation, the texture is its first frame.
+    """
+    __slots__ = ('texture', 'fullSize', 'animated')
+
+    def __init__(self, texture, fullSize=None, animated=False):
+        self.texture = texture
+        self.fullSize = tuple(fullSize) if fullSize else tuple(texture.size)
+        self.animated = animated
+
+    @property
+    def reduced(self):
+        return tuple(self.texture.size) != self.fullSize
+
+    @property
+    def nbytes(self):
+        # textures are uploaded as rgba ubyte
+        return self.texture.width * self.texture.height * 4
+
+
+class DecodeJob:
+    """A decode queued or running for the cache, and who wants to hear when it's uploaded"""
+    __slots__ = ('path', 'kind', 'priority', 'state', 'callbacks', 'started', 'result')
+
+    def __init__(self, path, kind, priority):
+        self.path = path
+        # 'display', 'full' resolution or 'preview'
+        self.kind = kind
+        self.priority = priority
+        # queued -> decoding -> decoded
+        self.state = 'queued'
+        self.callbacks = []
+        self.started = time.monotonic()
+        self.result = None
+
+
+class ImageCache:
+    """
+    Decoded textures keyed by image path. Holds prefetchCount images on each
+    side of setPos and evicts least-recently-used entries once the total
+    texture size goes over budgetMB. With a decodeSize, images are decoded
+    only as big as needed to fit in it, and upgraded to full resolution on
+    request. With previews, an image asked for that isn't cached gets a
+    quick rough version (see decode_preview) decoded ahead of it.
+
+    Decoding happens on workers threads (Pillow lets go of the GIL while it
+    works), the image wanted on screen ahead of prefetches. Finished RGBA
+    buffers go straight into Texture.blit_buffer on the main thread, one
+    upload a frame, so the render thread never decodes anything.
+    """
+
+    def __init__(self, budgetMB=1024, prefetchCount=3, decodeSize=None, workers=4, previews=True):
+        self.budget = int(budgetMB * 1024 * 1024)
+        self.prefetchCount = prefetchCount
+        self.decodeSize = decodeSize
+        self.previews = previews
+        # path -> CacheEntry, oldest first
+        self.entries = OrderedDict()
+        # path -> DecodeJob not uploaded yet
+        self.pending = {}
+        # path -> DecodeJob of a full resolution load
+        self.upgrading = {}
+        # path -> DecodeJob of a preview, they're shown but never cached
+        self.previewing = {}
+        self.tables = {'display': self.pending, 'full': self.upgrading, 'preview': self.previewing}
+        self.bytesUsed = 0
+        # decoded buffers waiting for upload, added to from the decode threads
+        self.decodedBytes = 0
+        self.decodedLock = threading.Lock()
+        # seconds from asking for a load to having it, running average
+        self.loadTime = 0.25
+        # (priority, sequence, job), a job can be in here twice once it's wanted sooner
+        self.jobs = queue.PriorityQueue()
+        # previews have a thread to themselves, a few ms each is no good stuck behind whole decodes
+        self.previewJobs = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.decoded = queue.Queue()
+        # wanted decodes running, prefetches hold off until there are none
+        self.wantedDecoding = 0
+        self.wantedDone = threading.Condition()
+        self.uploadEvent = None
+        for n in range(workers):
+            threading.Thread(target=self._work, args=(self.jobs,), name=f'ImageDecode-{n}', daemon=True).start()
+        if previews:
+            threading.Thread(target=self._work, args=(self.previewJobs,), name='ImagePreview', daemon=True).start()
+
+    def get(self, path):
+        """Return the CacheEntry for path (marking it recently used), or None"""
+        entry = self.entries.get(path)
+        if entry is not None:
+            self.entries.move_to_end(path)
+        return entry
+
+    def put(self, path, texture, fullSize=None, animated=False):
+        if texture is None:
+            return None
+        self.discard(path)
+        entry = CacheEntry(texture, fullSize, animated)
+        self.entries[path] = entry
+        self.bytesUsed += entry.nbytes
+        self._evict()
+        return entry
+
+    def discard(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.bytesUsed -= entry.nbytes
+        self._drop(path)
+
+    def _drop(self, path):
+        # not decoded if it hasn't started, and dropped when it comes back if it has
+        for table in self.tables.values():
+            job = table.pop(path, None)
+            if job is not None and job.state == 'queued':
+                job.state = 'dropped'
+
+    def cancel(self, path):
+        """Not wanted on screen after all - forget the decodes of path that haven't started"""
+        for table in (self.previewing, self.pending):
+            job = table.get(path)
+            if job is not None and job.state == 'queued':
+                del table[path]
+                job.state = 'dropped'
+
+    def cancel_prefetches(self):
+        """Forget read-ahead that hasn't started, it's around somewhere we're moving away from"""
+        for path, job in list(self.pending.items()):
+            if job.state == 'queued' and job.priority >= PREFETCH:
+                del self.pending[path]
+                job.state = 'dropped'
+
+    def ready(self, path):
+        return path in self.entries
+
+    def loading(self, path):
+        return path in self.pending
+
+    def rename(self, oldPath, newPath):
+        """Keep a decoded texture valid when its file gets moved"""
+        entry = self.entries.pop(oldPath, None)
+        self._drop(oldPath)
+        if entry is not None:
+            self.entries[newPath] = entry
+
+    def memory_used(self):
+        """Bytes held in textures and in decoded images not uploaded yet"""
+        return self.bytesUsed + self.decodedBytes
+
+    def shrink(self, target):
+        """Evict until memory_used() is down to target (as near as the image on screen allows), returns bytes freed"""
+        before = self.bytesUsed
+        self._evict(max(0, target - self.decodedBytes))
+        return before - self.bytesUsed
+
+    def _evict(self, budget=None):
+        budget = self.budget if budget is None else budget
+        # always keep the most recent entry, it's what is on screen
+        while self.bytesUsed > budget and len(self.entries) > 1:
+            path, entry = self.entries.popitem(last=False)
+            self.bytesUsed -= entry.nbytes
+            Logger.debug(f"ImageCache: evicted {path}, now {self.bytesUsed / 1048576:.0f}MB")
+
+    def _queue(self, kind, path, priority, callback=None):
+        """Get path decoding (or sooner, if it's queued behind less urgent ones)"""
+        table = self.tables[kind]
+        jobs = self.previewJobs if kind == 'preview' else self.jobs
+        job = table.get(path)
+        if job is None:
+            job = table[path] = DecodeJob(path, kind, priority)
+            jobs.put((priority, next(self.sequence), job))
+        elif priority < job.priority and job.state == 'queued':
+            job.priority = priority
+            jobs.put((priority, next(self.sequence), job))
+        if callback is not None:
+            job.callbacks.append(callback)
+        if self.uploadEvent is None:
+            self.uploadEvent = Clock.schedule_interval(self._upload, 0)
+        return job
+
+    def request(self, path, callback, previewCallback=None, decode=True):
+        """
+        The CacheEntry for path if it's cached. Otherwise None, and it gets
+        decoded ahead of everything else and callback(path, entry) called
+        once it's uploaded (entry None if it couldn't be read). Before that,
+        previewCallback(path, entry) may get a quick rough version - or only
+        that, without decode.
+        """
+        entry = self.get(path)
+        if entry is None:
+            job = self._queue('display', path, WANTED, callback) if decode else self.pending.get(path)
+            if previewCallback is not None and self.previews and (job is None or job.state == 'queued'):
+                self._queue('preview', path, PREVIEW, previewCallback)
+        return entry
+
+    def neighbours(self, imageSet):
+        """Paths around setPos in the current order, nearest first"""
+        numImages = len(imageSet)
+        paths = []
+        if numImages < 2:
+            return paths
+        for dist in range(1, self.prefetchCount + 1):
+            for pos in (imageSet.setPos + dist, imageSet.setPos - dist):
+                path = imageSet.path_at(pos % numImages)
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def prefetch(self, imageSet):
+        """Start loading whatever is missing around setPos"""
+        if len(imageSet) < 2:
+            return
+        self.fetch(self.neighbours(imageSet))
+
+    def fetch(self, paths):
+        """Start loading whichever of paths aren't cached, nearest (first) is the last to be evicted"""
+        # touch farthest first so the nearest images are the last to be evicted
+        for path in reversed(paths):
+            if path in self.entries:
+                self.entries.move_to_end(path)
+        for distance, path in enumerate(paths):
+            if path not in self.entries:
+                # nearest decoded first
+                self._queue('display', path, PREFETCH + distance)
+
+    def upgrade(self, path, callback):
+        """Load path at full resolution in the background, then callback(path, entry)"""
+        entry = self.entries.get(path)
+        if entry is None or not entry.reduced:
+            return
+        self._queue('full', path, WANTED, callback)
+
+    def _work(self, jobs):
+        # decode thread
+        while True:
+            priority, sequence, job = jobs.get()
+            if job.state != 'queued':
+                # queued again sooner and done already, or not wanted any more
+                continue
+            wanted = job.priority <= WANTED
+            with self.wantedDone:
+                if not wanted and self.wantedDecoding:
+                    # on few cores a read-ahead would only slow down what's wanted on screen
+                    jobs.put((priority, sequence, job))
+                    self.wantedDone.wait_for(lambda: not self.wantedDecoding)
+                    continue
+                if wanted:
+                    self.wantedDecoding += 1
+            job.state = 'decoding'
+            try:
+                if job.kind == 'preview':
+                    job.result = decode_preview(job.path, self.decodeSize)
+                else:
+                    job.result = decode_rgba(job.path, None if job.kind == 'full' else self.decodeSize)
+            except Exception as e:
+                Logger.warning(f"ImageCache: couldn't decode {job.path} - {e}")
+            job.state = 'decoded'
+            if job.result is not None:
+                with self.decodedLock:
+                    self.decodedBytes += len(job.result[2])
+            self.decoded.put(job)
+            if wanted:
+                with self.wantedDone:
+                    self.wantedDecoding -= 1
+                    self.wantedDone.notify_all()
+
+    def _upload(self, dt):
+        # one texture a frame at most, a few big ones in one go would be a visible hitch
+        while True:
+            try:
+                job = self.decoded.get_nowait()
+            except queue.Empty:
+                break
+            if job.result is not None:
+                with self.decodedLock:
+                    self.decodedBytes -= len(job.result[2])
+            table = self.tables[job.kind]
+            if table.get(job.path) is not job:
+                # discarded (moved/deleted) while loading
+                continue
+            del table[job.path]
+            if job.kind == 'preview' and (job.result is None or job.path in self.entries):
+                # no quick way for this one, or the real thing beat it
+                continue
+            elapsed = time.monotonic() - job.started
+            if job.kind == 'display':
+                self.loadTime = 0.8 * self.loadTime + 0.2 * elapsed
+            # queueing for a decode thread included
+            trace.add({'display': 'load', 'full': 'full res load', 'preview': 'preview load'}[job.kind],
+                      time.perf_counter() - elapsed, elapsed, job.path)
+            entry = None
+            if job.result is not None:
+                width, height, pixels, fullSize, animated = job.result
+                with trace.span('upload', job.path):
+                    texture = Texture.create(size=(width, height), colorfmt='rgba')
+                    texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
+                    texture.flip_vertical()
+                if job.kind == 'preview':
+                    entry = CacheEntry(texture, fullSize)
+                else:
+                    entry = self.put(job.path, texture, fullSize, animated)
+                    Logger.debug(f"ImageCache: loaded {job.path}{' at full resolution' if job.kind == 'full' else ''}")
+            for callback in job.callbacks:
+                callback(job.path, entry)
+            break
+        if not any(self.tables.values()) and self.decoded.empty():
+            self.uploadEvent = None
+            return False
@@ -0,0 +1,169 @@
+import io
+import math
+
+from PIL import ExifTags, Image as PILImage
+
+from tiviewlib.Trace import trace
+
+# big scans are what we're here for, not decompression bombs
+PILImage.MAX_IMAGE_PIXELS = None
+# a preview only has to do for the moment before the real decode lands
+PREVIEW_SIZE = (480, 480)
+# smaller than this decodes quickly enough as it is, no preview first
+PREVIEW_MIN_PIXELS = 4000000
+# JPEG2000 resolution levels we'll ask for, files are made with 6 unless asked otherwise
+JP2_MAX_REDUCE = 5
+
+def fit_size(imageSize, maxSize):
+    """Size imageSize would be drawn at when fit inside maxSize"""
+    scale = min(maxSize[0] / imageSize[0], maxSize[1] / imageSize[1], 1)
+    return (max(1, int(imageSize[0] * scale)), max(1, int(imageSize[1] * scale)))
+
+def to_8bit(img):
+    """Get PIL image into rgb/rgba at 8 bits per channel, which is all a texture takes"""
+    if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        # 16/32-bit greyscale - scale down rather than let convert() clip it
+        img = img.convert('I').point(lambda i: i * (1 / 256)).convert('L')
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    return img
+
+# EXIF orientation -> the transpose that puts it upright
+ORIENTATIONS = {
+    2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PILImage.Transpose.ROTATE_180,
+    4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PILImage.Transpose.TRANSPOSE,
+    6: PILImage.Transpose.ROTATE_270,
+    7: PILImage.Transpose.TRANSVERSE,
+    8: PILImage.Transpose.ROTATE_90,
+}
+SWAPS_AXES = (5, 6, 7, 8)
+
+def exif_orientation(img):
+    """EXIF orientation of an opened image, 1 (the way it's stored) where it doesn't say"""
+    try:
+        return img.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+def upright(img, orientation):
+    """img turned the way orientation says it should be shown"""
+    if orientation in ORIENTATIONS:
+        img = img.transpose(ORIENTATIONS[orientation])
+    return img
+
+def upright_size(size, orientation):
+    """Size an image stored at size is once turned upright"""
+    return size[::-1] if orientation in SWAPS_AXES else size
+
+def _draft(img, target):
+    """Have img decode at the smallest of its format's built in scales that covers target"""
+    if img.format == 'JPEG':
+        # lets libjpeg do the DCT scaling (1/2, 1/4, 1/8) while decoding
+        img.draft('RGB', target)
+    elif img.format == 'JPEG2000':
+        # openjpeg decodes just the resolution levels needed, each one halving the size
+        factor = min(img.size[0] / target[0], img.size[1] / target[1])
+        if factor >= 2:
+            img.reduce = min(JP2_MAX_REDUCE, int(math.log2(factor)))
+
+def _exif_thumbnail(img):
+    """The JPEG thumbnail cameras embed in EXIF, if there's one the same shape as img"""
+    try:
+        exif = img.getexif()
+        ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)
+        if not offset or not length:
+            return None
+        # offsets count from the TIFF header, after the 'Exif\0\0' marker
+        data = img.info['exif'][6 + offset:6 + offset + length]
+        thumb = PILImage.open(io.BytesIO(data))
+        thumb.load()
+    except Exception:
+        return None
+    # some cameras letterbox 3:2 photos into a 4:3 thumbnail, that would jump when the real one arrives
+    if abs(thumb.size[0] / thumb.size[1] - img.size[0] / img.size[1]) > 0.02:
+        return None
+    return thumb
+
+def decode_reduced(filename, maxSize):
+    """
+    Decode at the smallest scale that still covers maxSize when fit, turned
+    upright as its EXIF orientation says. Returns the decoded PIL image and
+    the (upright) full-resolution size of the file.
+    """
+    img, fullSize, animated = _decode(filename, maxSize)
+    return img, fullSize
+
+def _decode(filename, maxSize):
+    # decode_reduced, and whether there are more frames after the one decoded
+    # read it all in first, so disk time and decode time can be told apart
+    with trace.span('read', filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+    with trace.span('decode', filename):
+        img = PILImage.open(io.BytesIO(data))
+        fullSize = img.size
+        # only looks for a second frame, doesn't count them
+        animated = getattr(img, 'is_animated', False)
+        orientation = exif_orientation(img)
+        fullSize = upright_size(fullSize, orientation)
+        if maxSize:
+            # fit the way round it'll be shown
+            maxSize = upright_size(maxSize, orientation)
+        if maxSize:
+            target = fit_size(img.size, maxSize)
+            _draft(img, target)
+        # before reducing, which 16-bit modes don't have
+        img = to_8bit(img)
+        # PIL decodes lazily, make it happen here rather than in whoever asks for the pixels
+        img.load()
+        if maxSize:
+            factor = min(img.size[0] // target[0], img.size[1] // target[1])
+            if factor >= 2:
+                # JPEG2000 images have a reduce attribute of their own in the way
+                img = PILImage.Image.reduce(img, factor)
+        return upright(img, orientation), fullSize, animated
+
+def decode_rgba(filename, maxSize):
+    """
+    (width, height, rgba bytes, full-resolution size, animated) of filename,
+    decoded as decode_reduced does, ready for Texture.blit_buffer. Animated
+    images come back as their first frame. For decode threads.
+    """
+    img, fullSize, animated = _decode(filename, maxSize)
+    with trace.span('convert', filename):
+        # rgb rows aren't always 4 byte aligned, which GL doesn't take kindly to
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        return img.size[0], img.size[1], img.tobytes(), fullSize, animated
+
+def decode_preview(filename, decodeSize=None):
+    """
+    A quick, rough version of a big JPEG or JPEG2000 to show while the real
+    decode (fitting decodeSize, None for full size) runs: its EXIF
+    thumbnail, or failing that a decode at a low JPEG2000 resolution level,
+    or 1/8 scale for a JPEG whose real decode won't be DCT scaled itself.
+    As decode_rgba, or None where there's no quick way or no need.
+    """
+    with trace.span('preview', filename):
+        with PILImage.open(filename) as img:
+            fullSize = img.size
+            if img.format not in ('JPEG', 'JPEG2000') or fullSize[0] * fullSize[1] < PREVIEW_MIN_PIXELS:
+                return None
+            orientation = exif_orientation(img)
+            preview = _exif_thumbnail(img) if img.format == 'JPEG' else None
+            if preview is None:
+                if img.format == 'JPEG' and decodeSize:
+                    # huffman decoding is most of the work at any scale, 1/8 would hardly beat it
+                    return None
+                _draft(img, fit_size(img.size, PREVIEW_SIZE))
+                preview = img
+            preview = to_8bit(preview)
+            preview.load()
+            preview = upright(preview, orientation)
+            fullSize = upright_size(fullSize, orientation)
+            if preview.mode != 'RGBA':
+                preview = preview.convert('RGBA')
+            return preview.size[0], preview.size[1], preview.tobytes(), fullSize, False
@@ -0,0 +1,325 @@
+import bisect
+import gc
+import math
+import random
+
+import numpy as np
+
+# what 'ordered' sorts by, picked with ImageSet.sortKey
+# plain values where possible, a million tuple keys is noticeably slower
+SORT_KEYS = {
+    'name': lambda x: x.path,
+    'size': lambda x: x.size,
+    'mtime': lambda x: x.mtime,
+    # capture time from EXIF once it's been read, file mtime until then
+    'created': lambda x: x.created,
+    # unknown goes last
+    'dimensions': lambda x: math.inf if x.pixels is None else x.pixels,
+    'quality': lambda x: (x.quality is None, x.quality or 0, x.path),
+    # duplicate groups together, biggest file first in each, everything else after
+    'duplicates': lambda x: (math.inf if x.dupGroup is None else x.dupGroup, -x.size),
+}
+SORT_NAMES = {'name': 'filename', 'size': 'file size', 'mtime': 'modification time',
+              'created': 'capture date', 'dimensions': 'dimensions', 'quality': 'JPEG quality',
+              'duplicates': 'duplicate group'}
+
+# how far 'shuffled' moves an image from where it'd be in order
+SHUFFLE_SPAN = 20
+# adding fewer than 1/this of the set binary searches each one into place, more re-sorts
+INSERT_FRACTION = 16
+
+
+class ImageRecord:
+    """
+    One image of the set. Records from the same directory share one
+    directory string, so a million paths don't cost a million copies of it.
+    """
+    __slots__ = ('dir', 'name', 'size', 'mtime', 'created', 'quality', 'pixels', 'hashes', 'dupGroup')
+
+    def __init__(self, dir, name, size=0, mtime=0):
+        self.dir = dir
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.created = mtime
+        self.quality = None
+        self.pixels = None
+        self.hashes = None
+        self.dupGroup = None
+
+    @property
+    def path(self):
+        return self.dir + self.name
+
+
+class ImageSet:
+    """
+    The images being viewed and the order they're viewed in.
+
+    Records are kept once, in the order found, and never move. The ordered,
+    shuffled and random orders are permutation arrays of record indexes,
+    kept around once made, so flipping between modes doesn't re-sort.
+    Random and shuffled come from a per-session seed, so going back in
+    random mode goes back through what was already seen. Where a path sits
+    in the current order is a dict and an array lookup away.
+    """
+
+    def __init__(self, delDir=None, sortKey='name', seed=None):
+        self.delDir = delDir
+        self.setPos = 0
+        self.changeType = 'ordered'
+        self.sortKey = sortKey
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.records = []
+        # path -> record index
+        self.index = {}
+        # interned directory prefixes
+        self.dirs = {}
+        self.removed = np.zeros(0, dtype=bool)
+        # record indexes in viewing order, and record index -> position in it (-1 if not there)
+        self.order = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros(0, dtype=np.int64)
+        # changeType -> permutation made earlier, may still hold removed records
+        self.orders = {}
+        # per-record sort keys for the current sortKey
+        self.keys = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, pos):
+        return self.records[self.order[pos]]
+
+    def __iter__(self):
+        """Records in viewing order"""
+        records = self.records
+        return (records[i] for i in self.order.tolist())
+
+    def current(self):
+        return self[self.setPos] if len(self.order) else None
+
+    def path_at(self, pos):
+        return self.records[self.order[pos]].path
+
+    def paths(self):
+        return [record.path for record in self]
+
+    def position(self, path):
+        """Where path is in the current order, None if it isn't"""
+        i = self.index.get(path)
+        return None if i is None else int(self.positions[i])
+
+    def _set_order(self, order):
+        self.order = order
+        self.positions = np.full(len(self.records), -1, dtype=np.int64)
+        self.positions[order] = np.arange(len(order))
+
+    def _live(self, order):
+        return order[~self.removed[order]]
+
+    def _keep_current(self, record):
+        if record is not None:
+            self.setPos = int(self.positions[self.index[record.path]])
+
+    def _sorted(self):
+        if self.keys is None:
+            sortKey = SORT_KEYS[self.sortKey]
+            self.keys = [sortKey(record) for record in self.records]
+        live = np.flatnonzero(~self.removed).tolist()
+        return np.array(sorted(live, key=self.keys.__getitem__), dtype=np.int64)
+
+    def _permutation(self, changeType):
+        if changeType in self.orders:
+            return self._live(self.orders[changeType])
+        if changeType == 'ordered':
+            order = self._sorted()
+        elif changeType == 'shuffled':
+            # each image only moves a little way from where it'd be in order
+            ordered = self._permutation('ordered')
+            rng = np.random.default_rng(self.seed + 1)
+            order = ordered[np.argsort(np.arange(len(ordered)) + rng.uniform(0, SHUFFLE_SPAN, len(ordered)))]
+        else:
+            rng = np.random.default_rng(self.seed)
+            order = rng.permutation(np.flatnonzero(~self.removed))
+        self.orders[changeType] = order
+        return order
+
+    def set_order(self, changeType):
+        """Switch between ordered, shuffled and random, staying on the current image"""
+        if changeType == self.changeType:
+            return
+        record = self.current()
+        self.orders[self.changeType] = self.order
+        self._set_order(self._permutation(changeType))
+        self.changeType = changeType
+        self._keep_current(record)
+
+    def set_sort_key(self, sortKey):
+        """Re-sort by something else (or by what records say now), staying on the current image"""
+        record = self.current()
+        self.sortKey = sortKey
+        self.keys = None
+        # shuffled follows ordered, so both are stale now
+        self.orders.pop('ordered', None)
+        self.orders.pop('shuffled', None)
+        self.changeType = 'ordered'
+        self._set_order(self._permutation('ordered'))
+        self._keep_current(record)
+
+    def extend(self, found, keepSorted=True):
+        """
+        Add (path, size, mtime) images. In ordered mode with keepSorted they
+        get merged in by sortKey, otherwise they go on the end. Returns the
+        number added.
+        """
+        record = self.current()
+        first = len(self.records)
+        index, dirs, records = self.index, self.dirs, self.records
+        # records only point at strings and numbers, so the cyclic gc walking
+        # all of them again every few thousand allocations is pure overhead
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            for path, size, mtime in found:
+                if path in index:
+                    continue
+                cut = path.rfind('/') + 1
+                dirName = path[:cut]
+                index[path] = len(records)
+                records.append(ImageRecord(dirs.setdefault(dirName, dirName), path[cut:], size, mtime))
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        added = np.arange(first, len(self.records), dtype=np.int64)
+        if not len(added):
+            return 0
+        self.removed = np.concatenate([self.removed, np.zeros(len(added), dtype=bool)])
+        if self.keys is not None:
+            sortKey = SORT_KEYS[self.sortKey]
+            self.keys.extend(sortKey(r) for r in self.records[first:])
+
+        # new images go on the end of remembered orders, random ones in random order
+        rng = np.random.default_rng(self.seed + first)
+        for changeType in list(self.orders):
+            if changeType == 'random':
+                self.orders[changeType] = np.concatenate([self.orders[changeType], rng.permutation(added)])
+            else:
+                del self.orders[changeType]
+
+        if self.changeType == 'ordered' and keepSorted:
+            if self.keys is not None and len(added) * INSERT_FRACTION < len(self.order):
+                self._insert_sorted(added)
+            else:
+                # old order is sorted already, so this is mostly a merge
+                self._set_order(self._sorted())
+        elif self.changeType == 'random':
+            self._set_order(np.concatenate([self.order, rng.permutation(added)]))
+        else:
+            self._set_order(np.concatenate([self.order, added]))
+        self._keep_current(record)
+        return len(added)
+
+    def _insert_sorted(self, added):
+        """Put new records into the ordered view where sorting would, a binary search each"""
+        keys = self.keys
+        added = sorted(added.tolist(), key=keys.__getitem__)
+        # after equal keys, as a stable sort would have them
+        at = [bisect.bisect_right(self.order, keys[i], key=keys.__getitem__) for i in added]
+        self._set_order(np.insert(self.order, at, added))
+
+    def remove(self, record):
+        """
+        Take record out of the set, the position it was at now holds the next
+        image. Returns its index, for reinsert().
+        """
+        i = self.index.pop(record.path)
+        self.removed[i] = True
+        pos = int(self.positions[i])
+        if pos >= 0:
+            self.order = np.delete(self.order, pos)
+            self.positions[self.order[pos:]] -= 1
+            self.positions[i] = -1
+        return i
+
+    def reinsert(self, i, pos):
+        """Put back record i that remove() took out, at pos in the current order. Returns where it went."""
+        record = self.records[i]
+        if record.path in self.index:
+            return int(self.positions[self.index[record.path]])
+        self.removed[i] = False
+        self.index[record.path] = i
+        pos = max(0, min(pos, len(self.order)))
+        self.order = np.insert(self.order, pos, i)
+        self.positions[self.order[pos:]] += 1
+        self.positions[i] = pos
+        return pos
+
+    def discard(self, paths):
+        """
+        Take out whichever of paths are in the set, staying on the current
+        image unless it's one of them, in which case the one after it takes
+        its place. Returns how many went and whether the current one did.
+        """
+        record = self.current()
+        gone = [self.index.pop(path) for path in paths if path in self.index]
+        if not gone:
+            return 0, False
+        self.removed[gone] = True
+        before = int(np.count_nonzero((self.positions[gone] >= 0) & (self.positions[gone] < self.setPos)))
+        self._set_order(self._live(self.order))
+        if record.path in self.index:
+            self._keep_current(record)
+            return len(gone), False
+        self.setPos = max(0, min(self.setPos - before, len(self.order) - 1))
+        return len(gone), True
+
+    def names_by_dir(self):
+        """dir -> names of the images in it. Safe enough from another thread, it only reads."""
+        names = {}
+        records = self.records
+        for i in np.flatnonzero(~self.removed).tolist():
+            record = records[i]
+            names.setdefault(record.dir, set()).add(record.name)
+        return names
+
+    def filter(self, keep):
+        """Drop records keep(record) says no to, staying on the current image if it's kept"""
+        record = self.current()
+        for r in self:
+            if not keep(r):
+                i = self.index.pop(r.path)
+                self.removed[i] = True
+        # filtered out for good, unlike remove(), so remembered orders can let go of them too
+        self.orders = {changeType: self._live(order) for changeType, order in self.orders.items()}
+        self._set_order(self._live(self.order))
+        if record is not None and record.path in self.index:
+            self._keep_current(record)
+        else:
+            self.setPos = 0
+
+    def snapshot(self):
+        """Live records, and the current order as indexes into that list"""
+        live = np.flatnonzero(~self.removed)
+        remap = np.full(len(self.records), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        records = self.records
+        return [records[i] for i in live.tolist()], remap[self.order]
+
+    def restore(self, dirNames, dirIndex, names, sizes, mtimes, order, changeType='ordered', setPos=0):
+        """Start over with records as a snapshot had them, viewed in order"""
+        dirNames = [self.dirs.setdefault(d, d) for d in dirNames]
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            recordDirs = [dirNames[d] for d in dirIndex.tolist()]
+            self.records = list(map(ImageRecord, recordDirs, names, sizes.tolist(), mtimes.tolist()))
+            self.index = dict(zip(map(str.__add__, recordDirs, names), range(len(names))))
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        self.removed = np.zeros(len(self.records), dtype=bool)
+        self.orders = {}
+        self.keys = None
+        self.changeType = changeType
+        self._set_order(np.asarray(order, dtype=np.int64))
+        self.setPos = min(max(setPos, 0), max(len(order) - 1, 0))
@@ -2,12 +2,7 @@ import os
 import sys
 import math
 import random
-import reusables
-import shutil
 import time
-import subprocess
-import numpy as np
-from PIL import Image
 
 from kivy.uix.button import Button
 from kivy.uix.floatlayout import FloatLayout
@@ -17,10 +12,20 @@ from kivy.uix.label import Label
 from kivy.graphics import Color, Rectangle
 from kivy.core.window import Window
 from kivy.clock import Clock
-from kivy.loader import Loader
 from kivy.logger import Logger
 from kivy.app import App
 from tiviewlib.MainImage import MainImage
+from tiviewlib.ImageSet import ImageSet, SORT_NAMES
+from tiviewlib.ImageCache import ImageCache
+from tiviewlib.MemoryGovernor import MemoryGovernor
+from tiviewlib.DirScanner import DirScanner
+from tiviewlib.MetadataIndex import MetadataIndex, SortInfoScan
+from tiviewlib.SessionSnapshot import SessionSnapshot
+from tiviewlib.KeyPanner import KeyPanner
+from tiviewlib.Slideshow import Slideshow
+from tiviewlib.Trace import trace
+# the watcher, file ops, album grid, quality and duplicate scans get imported on first use.
+# numpy and PIL aren't among what that saves, ImageSet, ImageCache and ImageDecoder load them up front
 #from tiviewlib.kivy_hover import MouseOver
 
 class ImageViewer(FloatLayout):
@@ -29,6 +34,11 @@ class ImageViewer(FloatLayout):
             delete_dir=f"{os.environ['HOME']}/.Trash",
             deviceRes=None,
             appConfig=None,
+            recursive=False,
+            maxQuality=None,
+            sortKey='name',
+            fileList=None,
+            fileListSeparator=b'\n',
             **kwargs):
         super().__init__(**kwargs)
 
@@ -45,45 +55,130 @@ class ImageViewer(FloatLayout):
         if appConfig != None:
             self.appConfig = appConfig
 
+        # pull images out of subdirectories too
+        self.recursive = recursive
+        # only keep JPEGs at or below this estimated quality
+        self.maxQuality = maxQuality
+        # binary stream of more paths to view (tiv -, --files-from), read while viewing
+        self.fileList = fileList
+        self.fileListSeparator = fileListSeparator
+        # BatchScan kind -> clock event polling it
+        self.batchScans = {}
+        # moves, copies and trashing run on a worker thread, made on first use
+        self.fileOps = None
+        self.fileOpEvent = None
+        try:
+            self.fileOpHistory = int(self.appConfig.get("Performance", "undo-history"))
+        except:
+            self.fileOpHistory = 50
+        self.pendingSortKey = sortKey
+        self.dupGroupCount = 0
+        # keeps an eye on scanned directories once the first scan is done
+        self.dirWatcher = None
+        self.dirWatchEvent = None
+        # message overlays get made on first use, none of them are needed for the first image
+        self.info_button = None
+        self.giant_info_button = None
+        self.metadata_outer = None
+        self.timing_hud = None
+        self.timingHudEvent = None
+        # key press time, and the press an image change is waiting to be drawn for
+        self.keyDownAt = None
+        self.navStart = None
+        # key being held down, its repeats are navigation on the move
+        self.heldKey = None
+
         # Capture keyboard input
         self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
         self._keyboard.bind(on_key_down=self._on_keyboard_down)
         self._keyboard.bind(on_key_up=self._on_keyboard_up)
 
        # imageSet=Metadata about images
-        self.imageSet = {}
-        self.imageSet['del_dir'] = delete_dir
-        self.imageSet['setPos'] = 0
-        self.imageSet['changeType'] = 'ordered'
-        self.imageSet['orderedList'] = []
+        self.imageSet = ImageSet(delDir=delete_dir, sortKey=sortKey)
 
         # make trash dir, init random seed, get list of images to view
-        os.makedirs(self.imageSet['del_dir'], exist_ok=True)
+        os.makedirs(self.imageSet.delDir, exist_ok=True)
         random.seed()
         self._get_images()
 
+        # decoded images around setPos, so paging back and forth doesn't decode again
+        try:
+            cacheMB = int(self.appConfig.get("Performance", "image-cache-mb"))
+            prefetchCount = int(self.appConfig.get("Performance", "prefetch-count"))
+        except:
+            cacheMB = 1024
+            prefetchCount = 3
+        # fit mode only needs as many pixels as the screen has, decode at that size
+        try:
+            displayResDecode = self.appConfig.getboolean("Performance", "display-res-decode")
+        except:
+            displayResDecode = True
+        decodeSize = self.deviceRes if displayResDecode else None
+        try:
+            decodeWorkers = int(self.appConfig.get("Performance", "decode-workers"))
+        except:
+            decodeWorkers = 4
+        # big JPEGs show their EXIF thumbnail while they decode, JPEG2000 a low resolution level
+        try:
+            previews = self.appConfig.getboolean("Performance", "previews")
+        except:
+            previews = True
+        self.imageCache = ImageCache(budgetMB=cacheMB, prefetchCount=prefetchCount, decodeSize=decodeSize,
+                                     workers=decodeWorkers, previews=previews)
+
+        # everything decoded kept under one ceiling, and less when the system runs short
+        try:
+            memoryLimitMB = int(self.appConfig.get("Performance", "memory-limit-mb"))
+        except:
+            memoryLimitMB = 2048
+        try:
+            lowMemoryMB = int(self.appConfig.get("Performance", "low-memory-mb"))
+        except:
+            lowMemoryMB = 512
+        self.memoryGovernor = MemoryGovernor(limitMB=memoryLimitMB, lowMB=lowMemoryMB)
+        self.memoryGovernor.register('images', self.imageCache.memory_used, self.imageCache.shrink)
+
+        # file info for the i key, read ahead for images around setPos
+        self.metadataIndex = MetadataIndex()
+
+        # huge images get drawn from a tile pyramid when zoomed in
+        tileLayerConfig = {}
+        for key, option, default in (('cacheMB', 'tile-cache-mb', 256), ('diskMB', 'tile-disk-mb', 4096),
+                                     ('thresholdMP', 'tile-threshold-mp', 32)):
+            try:
+                tileLayerConfig[key] = int(self.appConfig.get("Performance", option))
+            except:
+                tileLayerConfig[key] = default
+
         # Define widgets used so we can reference them elsewhere
-        self.image = MainImage(imageSet=self.imageSet)
+        self.image = MainImage(imageSet=self.imageSet, imageCache=self.imageCache, metadataIndex=self.metadataIndex,
+                               tileLayerConfig=tileLayerConfig)
+        if self.image.tileLayer is not None:
+            self.memoryGovernor.register('tiles', self.image.tileLayer.memory_used, self.image.tileLayer.shrink)
+        self.memoryGovernor.register('animation', self.image.animation_memory_used, self.image.shrink_animation)
         self.sv = ScrollView(size=Window.size)
         self.sv.scroll_x = 0.5
         self.sv.scroll_y = 0.5
         self.sv.add_widget(self.image)
         self.add_widget(self.sv)
+        self.image.bind(source=self._on_image_changed)
 
         # deal with resizing
         self.bind(pos=self.on_size, size=self.on_size)
 
-        # progressive scrolling - up down left right
-        self.scrollingDir = [False, False, False, False]
-        self.scrollPix = 1
-        self.progressiveSpeed = 2
-        self.progressiveReset = 20
-        self.scrollEvent = None
-        # just over 100x/sec
-        self.scrollScheduleInterval = 0.008
-
-        # slideshow event
-        self.slideshowEvent = None
+        # arrow keys pan by time held, stepped once per frame
+        try:
+            panConfig = {'speed': int(self.appConfig.get("UI", "pan-speed")),
+                         'accel': int(self.appConfig.get("UI", "pan-accel")),
+                         'maxSpeed': int(self.appConfig.get("UI", "pan-max-speed"))}
+        except:
+            panConfig = {}
+        self.panner = KeyPanner(self.sv, **panConfig)
+        # no key-up comes for keys let go of while another window has focus
+        Window.bind(focus=lambda window, focused: focused or self._keys_lost())
+
+        # slideshow only moves on once the next image is decoded
+        self.slideshow = Slideshow(self.imageSet, self.imageCache, self.slideshowNextImage)
         try:
             self.slideshowInterval = int(self.appConfig.get("UI", "slideshow-interval"))
         except:
@@ -92,6 +187,10 @@ class ImageViewer(FloatLayout):
         # metadata display timer
         self.metadataEvent = None
 
+        # thumbnail grid, made on first use
+        self.albumView = None
+        self.thumbnailCache = None
+
         # for scary actions multi-key commands
         self.lastScaryTimestamp = 0
         self.previousKey = ''
@@ -112,38 +211,375 @@ class ImageViewer(FloatLayout):
             self.user_feedback_fg = (0.95, 0.95, 0.95, 0.8)
             self.user_feedback_bg = (0.05, 0.05, 0.05, 0.8)
 
-        # now that image loaded, also load cached next
+        # now that image loaded, also load the ones around it
+        self.image.prefetch()
+
+        # say hello once the first image is up
+        Clock.schedule_once(lambda dt: self.user_feedback('timeless image viewer', 1), 0.2)
+
+    def _get_images(self):
+        # if no args passed in at all, use current directory as location for images
+        if sys.argv[1:] == [] and self.fileList is None:
+            sys.argv[1:] = ['.']
+
+        # dir/ -> (mtime_ns, 'scan' or 'files') of everywhere images came from, for the snapshot
+        self.sessionDirs = {}
+        # directories being looked at again after a snapshot restore, and what's still in them
+        self.refreshDirs = set()
+        self.refreshSeen = set()
         try:
-            self.imageSet['cacheImage'] = Loader.image(self.imageSet['orderedList'][self.imageSet['setPos'] + 1]['image'])
-            self.imageSet['cacheImage'].bind(on_load=self.image.cacheImage_loaded)
+            useSnapshot = self.appConfig.getboolean("Performance", "session-snapshot")
         except:
-            # i guess we only had 1 image?
-            pass
+            useSnapshot = True
+        self.session = None
+        # a list on stdin can say something else every time
+        if useSnapshot and self.fileList is None:
+            # same arguments from the same place picks up where it left off
+            self.session = SessionSnapshot([os.getcwd(), self.recursive, self.imageSet.sortKey, self.maxQuality]
+                                           + sys.argv[1:])
+            if self._restore_session():
+                return
 
-        # a place to put messages
-        self.info_button = Button(text='timeless image viewer',
-                                  font_name = "Times New Roman",
-                                  font_size = self.user_feedback_font_size,
-                                  size_hint=(1.0, 0.055),
-                                  pos_hint={'x':0, 'y':.01},
-                                  color = self.user_feedback_fg,
-                                  background_color = self.user_feedback_bg
-                                  )
-        self.add_widget(self.info_button)
-        Clock.schedule_once(self.user_feedback_clear, 1)
+        # might get a file or dir as argv
+        self.scanSorted = False
+        scanDirs = []
+        files = []
 
-        # more massive messages can go here, for eg move-to locations
-        self.giant_info_button = Button(text='lots of info would go here',
-                                  font_name = "Times New Roman",
-                                  font_size = self.user_feedback_font_size,
-                                  size_hint=(1.0, 0.75),
-                                  pos_hint={'x':0, 'y':.15},
-                                  color = self.user_feedback_fg,
-                                  background_color = self.user_feedback_bg
-                                  )
-        self.add_widget(self.giant_info_button)
-        Clock.schedule_once(self.giant_info_clear, 1)
+        for inArg in sys.argv[1:]:
+            if os.path.isdir(inArg):
+                self.scanSorted = True
+                scanDirs.append(inArg)
+            elif os.path.isfile(inArg):
+                st = os.stat(inArg)
+                files.append((inArg, st.st_size, st.st_mtime))
+                dirName = inArg[:inArg.rfind('/') + 1]
+                if dirName not in self.sessionDirs:
+                    try:
+                        self.sessionDirs[dirName] = (os.stat(dirName or '.').st_mtime_ns, 'files')
+                    except OSError:
+                        pass
+            else:
+                Logger.error(f"Input {inArg} is neither file nor directory. Ignoring.")
+
+        # given files stay in the order given, unless asked for some other order
+        if self.imageSet.sortKey != 'name':
+            self.scanSorted = True
+        # they come in some random order, so put them in filename order
+        self.imageSet.extend(files, keepSorted=self.scanSorted)
+
+        # scan directories in the background, only waiting until there's something to show
+        try:
+            scanWorkers = int(self.appConfig.get("Performance", "scan-workers"))
+        except:
+            scanWorkers = 8
+        self.scanner = DirScanner(scanDirs, recursive=self.recursive, workers=scanWorkers,
+                                  fileList=self.fileList, separator=self.fileListSeparator)
+        if len(self.imageSet) == 0:
+            self._merge_scan_batches(self.scanner.wait_for_first())
+        self.scanEvent = Clock.schedule_interval(self._merge_scan_results, 0.1)
+
+    def _restore_session(self):
+        """
+        Bring back the image list and position from last time. Directories
+        that changed since get re-read in the background, ones that are gone
+        take their images with them.
+        """
+        header = self.session.load(self.imageSet)
+        if header is None:
+            return False
+        self.scanSorted = header.get('scanSorted', True)
+        unchanged, rescan, refresh, gone = self.session.check_dirs(header)
+        self.sessionDirs.update(unchanged)
+        # just the images we were given by name need a fresh look
+        self.sessionDirs.update(refresh)
+        self.refreshDirs.update(refresh)
+        self.refreshDirs.update(rescan)
+        if gone:
+            self.imageSet.filter(lambda x: x.dir not in gone)
+        if len(self.imageSet) == 0:
+            Logger.info("SessionSnapshot: nothing left of the last session, scanning afresh")
+            self.sessionDirs = {}
+            self.refreshDirs = set()
+            return False
+
+        restat = []
+        if len(self.refreshDirs) > len(rescan):
+            restatDirs = self.refreshDirs.difference(rescan)
+            restat = [x.path for x in self.imageSet if x.dir in restatDirs]
+        Logger.info(f"SessionSnapshot: {len(rescan)} directories to re-read, {len(restat)} files to re-check, "
+                    f"{len(gone)} directories gone")
+        try:
+            scanWorkers = int(self.appConfig.get("Performance", "scan-workers"))
+        except:
+            scanWorkers = 8
+        # unchanged subdirectories of changed ones have nothing new
+        self.scanner = DirScanner(rescan, recursive=self.recursive, workers=scanWorkers,
+                                  skip=self.sessionDirs, files=restat)
+        self.scanEvent = Clock.schedule_interval(self._merge_scan_results, 0.1)
+        return True
+
+    def save_session(self):
+        """Snapshot the image list for next time, once it's complete"""
+        if self.session is None or self.scanEvent is not None or len(self.imageSet) == 0:
+            return
+        # kivy can stop twice on the way out, once is enough
+        session, self.session = self.session, None
+        session.save(self.imageSet, self._image_dirs(), scanSorted=self.scanSorted)
+
+    def _image_dirs(self):
+        """dir/ -> (mtime_ns, 'scan' or 'files') of everywhere images came from"""
+        dirs = dict(self.sessionDirs)
+        dirs.update((dirName, (mtime, 'scan')) for dirName, mtime in self.scanner.dirMtimes.items())
+        return dirs
+
+    def watch_dirs(self):
+        """Pick up images added to and removed from the scanned directories from now on"""
+        try:
+            watch = self.appConfig.getboolean("Performance", "watch-dirs")
+            pollSeconds = float(self.appConfig.get("Performance", "watch-poll-seconds"))
+        except:
+            watch = True
+            pollSeconds = 5
+        # new images would need their quality estimated before they could be let in
+        if not watch or self.dirWatcher is not None or self.maxQuality is not None:
+            return
+        dirMtimes = {dirName: mtime for dirName, (mtime, kind) in self._image_dirs().items() if kind == 'scan'}
+        if not dirMtimes:
+            return
+        from tiviewlib.DirWatcher import DirWatcher
+        self.dirWatcher = DirWatcher(dirMtimes, self.imageSet.names_by_dir, recursive=self.recursive,
+                                     pollSeconds=pollSeconds)
+        self.dirWatchEvent = Clock.schedule_interval(self._apply_dir_changes, 0.5)
+
+    def _apply_dir_changes(self, dt):
+        added, removed = self.dirWatcher.get_changes()
+        if not added and not removed:
+            return
+        hadImages = len(self.imageSet) > 0
+        # in order they go where sorting puts them, random and shuffled add them on the end
+        numNew = self.imageSet.extend(added, keepSorted=self.scanSorted)
+        numGone, currentGone = self.imageSet.discard(removed)
+        if not len(self.imageSet):
+            return
+        if currentGone or not hadImages:
+            self.change_to_image(self.imageSet.setPos)
+        elif numNew or numGone:
+            # same image on screen, but its neighbours may have changed
+            self.image.prefetch()
+        if numNew or numGone:
+            Logger.info(f"DirWatcher: {numNew} images arrived, {numGone} went, {len(self.imageSet)} now")
+            self.user_feedback(f"{numNew} new images, {numGone} gone" if numGone else f"{numNew} new images", 2)
+
+    def _merge_scan_batches(self, batches):
+        """Fold newly scanned images into the image set, keeping the current image where it is"""
+        if self.refreshDirs:
+            self.refreshSeen.update(found[0] for batch in batches for found in batch)
+        numNew = self.imageSet.extend((found for batch in batches for found in batch), keepSorted=self.scanSorted)
+        if numNew:
+            Logger.debug(f"Collected files - total so far: {len(self.imageSet)}")
+        return numNew
+
+    def _merge_scan_results(self, dt):
+        numNew = self._merge_scan_batches(self.scanner.get_batches())
+        numImages = len(self.imageSet)
+        if self.scanner.finished():
+            Clock.unschedule(self.scanEvent)
+            self.scanEvent = None
+            if self.refreshDirs:
+                # whatever the changed directories no longer have was deleted or moved away
+                refreshDirs, seen = self.refreshDirs, self.refreshSeen
+                self.refreshDirs, self.refreshSeen = set(), set()
+                if any(x.dir in refreshDirs and x.path not in seen for x in self.imageSet):
+                    self.filter_images(lambda x: x.dir not in refreshDirs or x.path in seen)
+            if self.scanner.dirsScanned > 0:
+                self.user_feedback(f"Found {numImages} images in {self.scanner.dirsScanned} directories", 2)
+            elif self.scanner.listed > 0:
+                self.user_feedback(f"Found {numImages} images", 2)
+            if self.imageSet.sortKey in ('dimensions', 'created'):
+                self.sort_by(self.imageSet.sortKey)
+            if self.maxQuality is not None:
+                self.start_quality_scan()
+            self.watch_dirs()
+        else:
+            self.user_feedback(f"Scanning... {self.scanner.dirsScanned} directories, {numImages} images so far", 1)
+        if numNew:
+            self.image.prefetch()
+
+    def start_batch_scan(self, scanClass, paths, message, finished):
+        """Run a BatchScan over paths showing progress, then finished(scan) on the main thread"""
+        if scanClass.kind in self.batchScans:
+            return
+        try:
+            scanWorkers = int(self.appConfig.get("Performance", "index-workers"))
+        except:
+            scanWorkers = None
+        scan = scanClass(paths, self.metadataIndex, workers=scanWorkers)
+
+        def check(dt):
+            if not scan.finished():
+                self.user_feedback(f"{message}... {scan.progress}/{len(scan.paths)}", 1)
+                return
+            del self.batchScans[scan.kind]
+            finished(scan)
+            return False
+        self.batchScans[scan.kind] = Clock.schedule_interval(check, 0.25)
+
+    def sort_by(self, sortKey):
+        """Switch to ordered by sortKey, reading image headers first if it needs them"""
+        # what to sort by once a header scan finishes, the last one asked for wins
+        self.pendingSortKey = sortKey
+        if sortKey in ('dimensions', 'created'):
+            paths = [x.path for x in self.imageSet if x.pixels is None]
+            if paths:
+                self.start_batch_scan(SortInfoScan, paths, "Reading image sizes and dates", self._sort_info_scanned)
+                return
+        if len(self.imageSet):
+            self.image.set_sort_key(sortKey)
+        self.user_feedback(f"Sorted by {SORT_NAMES[sortKey]}", 2)
+
+    def _sort_info_scanned(self, scan):
+        for img in self.imageSet:
+            if img.path not in scan.results:
+                continue
+            info = scan.results[img.path]
+            if info is None:
+                # unreadable, sorts last and isn't asked about again
+                img.pixels = math.inf
+                continue
+            width, height, captured = info
+            img.pixels = width * height
+            if captured is not None:
+                img.created = captured
+        # unless someone picked another order meanwhile
+        if self.pendingSortKey in ('dimensions', 'created'):
+            self.sort_by(self.pendingSortKey)
+
+    def next_sort_key(self):
+        """Cycle through the stat-backed orders"""
+        sortKeys = ['name', 'size', 'mtime', 'created', 'dimensions']
+        try:
+            sortKey = sortKeys[(sortKeys.index(self.imageSet.sortKey) + 1) % len(sortKeys)]
+        except ValueError:
+            sortKey = 'name'
+        self.sort_by(sortKey)
+
+    def find_duplicates(self):
+        """Hash every image, then put near-duplicates next to each other to cull"""
+        if self.imageSet.sortKey == 'duplicates':
+            self.next_dup_group()
+            return
+        paths = [x.path for x in self.imageSet if x.hashes is None]
+        if paths:
+            from tiviewlib.DupFinder import HashScan
+            self.start_batch_scan(HashScan, paths, "Hashing images for duplicates", self._hashes_scanned)
+        else:
+            self._group_duplicates()
+
+    def _hashes_scanned(self, scan):
+        for img in self.imageSet:
+            if img.path in scan.results:
+                # unreadable ones get [] so they aren't asked about again
+                img.hashes = scan.results[img.path] or []
+        self._group_duplicates()
+
+    def _group_duplicates(self):
+        from tiviewlib.DupFinder import group_duplicates
+        hashed = []
+        for img in self.imageSet:
+            img.dupGroup = None
+            if img.hashes:
+                hashed.append(img)
+        groups = group_duplicates([x.hashes[0] for x in hashed], [x.hashes[1] for x in hashed])
+        for group, members in enumerate(groups):
+            for i in members:
+                hashed[i].dupGroup = group
+        self.dupGroupCount = len(groups)
+        if not groups:
+            self.user_feedback("No duplicates found", 3)
+            return
+        self.image.set_sort_key('duplicates')
+        self.change_to_image(0)
+        self.giant_info(f"{len(groups)} groups of duplicates\n\nd for the next group, o to go back to sorting", 4)
+
+    def next_dup_group(self):
+        imageSet = self.imageSet
+        group = imageSet.current().dupGroup
+        pos = imageSet.setPos
+        while pos < len(imageSet) and group is not None and imageSet[pos].dupGroup == group:
+            pos += 1
+        if pos >= len(imageSet) or imageSet[pos].dupGroup is None:
+            pos = 0
+        self.change_to_image(pos)
+
+    def _on_image_changed(self, obj, source):
+        if self.keyDownAt is not None and self.navStart is None:
+            self.navStart = self.keyDownAt
+            self._wait_for_image()
+        imageSet = self.imageSet
+        if imageSet.sortKey != 'duplicates' or not len(imageSet):
+            return
+        group = imageSet.current().dupGroup
+        if group is None:
+            self.user_feedback("No more duplicates", 2)
+            return
+        # groups are contiguous, so find the ends of this one
+        start = end = imageSet.setPos
+        while start > 0 and imageSet[start - 1].dupGroup == group:
+            start -= 1
+        while end < len(imageSet) - 1 and imageSet[end + 1].dupGroup == group:
+            end += 1
+        self.user_feedback(f"Duplicate group {group + 1}/{self.dupGroupCount}: {imageSet.setPos - start + 1} of {end - start + 1}", 2)
+
+    def start_quality_scan(self):
+        """Estimate JPEG quality of every image, then sort lowest quality first"""
+        paths = self.imageSet.paths()
+        from tiviewlib.JpegQuality import QualityScan
+        self.start_batch_scan(QualityScan, paths, "Estimating JPEG quality", self._quality_scanned)
+
+    def _quality_scanned(self, scan):
+        for img in self.imageSet:
+            if img.path in scan.results:
+                img.quality = scan.results[img.path]
+        if self.maxQuality is not None:
+            self.filter_images(lambda x: x.quality is not None and x.quality <= self.maxQuality)
+        if len(self.imageSet):
+            self.image.set_sort_key('quality')
+        self.user_feedback(f"Sorted {len(self.imageSet)} images by JPEG quality, lowest first", 3)
+
+    def filter_images(self, keep):
+        """Drop images that keep(img) says no to, staying on the current image if it's kept"""
+        self.imageSet.filter(keep)
+        if not len(self.imageSet):
+            Logger.error("No images left after filtering!")
+            return
+        self.change_to_image(self.imageSet.setPos)
 
+    def on_size(self, obj, size):
+        """Make sure all children sizes adjust properly"""
+        #Logger.debug(f"Resizing image itself to {size[0]}x{size[1]}, obj={obj}")
+        self.image.size_hint_x = None
+        self.image.size_hint_y = None
+        self.image.width = size[0]
+        self.image.height = size[1]
+        self.image.xpos = 0
+        self.image.ypos = 0
+
+        self.sv.width = size[0]
+        self.sv.height = size[1]
+
+    def _make_feedback_button(self, size_hint, pos_hint):
+        button = Button(text='',
+                        font_name = "Times New Roman",
+                        font_size = self.user_feedback_font_size,
+                        size_hint=size_hint,
+                        pos_hint=pos_hint,
+                        color = (0, 0, 0, 0),
+                        background_color = (0, 0, 0, 0)
+                        )
+        self.add_widget(button)
+        return button
+
+    def _make_metadata_overlay(self):
         # metadata display with two columns for proper alignment
         self.metadata_outer = BoxLayout(orientation='vertical',
                                        size_hint=(0.9, None),
@@ -193,63 +629,58 @@ class ImageViewer(FloatLayout):
         self.metadata_container.add_widget(self.metadata_values)
         self.metadata_outer.add_widget(self.metadata_container)
 
-        self.add_widget(self.metadata_outer)
         self.metadata_outer.opacity = 0
+        self.add_widget(self.metadata_outer)
 
-    def _get_images(self):
-        self.imageSet['orderedList'] = []
-
-        # if no args passed in at all, use current directory as location for images
-        if sys.argv[1:] == []:
-            sys.argv[1:] = ['.']
-
-        # might get a file or dir as argv
-        toSort = False
-        
-        for inArg in sys.argv[1:]:
-            if os.path.isdir(inArg):
-                toSort = True
-                dirName = inArg
-                # append a / for dirName
-                if dirName[-1] != '/':
-                    dirName += '/'
-                try:
-                    for imgName in os.listdir(dirName):
-                        # until JPEG2000 support is hacked in, don't include those
-                        # also animated GIF seems to kill me
-                        #if imgName.lower().endswith(("jpeg", "jpg", "png", "gif", "jp2")):
-                        # endswith can be a string or tuple of strings
-                        if imgName.lower().endswith(("jpeg", "jpg", "png")):
-                            data = {'image': dirName + imgName, 'created': 0}
-                            self.imageSet['orderedList'].append(data)
-                except:
-                    Logger.error(f"Couldn't collect images from {dirName}")
-                Logger.debug(f"Collected files from {dirName} - total so far: {len(self.imageSet['orderedList'])}")
-            elif os.path.isfile(inArg):
-                toSort = False
-                data = {'image': inArg, 'created': 0}
-                self.imageSet['orderedList'].append(data)
-            else:
-                Logger.error(f"Input {inArg} is neither file nor directory. Ignoring.")
-
-        # they come in some random order, so put them in filename order
-        if toSort:
-            self.imageSet['orderedList'].sort(key=lambda x: x['image'])
-
-    def on_size(self, obj, size):
-        """Make sure all children sizes adjust properly"""
-        #Logger.debug(f"Resizing image itself to {size[0]}x{size[1]}, obj={obj}")
-        self.image.size_hint_x = None
-        self.image.size_hint_y = None
-        self.image.width = size[0]
-        self.image.height = size[1]
-        self.image.xpos = 0
-        self.image.ypos = 0
-
-        self.sv.width = size[0]
-        self.sv.height = size[1]
+    def _make_timing_hud(self):
+        # recent timings, sits above the feedback bar on the right
+        hud = Label(text='', font_name="RobotoMono-Regular",
+                    font_size=int(self.user_feedback_font_size * 0.5),
+                    size_hint=(0.5, 0.4),
+                    pos_hint={'right': 1, 'y': .07},
+                    halign='left', valign='bottom',
+                    padding=(10, 10),
+                    color=self.user_feedback_fg)
+        hud.bind(size=lambda *x: setattr(hud, 'text_size', hud.size))
+        with hud.canvas.before:
+            Color(*self.user_feedback_bg)
+            hudBg = Rectangle(pos=hud.pos, size=hud.size)
+        hud.bind(pos=lambda *x: setattr(hudBg, 'pos', hud.pos),
+                 size=lambda *x: setattr(hudBg, 'size', hud.size))
+        self.add_widget(hud)
+        return hud
+
+    def toggle_timing_hud(self):
+        """Show/hide recent hot path timings, frames get watched for hitches while it's up"""
+        if self.timingHudEvent is not None:
+            self.timingHudEvent.cancel()
+            self.timingHudEvent = None
+            trace.watch_frames(False)
+            self.remove_widget(self.timing_hud)
+            return
+        if self.timing_hud is None:
+            self.timing_hud = self._make_timing_hud()
+        elif self.timing_hud.parent is None:
+            self.add_widget(self.timing_hud)
+        trace.watch_frames(True)
+        self.update_timing_hud(0)
+        self.timingHudEvent = Clock.schedule_interval(self.update_timing_hud, 0.5)
+
+    def update_timing_hud(self, dt):
+        lines = [f"{'':16}{'n':>5}{'avg':>8}{'p95':>8}{'max':>8}  ms"]
+        for name, (count, mean, p95, worst) in sorted(trace.summary().items()):
+            lines.append(f"{name:16}{count:5d}{mean:8.1f}{p95:8.1f}{worst:8.1f}")
+        hits, misses = trace.counters['cache hit'], trace.counters['cache miss']
+        if hits + misses:
+            lines.append(f"cache {hits} hits, {misses} misses ({100 * hits / (hits + misses):.0f}% hit)")
+        lines.append(f"{Clock.get_fps():.0f} fps, loads averaging {self.imageCache.loadTime * 1000:.0f}ms")
+        lines.append(self.memoryGovernor.summary())
+        self.timing_hud.text = '\n'.join(lines)
 
     def user_feedback(self, text, clearTime=2):
+        # a place to put messages
+        if self.info_button is None:
+            self.info_button = self._make_feedback_button((1.0, 0.055), {'x':0, 'y':.01})
         self.info_button.text = text
         self.info_button.color = self.user_feedback_fg
         self.info_button.background_color = self.user_feedback_bg
@@ -257,11 +688,16 @@ class ImageViewer(FloatLayout):
         Clock.schedule_once(self.user_feedback_clear, clearTime)
 
     def user_feedback_clear(self, dt):
+        if self.info_button is None:
+            return
         self.info_button.text = ''
         self.info_button.color=(0,0,0,0)
         self.info_button.background_color=(0,0,0,0)
 
     def giant_info(self, text, clearTime=2):
+        # more massive messages can go here, for eg move-to locations
+        if self.giant_info_button is None:
+            self.giant_info_button = self._make_feedback_button((1.0, 0.75), {'x':0, 'y':.15})
         self.giant_info_button.text = text
         self.giant_info_button.color = self.user_feedback_fg
         self.giant_info_button.background_color = self.user_feedback_bg
@@ -269,181 +705,258 @@ class ImageViewer(FloatLayout):
         Clock.schedule_once(self.giant_info_clear, clearTime)
 
     def giant_info_clear(self, dt):
+        if self.giant_info_button is None:
+            return
         self.giant_info_button.text = ''
         self.giant_info_button.color=(0,0,0,0)
         self.giant_info_button.background_color=(0,0,0,0)
 
-    def estimate_jpeg_quality(self, image_path):
-        """Estimate JPEG quality from quantization tables"""
-        try:
-            img = Image.open(image_path)
-            if img.format != 'JPEG':
-                return "N/A (not JPEG)"
-            # Access quantization tables (if available)
-            qtables = img.quantization
-            if qtables:
-                # Simplified heuristic: Higher quality JPEGs have smaller quantization values
-                avg_q = np.mean([np.mean(table) for table in qtables.values()])
-                estimated_quality = max(0, min(100, int(100 - avg_q)))
-                return str(estimated_quality)
-            return "N/A (no qtables)"
-        except Exception as e:
-            Logger.error(f"Error estimating JPEG quality: {str(e)}")
-            return "N/A (error)"
-
     def show_exif_metadata(self):
-        """Run exiftool on current image and display filtered metadata"""
-        img = self.imageSet['orderedList'][self.imageSet['setPos']]
-        current_file = img['image']
-
-        try:
-            result = subprocess.run(
-                f'exiftool "{current_file}" | egrep "Date|Size|Encoding|Megapixel|MIME|Comment"',
-                shell=True, capture_output=True, text=True, timeout=5
-            )
-
-            if result.returncode == 0 and result.stdout.strip():
-                lines = result.stdout.strip().split('\n')
-                keys = []
-                values = []
-
-                # Add Directory as the first field
-                absolute_path = os.path.abspath(current_file)
-                directory_path = os.path.dirname(absolute_path)
-                directory_name = os.path.basename(directory_path) if directory_path else '.'
-                keys.append('Directory')
-                values.append(directory_name)
-
-                # Add Filename as the second field
-                keys.append('Filename')
-                values.append(os.path.basename(current_file))
-
-                # Add Image Quality as the third field
-                quality = self.estimate_jpeg_quality(current_file)
-                keys.append('Image Quality')
-                values.append(quality)
-
-                for line in lines:
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        keys.append(key.strip())
-                        values.append(value.strip())
-
-                self.metadata_header.text = 'TimelessIV File Info, Press Key to Dismiss'
-                self.metadata_keys.text = '\n'.join(keys)
-                self.metadata_values.text = '\n'.join(values)
-                self.metadata_outer.opacity = 1
-                # Unschedule any existing timer before scheduling a new one
-                if self.metadataEvent:
-                    Clock.unschedule(self.metadataEvent)
-                self.metadataEvent = Clock.schedule_once(lambda dt: setattr(self.metadata_outer, 'opacity', 0), 10)
-            else:
-                self.user_feedback("No metadata found or exiftool not available", 2)
-        except subprocess.TimeoutExpired:
-            self.user_feedback("Metadata lookup timed out", 2)
-        except Exception as e:
-            self.user_feedback(f"Error running exiftool: {str(e)}", 2)
-
-    # move or delete image
+        """Display filtered metadata of the current image, from the index if we have it"""
+        current_file = self.imageSet.current().path
+        fields = self.metadataIndex.get(current_file)
+        if fields is not None:
+            self._show_metadata_fields(current_file, fields)
+        else:
+            self.user_feedback("Reading metadata...", 1)
+            self.metadataIndex.lookup(current_file, self._metadata_loaded)
+
+    def _metadata_loaded(self, path, fields):
+        # user may have moved on while we were reading
+        if path != self.imageSet.current().path:
+            return
+        if fields is None:
+            self.user_feedback("No metadata found", 2)
+        else:
+            self._show_metadata_fields(path, fields)
+
+    def _show_metadata_fields(self, current_file, fields):
+        keys = []
+        values = []
+
+        # Add Directory as the first field
+        absolute_path = os.path.abspath(current_file)
+        directory_path = os.path.dirname(absolute_path)
+        directory_name = os.path.basename(directory_path) if directory_path else '.'
+        keys.append('Directory')
+        values.append(directory_name)
+
+        # Add Filename as the second field
+        keys.append('Filename')
+        values.append(os.path.basename(current_file))
+
+        for key, value in fields:
+            keys.append(key)
+            values.append(value)
+
+        if self.metadata_outer is None:
+            self._make_metadata_overlay()
+        self.metadata_header.text = 'TimelessIV File Info, Press Key to Dismiss'
+        self.metadata_keys.text = '\n'.join(keys)
+        self.metadata_values.text = '\n'.join(values)
+        self.metadata_outer.opacity = 1
+        # Unschedule any existing timer before scheduling a new one
+        if self.metadataEvent:
+            Clock.unschedule(self.metadataEvent)
+        self.metadataEvent = Clock.schedule_once(lambda dt: setattr(self.metadata_outer, 'opacity', 0), 10)
+
+    # move or delete image, the file itself goes in the background
     def move_image(self, destDir):
-        img = self.imageSet['orderedList'][self.imageSet['setPos']]
-        if os.path.exists(f"{destDir}/{img['image']}"):
-            self.user_feedback(f" ! img={destDir + '/' + img['image']} exists, not moving.")
-            Logger.critical(f"img={destDir}/{img['image']} exists! doing nothing.")
+        img = self.imageSet.current()
+        if img is None:
+            return
+        from tiviewlib.FileOps import FileOp
+        if "Trash" in destDir:
+            Logger.info(f"DELETE img={img.path} to destDir={destDir}")
+            self.user_feedback(f" x> TRASHED into {destDir}")
         else:
-            if "Trash" in destDir:
-                Logger.info(f"DELETE img={img['image']} to destDir={destDir}")
-                self.user_feedback(f" x> TRASHED into {destDir}")
-            else:
-                Logger.info(f"Move img={img['image']} to destDir={destDir}")
-                self.user_feedback(f" -> MOVED to {destDir}")
-            shutil.move(img['image'], destDir)
-            self.imageSet['orderedList'].remove(img)
-            self.change_to_image(self.imageSet['setPos'])
+            Logger.info(f"Move img={img.path} to destDir={destDir}")
+            self.user_feedback(f" -> MOVED to {destDir}")
+        op = FileOp('move', img.path, destDir, pos=self.imageSet.setPos)
+        op.recordIndex = self.imageSet.remove(img)
+        self.imageCache.rename(op.src, op.dest)
+        self._queue_file_op(op)
+        if len(self.imageSet):
+            self.change_to_image(self.imageSet.setPos)
 
     # copy an image elsewhere
     def copy_image(self, destDir):
-        img = self.imageSet['orderedList'][self.imageSet['setPos']]
-        if os.path.exists(f"{destDir}/{img['image']}"):
-            Logger.critical(f"img={destDir}/{img['image']} exists! doing nothing.")
-            self.user_feedback(f" ! img={destDir + '/' + img['image']} exists, not copying.")
+        img = self.imageSet.current()
+        if img is None:
+            return
+        from tiviewlib.FileOps import FileOp
+        Logger.info(f"Copy img={img.path} to destDir={destDir}")
+        self._queue_file_op(FileOp('copy', img.path, destDir))
+        self.user_feedback(f" >> COPIED to destDir={destDir}")
+
+    def undo_file_op(self):
+        """Take back the last move, trash or copy, putting a moved image back where it was"""
+        op = self.fileOps.undo() if self.fileOps is not None else None
+        if op is None:
+            self.user_feedback("Nothing to undo", 2)
+            return
+        self.user_feedback(f" <- undoing {op.kind} of {os.path.basename(op.src)}", 2)
+        self._watch_file_ops()
+
+    def _queue_file_op(self, op):
+        if self.fileOps is None:
+            from tiviewlib.FileOps import FileOpQueue
+            self.fileOps = FileOpQueue(self.fileOpHistory)
+        self.fileOps.submit(op)
+        self._watch_file_ops()
+
+    def _watch_file_ops(self):
+        if self.fileOpEvent is None:
+            self.fileOpEvent = Clock.schedule_interval(self._file_ops_done, 0.1)
+
+    def _file_ops_done(self, dt):
+        for op, action in self.fileOps.finished():
+            name = os.path.basename(op.src)
+            if op.state == 'failed':
+                self.user_feedback(f" ! couldn't {op.kind} {name} to {op.destDir}: {op.error}", 4)
+                if op.kind == 'move':
+                    self._put_back(op)
+            elif op.state == 'undo-failed':
+                self.user_feedback(f" ! couldn't undo {op.kind} of {name}: {op.error}", 4)
+            elif action == 'undo':
+                if op.kind == 'move':
+                    self._put_back(op)
+                    self.user_feedback(f" <- put back {op.src}", 2)
+                else:
+                    self.user_feedback(f" <- removed copy {op.dest}", 2)
+        if self.fileOps.idle():
+            self.fileOpEvent = None
+            return False
+
+    def _put_back(self, op):
+        """A move didn't happen after all, the image goes back in the set and on screen"""
+        self.imageCache.rename(op.dest, op.src)
+        pos = self.imageSet.reinsert(op.recordIndex, op.pos)
+        self.change_to_image(pos)
+
+    def toggle_album(self):
+        """Show/hide the thumbnail grid of the whole image set"""
+        if self.albumView is None:
+            from tiviewlib.ThumbnailCache import ThumbnailCache
+            from tiviewlib.AlbumView import AlbumView
+            try:
+                thumbSize = int(self.appConfig.get("Performance", "thumb-size"))
+                thumbCacheMB = int(self.appConfig.get("Performance", "thumb-cache-mb"))
+                thumbWorkers = int(self.appConfig.get("Performance", "thumb-workers"))
+            except:
+                thumbSize = 256
+                thumbCacheMB = 512
+                thumbWorkers = 4
+            self.thumbnailCache = ThumbnailCache(thumbSize=thumbSize, budgetMB=thumbCacheMB, workers=thumbWorkers)
+            self.albumView = AlbumView(imageSet=self.imageSet, thumbnailCache=self.thumbnailCache,
+                                       on_select=self.album_selected)
+            self.memoryGovernor.register('thumbnails', self.albumView.memory_used, self.albumView.shrink)
+
+        if self.albumView.parent:
+            self.hide_album()
         else:
-            Logger.info(f"Copy img={img['image']} to destDir={destDir}")
-            shutil.copy(img['image'], destDir)
-            self.user_feedback(f" >> COPIED to destDir={destDir}")
+            self.albumView.refresh()
+            # above the image, below the feedback buttons
+            self.add_widget(self.albumView, index=len(self.children) - 1)
+
+    def hide_album(self):
+        self.remove_widget(self.albumView)
+        self.albumView.close()
+
+    def album_selected(self, path):
+        self.hide_album()
+        # image set can change under the grid while scanning, so go by path
+        pos = self.imageSet.position(path)
+        if pos is not None:
+            self.change_to_image(pos)
 
     def reset_scrollpos(self):
         self.sv.scroll_x = 0
         self.sv.scroll_y = 0
 
     def change_to_image(self, image_pos):
-        self.imageSet['setPos'] = image_pos
-        self.image.source = self.image.gen_image()
-        self.image.reload()
+        self.image.show_image(image_pos)
 
     def _keyboard_closed(self):
         self._keyboard.unbind(on_key_down=self._on_keyboard_down)
         self._keyboard = None
 
-    def calc_scroll_amt(self, direction, modifiers):
-        # modify how much we scroll with keys
-        if self.scrollingDir[direction] == True:
-            self.scrollPix += self.progressiveSpeed
-        else:
-            self.scrollPix = self.progressiveReset
-
-        if 'shift' in modifiers:
-            tX = int(self.scrollPix / 2) + 1
-        elif 'ctrl' in modifiers:
-            tX = int(self.scrollPix / 5) + 1
-        elif 'alt' in modifiers:
-            tX = int(self.scrollPix / 18) + 1
+    def _on_keyboard_up(self, keyboard, keycode):
+        self.keyDownAt = None
+        self.heldKey = None
+        self.image.set_moving(False)
+        self.panner.release(keycode[1])
+
+    def _keys_lost(self):
+        self.panner.stop()
+        self.heldKey = None
+        self.image.set_moving(False)
+
+    def _wait_for_image(self, *args):
+        # the next frame drawn once it's decoded is the one with the new image
+        self.image.unbind(texture=self._wait_for_image)
+        if self.image.shown == self.image.source:
+            Window.bind(on_flip=self._navigation_drawn)
         else:
-            tX = self.scrollPix
+            self.image.bind(texture=self._wait_for_image)
 
-        # now record which way are we scrolling
-        self.scrollingDir = [False, False, False, False]
-        self.scrollingDir[direction] = True
+    def _navigation_drawn(self, window):
+        Window.unbind(on_flip=self._navigation_drawn)
+        trace.add('key to image', self.navStart, time.perf_counter() - self.navStart, self.image.source)
+        self.navStart = None
 
-        return self.sv.convert_distance_to_scroll(tX, tX)
+    def slideshowNextImage(self):
+        self.image.next_image(self.imageSet.changeType)
 
-    def _on_keyboard_up(self, keyboard, keycode):
-        # unschedule the keep-on-scrolling f()
-        Clock.unschedule(self.scrollEvent, all=True)
-        self.scrollEvent = None
-        self.scrollPix = self.progressiveReset
-
-    def keep_on_scrollin(self, dx):
-        if self.scrollingDir[0] == True:
-            self.sv.scroll_y += self.scrollAmount[1]
-        elif self.scrollingDir[1] == True:
-            self.sv.scroll_y -= self.scrollAmount[1]
-        elif self.scrollingDir[2] == True:
-            self.sv.scroll_x -= self.scrollAmount[0]
-        elif self.scrollingDir[3] == True:
-            self.sv.scroll_x += self.scrollAmount[0]
-
-    def slideshowNextImage(self, dx):
-        self.image.next_image(self.image.imageSet['changeType'])
+    def stop_slideshow(self):
+        self.slideshow.stop()
+        Logger.info(self.slideshow.summary())
+        if self.slideshow.missed:
+            self.user_feedback(self.slideshow.summary(), 4)
 
     def _on_keyboard_down(self, keyboard, keycode, text, modifiers):
         Logger.debug(f"keypress - keycode={keycode}, text={text}, modifiers={modifiers}")
+        self.keyDownAt = time.perf_counter()
+        # held keys repeat their key-down with no key-up in between
+        self.image.set_moving(keycode[1] == self.heldKey)
+        self.heldKey = keycode[1]
 
         # keyboard events hide the cursor
         Window.show_cursor = False
 
         # any keypress clears the giant info display and metadata display
-        if self.giant_info_button.text != '' or self.metadata_outer.opacity > 0:
+        giantShowing = self.giant_info_button is not None and self.giant_info_button.text != ''
+        metadataShowing = self.metadata_outer is not None and self.metadata_outer.opacity > 0
+        if giantShowing or metadataShowing:
             Clock.unschedule(self.giant_info_clear, all=True)
             self.giant_info_clear(0)
             if self.metadataEvent:
                 Clock.unschedule(self.metadataEvent)
                 self.metadataEvent = None
-            self.metadata_outer.opacity = 0
+            if self.metadata_outer is not None:
+                self.metadata_outer.opacity = 0
             # only return early (prevent retriggering) if 'i' was pressed
             if text == 'i':
                 return True
 
+        # THUMBNAIL GRID ----
+        if self.albumView is not None and self.albumView.parent:
+            if text == 'g':
+                self.hide_album()
+                return True
+            elif keycode[1] == 'enter':
+                self.albumView.select()
+                return True
+            elif keycode[1] in ('left', 'right', 'up', 'down', 'pageup', 'pagedown', 'home', 'end'):
+                moves = {'left': -1, 'right': 1, 'home': -len(self.imageSet),
+                         'end': len(self.imageSet)}
+                rowMoves = {'up': -1, 'down': 1, 'pageup': -5, 'pagedown': 5}
+                if keycode[1] in moves:
+                    self.albumView.move_selection(moves[keycode[1]])
+                else:
+                    self.albumView.move_selection_rows(rowMoves[keycode[1]])
+                return True
+
         # list of potential doublekeys
         doubleKeycodes = {'c': "Copy File", 'm': "Move File", 'q': "Quit Viewer"}
 
@@ -452,9 +965,8 @@ class ImageViewer(FloatLayout):
         or (keycode[0] >= 48 and keycode[0] <= 57) \
         or (keycode[1] in '!@#$%^&*()_+-=\{\}[]:;<>?,./"\''):
             # many keyboard events cancel the slideshow
-            if self.slideshowEvent and text != 's':
-                Clock.unschedule(self.slideshowEvent, all=True)
-                self.slideshowEvent = None
+            if self.slideshow.running and text != 's':
+                self.stop_slideshow()
 
             # is this a potential double-key combo?
             currTs = time.time()
@@ -503,29 +1015,15 @@ class ImageViewer(FloatLayout):
 
         # DELETION ----
         if keycode[1] == 'delete':
-            self.move_image(self.imageSet['del_dir'])
+            self.move_image(self.imageSet.delDir)
         if keycode[1] == 'backspace' and 'meta' in modifiers:
-            self.move_image(self.imageSet['del_dir'])
+            self.move_image(self.imageSet.delDir)
         # PANNING ----
-        if keycode[1] == 'up':
-            self.scrollAmount = self.calc_scroll_amt(0, modifiers)
-            if self.scrollEvent == None:
-                self.scrollEvent = Clock.schedule_interval(self.keep_on_scrollin, self.scrollScheduleInterval)
-        elif keycode[1] == 'down':
-            self.scrollAmount = self.calc_scroll_amt(1, modifiers)
-            if self.scrollEvent == None:
-                self.scrollEvent = Clock.schedule_interval(self.keep_on_scrollin, self.scrollScheduleInterval)
-        elif keycode[1] == 'left':
-            self.scrollAmount = self.calc_scroll_amt(2, modifiers)
-            if self.scrollEvent == None:
-                self.scrollEvent = Clock.schedule_interval(self.keep_on_scrollin, self.scrollScheduleInterval)
-        elif keycode[1] == 'right':
-            self.scrollAmount = self.calc_scroll_amt(3, modifiers)
-            if self.scrollEvent == None:
-                self.scrollEvent = Clock.schedule_interval(self.keep_on_scrollin, self.scrollScheduleInterval)
+        if self.panner.press(keycode[1], modifiers):
+            pass
         # SLIDESHOW -----
         elif text == 's':
-            if self.slideshowEvent:
+            if self.slideshow.running:
                 if "shift" in modifiers:
                     self.slideshowInterval = min(math.ceil(self.slideshowInterval * 1.65), 120)
                 else:
@@ -534,15 +1032,12 @@ class ImageViewer(FloatLayout):
             self.appConfig.set("UI", "slideshow-interval", str(self.slideshowInterval))
             schedTiming = int(self.slideshowInterval)
 
-            # if starting slideshow, pull next image, then schedule more on interval
-            if not self.slideshowEvent:
-                self.image.next_image(self.image.imageSet['changeType'])
-                self.slideshowEvent = Clock.schedule_interval(self.slideshowNextImage, schedTiming)
+            # if starting slideshow, pull next image (once decoded), then more on interval
+            if not self.slideshow.running:
+                self.slideshow.start(schedTiming)
                 self.user_feedback(f"Slideshow started with interval {schedTiming} seconds. Shift-S and s change interval.", 2)
             else:
-                Clock.unschedule(self.slideshowEvent, all=True)
-                self.slideshowEvent = None
-                self.slideshowEvent = Clock.schedule_interval(self.slideshowNextImage, schedTiming)
+                self.slideshow.set_interval(schedTiming)
                 self.user_feedback(f"New slideshow interval {schedTiming} seconds. Shift-S and s change interval.", 2)
         # IMAGE CHANGING -----
         elif keycode[1] == 'pagedown':
@@ -550,11 +1045,9 @@ class ImageViewer(FloatLayout):
         elif keycode[1] == 'pageup':
             self.image.prev_image('ordered')
         elif keycode[1] == 'home':
-            self.image.imageSet['setPos'] = 0
-            self.image.source = self.image.gen_image()
+            self.change_to_image(0)
         elif keycode[1] == 'end':
-            self.image.imageSet['setPos'] = len(self.image.imageSet['orderedList']) - 1
-            self.image.source = self.image.gen_image()
+            self.change_to_image(len(self.imageSet) - 1)
         elif text in ("'", '"'):
             if 'ctrl' in modifiers:
                 self.image.next_image('ordered', 50)
@@ -585,8 +1078,8 @@ class ImageViewer(FloatLayout):
                 self.size = Window.size
             else:
                 self.imgZoom *= 0.9
-                self.image.size[0] = self.image.texture_size[0] * self.imgZoom
-                self.image.size[1] = self.image.texture_size[1] * self.imgZoom
+                self.image.size[0] = self.image.full_size()[0] * self.imgZoom
+                self.image.size[1] = self.image.full_size()[1] * self.imgZoom
                 self.image.zoomMode = 'pan'
                 self.image.set_window_pos()
         elif text in ("=", "+"):
@@ -596,31 +1089,36 @@ class ImageViewer(FloatLayout):
                 self.size = Window.size
             else:
                 self.imgZoom *= 1.1
-                self.image.size[0] = self.image.texture_size[0] * self.imgZoom
-                self.image.size[1] = self.image.texture_size[1] * self.imgZoom
+                self.image.want_full_res()
+                self.image.size[0] = self.image.full_size()[0] * self.imgZoom
+                self.image.size[1] = self.image.full_size()[1] * self.imgZoom
                 self.image.zoomMode = 'pan'
                 self.image.set_window_pos()
         elif text == '2':
             self.imgZoom = 2
-            self.image.size[0] = self.image.texture_size[0] * self.imgZoom
-            self.image.size[1] = self.image.texture_size[1] * self.imgZoom
+            self.image.want_full_res()
+            self.image.size[0] = self.image.full_size()[0] * self.imgZoom
+            self.image.size[1] = self.image.full_size()[1] * self.imgZoom
             self.image.zoomMode = 'pan'
             self.image.set_window_pos()
         elif text == '3':
             self.imgZoom = 3
-            self.image.size[0] = self.image.texture_size[0] * self.imgZoom
-            self.image.size[1] = self.image.texture_size[1] * self.imgZoom
+            self.image.want_full_res()
+            self.image.size[0] = self.image.full_size()[0] * self.imgZoom
+            self.image.size[1] = self.image.full_size()[1] * self.imgZoom
             self.image.zoomMode = 'pan'
             self.image.set_window_pos()
         elif text == '4':
             self.imgZoom = 4
-            self.image.size[0] = self.image.texture_size[0] * self.imgZoom
-            self.image.size[1] = self.image.texture_size[1] * self.imgZoom
+            self.image.want_full_res()
+            self.image.size[0] = self.image.full_size()[0] * self.imgZoom
+            self.image.size[1] = self.image.full_size()[1] * self.imgZoom
             self.image.zoomMode = 'pan'
             self.image.set_window_pos()
         elif text in ('z', '1'):
             # view 1:1
             self.imgZoom = 1
+            self.image.want_full_res()
             self.image.zoomMode = 'pan'
             self.image.set_window_pos()
             self.image.be_zoom_1_to_1()
@@ -634,6 +1132,23 @@ class ImageViewer(FloatLayout):
         # METADATA INFO -----
         elif text == 'i':
             self.show_exif_metadata()
+        # TIMING HUD -----
+        elif text == 't':
+            self.toggle_timing_hud()
+        # UNDO MOVE/COPY/TRASH -----
+        elif text == 'u':
+            self.undo_file_op()
+        # THUMBNAIL GRID -----
+        elif text == 'g':
+            self.toggle_album()
+        # SORT ORDER -----
+        elif text == 'o':
+            self.next_sort_key()
+        elif text == 'j':
+            self.start_quality_scan()
+        # DUPLICATES -----
+        elif text == 'd':
+            self.find_duplicates()
         # # This shit never works and it crashes if window is already fullscreen
         # elif text == 'f':
         #     if self.fullscreen_mode == False:
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+from tiviewlib.BatchScan import BatchScan
+
+# DQT tables are stored in zigzag order, this is where each entry goes in the 8x8 block
+ZIGZAG = [0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+          12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+          35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+          58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63]
+
+# JPEG spec Annex K tables that libjpeg scales by quality, natural order
+STD_LUMINANCE = [16, 11, 10, 16, 24, 40, 51, 61,
+                 12, 12, 14, 19, 26, 58, 60, 55,
+                 14, 13, 16, 24, 40, 57, 69, 56,
+                 14, 17, 22, 29, 51, 87, 80, 62,
+                 18, 22, 37, 56, 68, 109, 103, 77,
+                 24, 35, 55, 64, 81, 104, 113, 92,
+                 49, 64, 78, 87, 103, 121, 120, 101,
+                 72, 92, 95, 98, 112, 100, 103, 99]
+STD_CHROMINANCE = [17, 18, 24, 47, 99, 99, 99, 99,
+                   18, 21, 26, 66, 99, 99, 99, 99,
+                   24, 26, 56, 99, 99, 99, 99, 99,
+                   47, 66, 99, 99, 99, 99, 99, 99] + [99] * 32
+
+def _ijg_tables():
+    """What libjpeg writes for every quality 1..100, shape (100, 2, 64)"""
+    quality = np.arange(1, 101)
+    scale = np.where(quality < 50, 5000 // quality, 200 - 2 * quality)
+    std = np.array([STD_LUMINANCE, STD_CHROMINANCE])
+    tables = (std[None, :, :] * scale[:, None, None] + 50) // 100
+    return np.clip(tables, 1, 255)
+
+IJG_TABLES = _ijg_tables()
+
+def quality_from_tables(qtables):
+    """
+    IJG quality (1-100) whose scaled standard tables are closest to qtables,
+    a {table id: 64 values in natural order} dict like PIL's quantization.
+    """
+    if not qtables or 0 not in qtables:
+        return None
+    error = np.abs(IJG_TABLES[:, 0, :] - np.asarray(qtables[0])).sum(axis=1)
+    if 1 in qtables:
+        error += np.abs(IJG_TABLES[:, 1, :] - np.asarray(qtables[1])).sum(axis=1)
+    return int(np.argmin(error)) + 1
+
+def read_qtables(path):
+    """
+    Quantization tables of a JPEG straight from its DQT segments, in natural
+    order. Stops at the start of scan, so no image data is read at all.
+    Returns None for anything that isn't a JPEG.
+    """
+    qtables = {}
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                break
+            if byte != b'\xff':
+                continue
+            marker = f.read(1)
+            # fill bytes, then markers without a length
+            while marker == b'\xff':
+                marker = f.read(1)
+            if not marker or marker == b'\xda' or marker == b'\xd9':
+                break
+            if marker in (b'\x01', b'\x00') or b'\xd0' <= marker <= b'\xd7':
+                continue
+            lengthBytes = f.read(2)
+            length = int.from_bytes(lengthBytes, 'big') - 2
+            # cut short, or a length that doesn't even cover itself - seeking back would go round forever
+            if len(lengthBytes) < 2 or length < 0:
+                break
+            if marker != b'\xdb':
+                f.seek(length, os.SEEK_CUR)
+                continue
+            segment = f.read(length)
+            if len(segment) != length:
+                break
+            pos = 0
+            while pos < len(segment):
+                precision, tableId = segment[pos] >> 4, segment[pos] & 15
+                pos += 1
+                if precision:
+                    values = np.frombuffer(segment[pos:pos + 128], dtype='>u2')
+                    pos += 128
+                else:
+                    values = np.frombuffer(segment[pos:pos + 64], dtype=np.uint8)
+                    pos += 64
+                natural = np.empty(64, dtype=np.int64)
+                natural[ZIGZAG] = values
+                qtables[tableId] = natural
+    return qtables
+
+def file_quality(path):
+    """Estimated quality of a JPEG file, None if it isn't one (or is broken)"""
+    try:
+        return quality_from_tables(read_qtables(path))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class QualityScan(BatchScan):
+    """Estimated quality of every path, None for non-JPEGs"""
+    kind = 'quality'
+    work = staticmethod(file_quality)
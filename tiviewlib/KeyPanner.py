@@ -0,0 +1,73 @@
+import time
+
+from kivy.clock import Clock
+
+# arrow key -> which way it moves the view
+DIRECTIONS = {'up': (0, 1), 'down': (0, -1), 'left': (-1, 0), 'right': (1, 0)}
+# held modifier -> how much slower, for fine positioning
+MODIFIER_DIVISORS = (('shift', 2), ('ctrl', 5), ('alt', 18))
+# a stalled frame (decoding, GC) shouldn't turn into a jump across the image
+MAX_STEP = 0.1
+
+class KeyPanner:
+    """
+    Pans a ScrollView while arrow keys are held. Steps once per rendered frame
+    by the time since the last one, so speed doesn't depend on frame rate or
+    timer jitter. Each key is tracked on its own, two at once go diagonally.
+    Speed starts at speed px/s and grows by accel px/s every second the key
+    stays down, up to maxSpeed. Nothing is scheduled while no key is held.
+    """
+
+    def __init__(self, scrollView, speed=1500, accel=3000, maxSpeed=12000):
+        self.sv = scrollView
+        self.speed = speed
+        self.accel = accel
+        self.maxSpeed = maxSpeed
+        # key -> when it went down, key repeat doesn't reset it
+        self.held = {}
+        self.divisor = 1
+        self.event = None
+
+    def press(self, key, modifiers):
+        """Start (or keep) panning for key. False if it isn't an arrow key."""
+        if key not in DIRECTIONS:
+            return False
+        self.held.setdefault(key, time.monotonic())
+        self.divisor = next((divisor for modifier, divisor in MODIFIER_DIVISORS if modifier in modifiers), 1)
+        if self.event is None:
+            # interval 0 is once per frame
+            self.event = Clock.schedule_interval(self._step, 0)
+        return True
+
+    def release(self, key):
+        self.held.pop(key, None)
+        if not self.held:
+            self.stop()
+
+    def stop(self):
+        self.held.clear()
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+
+    def _step(self, dt):
+        if not self.held or not self.sv.children:
+            self.event = None
+            return False
+        dt = min(dt, MAX_STEP)
+        now = time.monotonic()
+        dx = dy = 0
+        for key, since in self.held.items():
+            speed = min(self.maxSpeed, self.speed + self.accel * (now - since)) / self.divisor
+            directionX, directionY = DIRECTIONS[key]
+            dx += directionX * speed * dt
+            dy += directionY * speed * dt
+
+        # scroll_x/y go 0..1 over however much of the content doesn't fit
+        content = self.sv.children[0]
+        spareX = content.width - self.sv.width
+        spareY = content.height - self.sv.height
+        if dx and spareX > 0:
+            self.sv.scroll_x = min(1, max(0, self.sv.scroll_x + dx / spareX))
+        if dy and spareY > 0:
+            self.sv.scroll_y = min(1, max(0, self.sv.scroll_y + dy / spareY))
@@ -3,22 +3,48 @@ import sys
 import math
 import random
 import shutil
+import time
 
-import reusables
 from kivy.uix.image import Image
 from kivy.core.window import Window
-from kivy.loader import Loader
 from kivy.logger import Logger
+from tiviewlib.Animation import AnimationPlayer
+from tiviewlib.TileLayer import TileLayer
+from tiviewlib.Trace import trace
+
+# on the move, images passed over are only decoded when decodes take less than
+# this - anything slower would be for somewhere long gone by the time it's done
+MOVING_DECODE_SECONDS = 0.1
 
 class MainImage(Image):
 
     def __init__(self,
             imageSet=None,
+            imageCache=None,
+            metadataIndex=None,
+            tileLayerConfig=None,
             log=None,
             **kwargs):
         self.imageSet = imageSet
+        self.imageCache = imageCache
+        self.metadataIndex = metadataIndex
+        self.tileLayer = None
         self.zoomMode = 'fit'
-        super().__init__(source=self.gen_image(), **kwargs)
+        # full resolution size of what is showing, texture may be smaller
+        self.fullSize = None
+        self.fullResWanted = False
+        # path whose texture is showing, source can be ahead of it while decoding
+        self.shown = None
+        # AnimationPlayer for an animated image on screen
+        self.animation = None
+        # asked the cache for and not shown yet
+        self.waitingFor = None
+        # held key navigation, and the one decode it's allowed at a time
+        self.moving = False
+        self.inFlight = None
+        self.settledAt = None
+        # imageCache does the caching, kivy keeping a copy too would double up
+        super().__init__(source=self.gen_image(), nocache=imageCache is not None, **kwargs)
 
         # can be bigger than bounding widget
         self.allow_stretch = True
@@ -26,12 +52,167 @@ class MainImage(Image):
         # enable texture interpolation for better quality when downscaling
         self.bind(texture=self._on_texture_update)
 
+        # images too big for one texture get drawn from tiles when zoomed in
+        if tileLayerConfig is not None:
+            self.tileLayer = TileLayer(self, **tileLayerConfig)
+
     def _on_texture_update(self, instance, texture):
         """Enable linear/bicubic interpolation for better quality when downscaling"""
         if texture:
             texture.mag_filter = 'linear'
             texture.min_filter = 'linear'
 
+    def texture_update(self, *largs):
+        """Show the decoded texture from the cache, or keep showing the last one until it's decoded"""
+        self.fullSize = None
+        self.stop_animation()
+        if self.tileLayer is not None:
+            self.tileLayer.clear()
+        if self.imageCache is None or not self.source:
+            return super().texture_update(*largs)
+
+        if self.waitingFor not in (None, self.source):
+            # skipped past before it was decoded, the decode threads have better things to do
+            self.imageCache.cancel(self.waitingFor)
+        self.waitingFor = None
+        entry = self._request()
+        trace.count('cache miss' if entry is None else 'cache hit')
+
+    def _request(self):
+        if self.inFlight is not None and not self.imageCache.loading(self.inFlight):
+            # decoded, dropped, or skipped past before it started
+            self.inFlight = None
+        # on the move, only decode once the last one's done, for wherever we've got to by then
+        decode = not self.moving or (self.inFlight is None and self.imageCache.loadTime < MOVING_DECODE_SECONDS)
+        entry = self.imageCache.request(self.source, self._decoded, self._preview, decode=decode)
+        if entry is not None:
+            self._show(self.source, entry)
+            return entry
+        self.waitingFor = self.source
+        if decode:
+            self.inFlight = self.source
+        return None
+
+    def set_moving(self, moving):
+        """
+        Held key navigation. While moving, images passed over get a preview,
+        and if decodes are quick, a decode when there's none under way
+        already - so there's at most one decode to wait for once it stops.
+        """
+        if moving == self.moving or self.imageCache is None:
+            return
+        self.moving = moving
+        if moving:
+            self.imageCache.cancel_prefetches()
+            return
+        if self.waitingFor == self.source:
+            self.settledAt = time.perf_counter()
+            if self.inFlight != self.source:
+                self._request()
+        self.prefetch()
+
+    def _preview(self, path, entry):
+        # something to look at until the real decode lands
+        if path != self.source or self.waitingFor != path:
+            return
+        trace.count('preview shown')
+        self.texture = entry.texture
+        self.fullSize = entry.fullSize
+
+    def _decoded(self, path, entry):
+        if path == self.inFlight:
+            self.inFlight = None
+        if path != self.source:
+            # moved on while it was decoding, it's in the cache for coming back
+            if self.waitingFor == self.source and self.inFlight is None:
+                self._request()
+            return
+        self.waitingFor = None
+        if entry is None:
+            Logger.error(f"Image: Error loading <{path}>")
+        self._show(path, entry)
+
+    def _show(self, path, entry):
+        if self._coreimage:
+            self._coreimage.unbind(on_texture=self._on_tex_change)
+            self._coreimage = None
+        self.shown = path
+        self.stop_animation()
+        if self.settledAt is not None:
+            trace.add('stop to image', self.settledAt, time.perf_counter() - self.settledAt, path)
+            self.settledAt = None
+        if entry is None:
+            self.texture = None
+            return
+        self.texture = entry.texture
+        self.fullSize = entry.fullSize
+        if entry.animated:
+            self.animate(None if self.fullResWanted else self.imageCache.decodeSize)
+        elif self.fullResWanted:
+            self.want_full_res()
+
+    def animate(self, maxSize):
+        """Play the animation on screen from its first frame, frames fit inside maxSize"""
+        self.stop_animation()
+        self.animation = AnimationPlayer(self.source, maxSize, self._animation_frame)
+
+    def stop_animation(self):
+        if self.animation is not None:
+            self.animation.stop()
+            self.animation = None
+
+    def animation_memory_used(self):
+        """Bytes the animation playing holds, for the memory governor"""
+        return 0 if self.animation is None else self.animation.memory_used()
+
+    def shrink_animation(self, target):
+        return 0 if self.animation is None else self.animation.shrink(target)
+
+    def _animation_frame(self, texture):
+        self.texture = texture
+
+    def show_image(self, pos=None):
+        """Go to pos (or back to setPos), decoding it if needed - every change of image comes here"""
+        if pos is not None:
+            self.imageSet.setPos = pos
+        source = self.gen_image()
+        if source == self.source:
+            # setting source to what it is already wouldn't show anything new
+            self.texture_update()
+        else:
+            self.source = source
+        if not self.moving:
+            self.prefetch()
+
+    def prefetch(self):
+        if self.imageCache is not None:
+            self.imageCache.prefetch(self.imageSet)
+            if self.metadataIndex is not None:
+                self.metadataIndex.prefetch([self.source] + self.imageCache.neighbours(self.imageSet))
+
+    def full_size(self):
+        """Size of the image at 1:1, even while showing a display-res texture"""
+        return self.fullSize or self.texture_size
+
+    def want_full_res(self):
+        """Zooming in needs real pixels - swap in the full resolution texture once loaded"""
+        self.fullResWanted = True
+        if self.animation is not None:
+            # frames come from the player, so it's the player that needs to decode them bigger
+            if self.animation.maxSize is not None and self.fullSize != tuple(self.texture_size):
+                self.animate(None)
+            return
+        if self.tileLayer is not None and self.source and self.tileLayer.wants(self.full_size()):
+            # never the whole thing as one texture, just what's in view
+            self.tileLayer.show(self.source)
+            return
+        if self.imageCache is not None and self.source:
+            self.imageCache.upgrade(self.source, self._full_res_loaded)
+
+    def _full_res_loaded(self, path, entry):
+        if path == self.source and entry is not None:
+            self.texture = entry.texture
+
     def set_window_pos(self):
         # make sure image doesn't go wonky if it's smaller than
         # the display window - otherwise try to centerish it
@@ -48,56 +229,38 @@ class MainImage(Image):
             self.y = int(deltaY / 2)
 
     def be_zoom_1_to_1(self):
-        self.size = self.texture_size
+        self.size = self.full_size()
         self.set_window_pos()
 
     def be_zoom_fit(self):
+        self.fullResWanted = False
+        if self.tileLayer is not None:
+            self.tileLayer.clear()
         self.size = Window.size
         self.set_window_pos()
 
     def flip_image_changeType(self, changeType):
-        if changeType != self.imageSet['changeType']:
-            Logger.debug(f"Flipping from {self.imageSet['changeType']} to {changeType}")
-            tmpImg = self.imageSet['orderedList'][self.imageSet['setPos']]
-            if changeType == 'ordered':
-                Logger.debug("Ordering!")
-                self.imageSet['orderedList'].sort(key=lambda x: x['image'])
-            elif changeType == 'shuffled':
-                Logger.debug("Shuffling!")
-                # only need to order them if not already ordered
-                if self.imageSet['changeType'] != 'ordered':
-                    self.imageSet['orderedList'].sort(key=lambda x: x['image'])
-                # shuffling, not totally randomised
-                for i in range(len(self.imageSet['orderedList'])):
-                    if i < len(self.imageSet['orderedList']) - 20:
-                        swapIndex = random.randint(i+1, i+20)
-                    else:
-                        swapIndex = random.randint(0, len(self.imageSet['orderedList']) - i)
-                    self.imageSet['orderedList'][i], self.imageSet['orderedList'][swapIndex] = self.imageSet['orderedList'][swapIndex], self.imageSet['orderedList'][i]
-            else:
-                Logger.debug("Randoming!")
-                self.imageSet['orderedList'].sort(key=lambda x: random.randint(0,999999999))
-
-            self.imageSet['changeType'] = changeType
-            self.imageSet['setPos'] = self.imageSet['orderedList'].index(tmpImg)
-            self.source = self.gen_image()
+        if changeType != self.imageSet.changeType:
+            Logger.debug(f"Flipping from {self.imageSet.changeType} to {changeType}")
+            self.imageSet.set_order(changeType)
+            self.show_image()
+
+    def set_sort_key(self, sortKey):
+        """Re-sort by something else, staying on the current image"""
+        self.imageSet.set_sort_key(sortKey)
+        self.show_image()
 
     def next_image(self, changeType, howMany=None):
         self.flip_image_changeType(changeType)
 
         if howMany == None:
             howMany = 1
-        self.imageSet['setPos'] += howMany
+        self.imageSet.setPos += howMany
 
-        if self.imageSet['setPos'] >= len(self.imageSet['orderedList']):
-            self.imageSet['setPos'] = 0
+        if self.imageSet.setPos >= len(self.imageSet):
+            self.imageSet.setPos = 0
 
-        if self.imageSet['cacheImage'].filename == self.imageSet['orderedList'][self.imageSet['setPos']]['image']:
-            Window.set_title(f"TimelessIV - {self.imageSet['cacheImage'].filename}")
-            self.texture = self.imageSet['cacheImage'].texture
-            self.source = self.imageSet['cacheImage'].filename
-        else:
-            self.source = self.gen_image()
+        self.show_image()
 
         # from image-to-image get to right zoom setting
         if self.zoomMode == 'pan':
@@ -106,60 +269,28 @@ class MainImage(Image):
         elif self.zoomMode == 'fit':
             self.be_zoom_fit()
 
-        try:
-            #Logger.debug(f"Caching NEXT image {self.imageSet['setPos'] + 1} named {self.imageSet['orderedList'][self.imageSet['setPos'] + 1]['image']}")
-            self.imageSet['cacheImage'] = Loader.image(self.imageSet['orderedList'][self.imageSet['setPos'] + 1]['image'])
-            self.imageSet['cacheImage'].bind(on_load=self.cacheImage_loaded)
-        except:
-            pass
-
         self.pos = [0,0]
 
     def prev_image(self, changeType, howMany=None):
         self.flip_image_changeType(changeType)
-        self.imageSet['cachedDirection'] = '-'
 
         if howMany == None:
             howMany = 1
-        self.imageSet['setPos'] -= howMany
+        self.imageSet.setPos -= howMany
 
-        if self.imageSet['setPos'] < 0:
-            self.imageSet['setPos'] = len(self.imageSet['orderedList']) - 1
-
-        if self.imageSet['cacheImage'].filename == self.imageSet['orderedList'][self.imageSet['setPos']]['image']:
-            Window.set_title(f"TimelessIV - {self.imageSet['cacheImage'].filename}")
-            self.texture = self.imageSet['cacheImage'].texture
-            self.source = self.imageSet['cacheImage'].filename
-        else:
-            self.source = self.gen_image()
-
-        try:
-            #Logger.debug(f"Caching PREV image {self.imageSet['setPos'] - 1} named {self.imageSet['orderedList'][self.imageSet['setPos'] - 1]['image']}")
-            self.imageSet['cacheImage'] = Loader.image(self.imageSet['orderedList'][self.imageSet['setPos'] - 1]['image'])
-            self.imageSet['cacheImage'].bind(on_load=self.cacheImage_loaded)
-        except:
-            pass
+        if self.imageSet.setPos < 0:
+            self.imageSet.setPos = len(self.imageSet) - 1
 
+        self.show_image()
         self.pos = [0,0]
 
-    def cacheImage_loaded(self, cacheImage):
-        Logger.debug(f"cacheImage_loaded() called with {cacheImage.filename}")
-        if cacheImage.texture:
-            if self.imageSet['cacheImage'].filename == self.imageSet['orderedList'][self.imageSet['setPos']]['image']:
-                # if there are exactly two images... this excepts
-                try:
-                    self.imageSet['cacheImage'].texture = cacheImage.texture
-                except:
-                    pass
-
     def gen_image(self):
         # sometimes in cases of deleting/reordering we can get here with an
         # invalid setPos. make it the 1st image in that case
-        if self.imageSet['setPos'] < 0 or self.imageSet['setPos'] > len(self.imageSet['orderedList']) - 1:
-            self.imageSet['setPos'] = 0
+        if self.imageSet.setPos < 0 or self.imageSet.setPos > len(self.imageSet) - 1:
+            self.imageSet.setPos = 0
 
-        #Logger.debug(f"Grabbing from {self.imageSet['orderedList'][self.imageSet['setPos']]}")
-        tmpImg = self.imageSet['orderedList'][self.imageSet['setPos']]['image']
+        tmpImg = self.imageSet.path_at(self.imageSet.setPos)
         Window.set_title(f"TimelessIV - {tmpImg}")
         return tmpImg
 
@@ -0,0 +1,107 @@
+import os
+import time
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+MB = 1024 * 1024
+# how often holdings are added up and system memory looked at
+CHECK_SECONDS = 2
+# usage goes in the log this often even when nothing's being evicted, for a record of long runs
+LOG_SECONDS = 600
+# however short the system is, the pools keep this much between them - the image on screen has to fit
+FLOOR_MB = 64
+
+def system_memory():
+    """(total, available) bytes from /proc/meminfo, None where there isn't one"""
+    try:
+        fields = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                fields[key] = int(value.split()[0]) * 1024
+        return fields['MemTotal'], fields['MemAvailable']
+    except (OSError, KeyError, ValueError, IndexError):
+        return None
+
+def process_rss():
+    """Bytes of this process resident in memory, None where /proc doesn't say"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryGovernor:
+    """
+    Keeps what the viewer's caches hold between them - decoded images and
+    their textures, tiles, thumbnails - under limitMB. Each cache registers
+    as a pool with usage() giving the bytes it holds and shrink(bytes)
+    dropping its least recently used items until it holds no more than that,
+    returning what it freed. Over the limit, every pool gives up the same
+    share of what it holds. With less than lowMB available to the system
+    (from /proc/meminfo, Linux only), the limit comes down by the shortfall
+    until there's enough again. Runs on the main thread, which is the only
+    one that can let go of textures.
+    """
+
+    def __init__(self, limitMB=2048, lowMB=512, checkSeconds=CHECK_SECONDS):
+        self.limit = int(limitMB * MB)
+        self.low = int(lowMB * MB)
+        # name -> (usage, shrink)
+        self.pools = {}
+        self.freed = 0
+        self.squeezed = False
+        self.lastLog = time.monotonic()
+        self.event = Clock.schedule_interval(self.check, checkSeconds)
+
+    def register(self, name, usage, shrink):
+        self.pools[name] = (usage, shrink)
+
+    def usage(self):
+        """name -> bytes held, for every pool"""
+        return {name: usage() for name, (usage, shrink) in self.pools.items()}
+
+    def ceiling(self, held):
+        """The limit as things are, lower while the system is short of memory"""
+        memory = system_memory()
+        squeezed = memory is not None and memory[1] < self.low
+        if squeezed != self.squeezed:
+            self.squeezed = squeezed
+            if squeezed:
+                Logger.warning(f"MemoryGovernor: only {memory[1] / MB:.0f}MB of memory left, giving some back")
+            else:
+                Logger.info("MemoryGovernor: memory's no longer short")
+        if not squeezed:
+            return self.limit
+        return max(FLOOR_MB * MB, min(self.limit, held - (self.low - memory[1])))
+
+    def check(self, dt=0):
+        usage = self.usage()
+        held = sum(usage.values())
+        ceiling = self.ceiling(held)
+        if held > ceiling:
+            freed = 0
+            for name, used in usage.items():
+                if used:
+                    freed += self.pools[name][1](int(used * ceiling / held))
+            self.freed += freed
+            Logger.info(f"MemoryGovernor: held {held / MB:.0f}MB against a limit of {ceiling / MB:.0f}MB, "
+                        f"let go of {freed / MB:.0f}MB")
+        if time.monotonic() - self.lastLog > LOG_SECONDS:
+            self.lastLog = time.monotonic()
+            Logger.info(f"MemoryGovernor: {self.summary()}")
+
+    def summary(self):
+        """One line of where the memory is, for the log and the timing HUD"""
+        usage = self.usage()
+        pools = ', '.join(f"{name} {used / MB:.0f}" for name, used in usage.items())
+        line = f"memory {sum(usage.values()) / MB:.0f}/{self.limit / MB:.0f}MB ({pools})"
+        rss = process_rss()
+        if rss is not None:
+            line += f", process {rss / MB:.0f}MB"
+        memory = system_memory()
+        if memory is not None:
+            line += f", {memory[1] / MB:.0f}MB free"
+        return line
@@ -0,0 +1,253 @@
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PILImage
+from PIL import IptcImagePlugin
+from kivy.clock import Clock
+from kivy.logger import Logger
+from tiviewlib.cachedir import cache_dir
+from tiviewlib.BatchScan import BatchScan
+
+# bump when extract_metadata or a BatchScan changes what it stores, old rows get dropped
+SCHEMA_VERSION = 3
+# lookups answered from memory, the rest come from the database
+MEMO_SIZE = 4096
+
+# EXIF tags we show, base IFD and Exif sub-IFD
+EXIF_IFD = 0x8769
+EXIF_TAGS = [(None, 306, 'Modify Date'), (EXIF_IFD, 36867, 'Date/Time Original'),
+             (EXIF_IFD, 36868, 'Create Date'), (None, 271, 'Make'), (None, 272, 'Camera Model Name'),
+             (None, 270, 'Image Description'), (EXIF_IFD, 37510, 'User Comment')]
+IPTC_TAGS = [((2, 55), 'Date Created'), ((2, 120), 'Caption-Abstract'), ((2, 25), 'Keywords')]
+XMP_TAGS = [('xmp:CreateDate', 'Create Date'), ('photoshop:DateCreated', 'Date Created'),
+            ('dc:description', 'Description')]
+# png text chunks, AI image tools like to leave their prompt in these
+PNG_TEXT = [('Comment', 'Comment'), ('Description', 'Description'), ('Creation Time', 'Create Date'),
+            ('parameters', 'Parameters')]
+
+def _text(value):
+    if isinstance(value, list):
+        return ', '.join(_text(v) for v in value)
+    if isinstance(value, bytes):
+        # exif UserComment starts with an 8 byte charset id
+        if value[:8] in (b'ASCII\0\0\0', b'UNICODE\0', b'\0' * 8):
+            value = value[8:].decode('utf-16' if value[:8] == b'UNICODE\0' else 'latin-1', 'replace')
+        else:
+            value = value.decode('utf-8', 'replace')
+    return ' '.join(str(value).replace('\0', '').split())
+
+def _xmp_value(xmp, tag):
+    # attribute form, then element form (possibly wrapping an rdf:Alt/li)
+    match = re.search(rf'{tag}="([^"]*)"', xmp) or \
+            re.search(rf'<{tag}>(?:\s*<rdf:\w+>\s*<rdf:li[^>]*>)?([^<]*)<', xmp)
+    return match.group(1).strip() if match else None
+
+def estimate_jpeg_quality(img):
+    """Estimate JPEG quality from quantization tables of an opened PIL image"""
+    if img.format != 'JPEG':
+        return "N/A (not JPEG)"
+    # numpy comes in with this, no need for it before the first image's metadata is read
+    from tiviewlib.JpegQuality import quality_from_tables
+    # PIL already parsed the DQT segments on open
+    quality = quality_from_tables(getattr(img, 'quantization', None))
+    if quality is None:
+        return "N/A (no qtables)"
+    return str(quality)
+
+def extract_metadata(path, st=None):
+    """
+    Metadata of interest as a list of [key, value], read from the file
+    headers only - pixels are never decoded.
+    """
+    st = st or os.stat(path)
+    fields = [['File Size', f"{st.st_size / 1024:.0f} kB" if st.st_size < 1048576 else f"{st.st_size / 1048576:.1f} MB"],
+              ['File Modification Date/Time', time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(st.st_mtime))]]
+
+    with PILImage.open(path) as img:
+        fields.insert(0, ['Image Quality', estimate_jpeg_quality(img)])
+        fields.append(['MIME Type', PILImage.MIME.get(img.format, img.format or 'unknown')])
+        fields.append(['Image Size', f"{img.size[0]}x{img.size[1]}"])
+        fields.append(['Megapixels', f"{img.size[0] * img.size[1] / 1000000:.1f}"])
+        if getattr(img, 'is_animated', False):
+            fields.append(['Frames', str(img.n_frames)])
+        if img.format == 'JPEG':
+            process = 'Progressive DCT, Huffman coding' if img.info.get('progressive') else 'Baseline DCT, Huffman coding'
+            fields.append(['Encoding Process', process])
+        if img.info.get('comment'):
+            fields.append(['Comment', _text(img.info['comment'])])
+
+        try:
+            exif = img.getexif()
+            exifIfd = exif.get_ifd(EXIF_IFD)
+            for ifd, tag, name in EXIF_TAGS:
+                value = (exifIfd if ifd else exif).get(tag)
+                if value:
+                    fields.append([name, _text(value)])
+        except Exception as e:
+            Logger.debug(f"MetadataIndex: bad EXIF in {path} - {e}")
+
+        if img.format == 'JPEG':
+            try:
+                iptc = IptcImagePlugin.getiptcinfo(img) or {}
+                for tag, name in IPTC_TAGS:
+                    if iptc.get(tag):
+                        fields.append([name, _text(iptc[tag])])
+            except Exception as e:
+                Logger.debug(f"MetadataIndex: bad IPTC in {path} - {e}")
+
+        xmp = img.info.get('xmp') or img.info.get('XML:com.adobe.xmp')
+        if xmp:
+            xmp = _text(xmp) if isinstance(xmp, bytes) else xmp
+            for tag, name in XMP_TAGS:
+                value = _xmp_value(xmp, tag)
+                if value:
+                    fields.append([name, value])
+
+        if img.format == 'PNG':
+            for key, name in PNG_TEXT:
+                if img.info.get(key):
+                    fields.append([name, _text(img.info[key])])
+
+    return fields
+
+def read_sort_info(path):
+    """
+    [width, height, capture time] of an image from its headers, capture time
+    (EXIF DateTimeOriginal as epoch seconds) None when it doesn't have one.
+    None if it can't be opened at all.
+    """
+    try:
+        with PILImage.open(path) as img:
+            captured = None
+            try:
+                exif = img.getexif()
+                stamp = exif.get_ifd(EXIF_IFD).get(36867) or exif.get(306)
+                if stamp:
+                    captured = time.mktime(time.strptime(_text(stamp)[:19], '%Y:%m:%d %H:%M:%S'))
+            except Exception:
+                pass
+            return [img.size[0], img.size[1], captured]
+    except Exception:
+        return None
+
+
+class SortInfoScan(BatchScan):
+    """Pixel dimensions and capture time of every path, for sorting by them"""
+    kind = 'sortinfo'
+    work = staticmethod(read_sort_info)
+
+
+class MetadataIndex:
+    """
+    Metadata per image, extracted in-process from headers and kept in an
+    SQLite index keyed by path, mtime and size. All database work happens
+    on one background thread; lookups already made are answered from
+    memory on the main thread.
+    """
+
+    def __init__(self, dbPath=None):
+        self.dbPath = dbPath or os.path.join(cache_dir(), 'metadata.sqlite')
+        # sqlite connections stay on the thread that made them, so just the one
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='MetadataIndex')
+        self.db = None
+        # path -> (mtime_ns, size, fields), oldest dropped past MEMO_SIZE - a days long
+        # slideshow would otherwise end up with every image it passed in here
+        self.memo = {}
+        self.queued = set()
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.dbPath)
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for table in ('metadata', 'quality', 'scanned'):
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.db.execute("CREATE TABLE IF NOT EXISTS metadata "
+                            "(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, fields TEXT)")
+            # BatchScan results, one kind of value per scan
+            self.db.execute("CREATE TABLE IF NOT EXISTS scanned "
+                            "(kind TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, value TEXT, "
+                            "PRIMARY KEY (kind, path))")
+        return self.db
+
+    def get(self, path):
+        """Fields for path if already known and still current, else None"""
+        known = self.memo.get(path)
+        if known is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if (st.st_mtime_ns, st.st_size) != known[:2]:
+            return None
+        return known[2]
+
+    def _lookup(self, path):
+        # worker thread
+        st = os.stat(path)
+        db = self._connect()
+        row = db.execute("SELECT mtime_ns, size, fields FROM metadata WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1]) == (st.st_mtime_ns, st.st_size):
+            fields = json.loads(row[2])
+        else:
+            fields = extract_metadata(path, st)
+            db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                       (path, st.st_mtime_ns, st.st_size, json.dumps(fields)))
+            db.commit()
+        self.memo[path] = (st.st_mtime_ns, st.st_size, fields)
+        while len(self.memo) > MEMO_SIZE:
+            # only this thread adds or removes, the main thread just reads
+            del self.memo[next(iter(self.memo))]
+        return fields
+
+    def lookup(self, path, callback=None):
+        """Find metadata for path in the background, then callback(path, fields or None) on the main thread"""
+        def work():
+            try:
+                fields = self._lookup(path)
+            except Exception as e:
+                Logger.warning(f"MetadataIndex: couldn't read {path} - {e}")
+                fields = None
+            finally:
+                self.queued.discard(path)
+            if callback:
+                Clock.schedule_once(lambda dt: callback(path, fields))
+        self.queued.add(path)
+        self.worker.submit(work)
+
+    def _cached_values(self, kind, stats):
+        db = self._connect()
+        cached = {}
+        for path, mtime_ns, size, value in db.execute(
+                "SELECT path, mtime_ns, size, value FROM scanned WHERE kind = ?", (kind,)):
+            if stats.get(path) == (mtime_ns, size):
+                cached[path] = json.loads(value)
+        return cached
+
+    def cached_values(self, kind, stats):
+        """
+        Known BatchScan values of kind for paths in stats ({path: (mtime_ns, size)})
+        that haven't changed since. Blocks, so not for the main thread.
+        """
+        return self.worker.submit(self._cached_values, kind, stats).result()
+
+    def _store_values(self, kind, rows):
+        db = self._connect()
+        db.executemany("INSERT OR REPLACE INTO scanned VALUES (?, ?, ?, ?, ?)",
+                       [(kind, path, mtime_ns, size, json.dumps(value)) for path, mtime_ns, size, value in rows])
+        db.commit()
+
+    def store_values(self, kind, rows):
+        """Remember (path, mtime_ns, size, value) rows of kind"""
+        self.worker.submit(self._store_values, kind, rows)
+
+    def prefetch(self, paths):
+        """Get neighbouring images indexed ahead of anyone pressing i"""
+        for path in paths:
+            if path not in self.queued and self.get(path) is None:
+                self.lookup(path)
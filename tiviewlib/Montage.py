@@ -0,0 +1,248 @@
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+from PIL import Image as PILImage, ImageDraw, ImageFont
+
+from kivy.logger import Logger
+from tiviewlib.BatchScan import worker_pool
+from tiviewlib.DirScanner import DirScanner
+from tiviewlib.ImageDecoder import decode_reduced
+from tiviewlib.ImageSet import ImageSet
+
+# space around each tile, and the sheet colour showing through it
+PADDING = 6
+BACKGROUND = (24, 24, 24)
+LABEL_COLOUR = (200, 200, 200)
+# rows decoded ahead of the one being written, per worker - keeps them all busy
+# without a slow row letting thousands of finished ones pile up behind it
+ROWS_AHEAD = 2
+
+# a FreeType face isn't safe to share between threads, so each worker loads its own
+_fonts = threading.local()
+
+def _font(size):
+    fonts = _fonts.__dict__
+    if size not in fonts:
+        try:
+            fonts[size] = ImageFont.load_default(size)
+        except TypeError:
+            # Pillow before 10.1 only has the one little bitmap font
+            fonts[size] = ImageFont.load_default()
+    return fonts[size]
+
+def label_height(fontSize):
+    return fontSize + PADDING if fontSize else 0
+
+def _fitted_label(draw, text, font, width):
+    """text, cut short with ... if it's wider than width"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '...', font=font) > width:
+        text = text[:-1]
+    return text + '...'
+
+def _flatten(img):
+    """RGB, with anything transparent over the sheet background"""
+    if img.mode == 'RGB':
+        return img
+    flat = PILImage.new('RGB', img.size, BACKGROUND)
+    flat.paste(img, mask=img.getchannel('A'))
+    return flat
+
+def render_row(paths, columns, tileSize, fontSize):
+    """
+    One row of a sheet as raw RGB bytes, each image decoded at only the size
+    its tile needs. Runs on several worker threads at once.
+    """
+    cell = tileSize + 2 * PADDING
+    row = PILImage.new('RGB', (cell * columns, cell + label_height(fontSize)), BACKGROUND)
+    draw = ImageDraw.Draw(row)
+    font = _font(fontSize) if fontSize else None
+    for i, path in enumerate(paths):
+        x = i * cell
+        try:
+            img, fullSize = decode_reduced(path, (tileSize, tileSize))
+            img.thumbnail((tileSize, tileSize))
+            img = _flatten(img)
+            row.paste(img, (x + PADDING + (tileSize - img.width) // 2, PADDING + (tileSize - img.height) // 2))
+        except Exception as e:
+            Logger.warning(f"Montage: couldn't read {path} - {e}")
+            draw.rectangle((x + PADDING, PADDING, x + PADDING + tileSize - 1, PADDING + tileSize - 1), outline=LABEL_COLOUR)
+        if font is not None:
+            text = _fitted_label(draw, os.path.basename(path), font, tileSize)
+            draw.text((x + cell // 2, cell), text, font=font, fill=LABEL_COLOUR, anchor='mt')
+    return row.tobytes()
+
+
+class PngSheet:
+    """
+    A PNG written a band of rows at a time as they come in, nothing but the
+    compressor's state kept in between. Rows use the Sub filter, which does
+    most of what Pillow's adaptive filtering would for photos, in one numpy op.
+    """
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.width = width
+        self.compressor = zlib.compressobj(6)
+        self.f = open(path, 'wb')
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per channel RGB, not interlaced
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.f.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+    def add_rows(self, data, height):
+        pixels = np.frombuffer(data, dtype=np.uint8).reshape(height, self.width * 3)
+        filtered = np.empty((height, self.width * 3 + 1), dtype=np.uint8)
+        # filter type 1, each byte less the same channel of the pixel before
+        filtered[:, 0] = 1
+        filtered[:, 1:4] = pixels[:, :3]
+        np.subtract(pixels[:, 3:], pixels[:, :-3], out=filtered[:, 4:])
+        compressed = self.compressor.compress(filtered.tobytes())
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.f.close()
+
+
+class ImageSheet:
+    """A sheet in a format Pillow can only write whole, put together in memory"""
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.img = PILImage.new('RGB', (width, height), BACKGROUND)
+        self.y = 0
+
+    def add_rows(self, data, height):
+        self.img.paste(PILImage.frombytes('RGB', (self.img.width, height), data), (0, self.y))
+        self.y += height
+
+    def close(self):
+        self.img.save(self.path, quality=90)
+        self.img = None
+
+
+class Montage:
+    """
+    Contact sheets of a list of images, columns x rows labelled tiles per
+    sheet. Rows are decoded across a worker_pool, a few ahead of the one
+    being written, and go into the sheet as they arrive in order. PNG sheets
+    are written out a row at a time, so memory stays at a few rows however
+    many images there are; other formats need one whole sheet in memory.
+    """
+
+    def __init__(self, output, columns=8, rows=10, tileSize=256, labels=True, workers=None):
+        self.output = output
+        self.columns = columns
+        self.rows = rows
+        self.tileSize = tileSize
+        self.fontSize = max(10, tileSize // 16) if labels else 0
+        self.workers = workers or os.cpu_count()
+
+    def sheet_names(self, numSheets):
+        """output itself for one sheet, otherwise numbered name-001.ext, name-002.ext, ..."""
+        if numSheets == 1:
+            return [self.output]
+        base, ext = os.path.splitext(self.output)
+        digits = max(3, len(str(numSheets)))
+        return [f"{base}-{n:0{digits}d}{ext}" for n in range(1, numSheets + 1)]
+
+    def _open_sheet(self, path, numRows):
+        cell = self.tileSize + 2 * PADDING
+        width = cell * self.columns
+        height = (cell + label_height(self.fontSize)) * numRows
+        sheetClass = PngSheet if path.lower().endswith('.png') else ImageSheet
+        return sheetClass(path, width, height)
+
+    def make(self, paths):
+        """Write the sheets for paths, in order. Returns the sheet filenames."""
+        if not paths:
+            return []
+        start = time.perf_counter()
+        rowPaths = [paths[i:i + self.columns] for i in range(0, len(paths), self.columns)]
+        names = self.sheet_names(math.ceil(len(rowPaths) / self.rows))
+        rowHeight = self.tileSize + 2 * PADDING + label_height(self.fontSize)
+        Logger.info(f"Montage: {len(paths)} images onto {len(names)} sheets with {self.workers} workers")
+
+        sheet = None
+        pending = deque()
+        submitted = 0
+        with worker_pool(self.workers, 'Montage') as pool:
+            for rowNum in range(len(rowPaths)):
+                while submitted < len(rowPaths) and len(pending) < self.workers * ROWS_AHEAD:
+                    pending.append(pool.submit(render_row, rowPaths[submitted], self.columns, self.tileSize, self.fontSize))
+                    submitted += 1
+                data = pending.popleft().result()
+                sheetNum, rowInSheet = divmod(rowNum, self.rows)
+                sheetRows = min(self.rows, len(rowPaths) - sheetNum * self.rows)
+                if rowInSheet == 0:
+                    sheet = self._open_sheet(names[sheetNum], sheetRows)
+                sheet.add_rows(data, rowHeight)
+                if rowInSheet == sheetRows - 1:
+                    sheet.close()
+                    Logger.info(f"Montage: wrote {sheet.path} ({sheetNum + 1}/{len(names)}, "
+                                f"{time.perf_counter() - start:.1f}s)")
+        return names
+
+
+def collect_images(inputs, recursive=False, sortKey='name', maxQuality=None, scanWorkers=8,
+                   fileList=None, separator=b'\n'):
+    """
+    Paths of the images the viewer would show for the same arguments, in the
+    order it would show them: files as given, directories scanned, fileList
+    read, then sorted and filtered the same way.
+    """
+    imageSet = ImageSet(sortKey=sortKey)
+    scanDirs = []
+    files = []
+    for inArg in inputs or ([] if fileList else ['.']):
+        if os.path.isdir(inArg):
+            scanDirs.append(inArg)
+        elif os.path.isfile(inArg):
+            st = os.stat(inArg)
+            files.append((inArg, st.st_size, st.st_mtime))
+        else:
+            Logger.error(f"Input {inArg} is neither file nor directory. Ignoring.")
+    # given files stay in the order given, unless there's scanning or another order
+    keepSorted = bool(scanDirs) or sortKey != 'name'
+    imageSet.extend(files, keepSorted=keepSorted)
+    scanner = DirScanner(scanDirs, recursive=recursive, workers=scanWorkers, fileList=fileList, separator=separator)
+    scanner.done.wait()
+    imageSet.extend((found for batch in scanner.get_batches() for found in batch), keepSorted=keepSorted)
+
+    if sortKey in ('dimensions', 'created') or maxQuality is not None:
+        from tiviewlib.MetadataIndex import MetadataIndex, SortInfoScan
+        metadataIndex = MetadataIndex()
+        if sortKey in ('dimensions', 'created'):
+            scan = SortInfoScan(imageSet.paths(), metadataIndex)
+            scan.done.wait()
+            for img in imageSet:
+                info = scan.results.get(img.path)
+                if info is None:
+                    img.pixels = math.inf
+                    continue
+                width, height, captured = info
+                img.pixels = width * height
+                if captured is not None:
+                    img.created = captured
+            imageSet.set_sort_key(sortKey)
+        if maxQuality is not None:
+            from tiviewlib.JpegQuality import QualityScan
+            scan = QualityScan(imageSet.paths(), metadataIndex)
+            scan.done.wait()
+            for img in imageSet:
+                img.quality = scan.results.get(img.path)
+            imageSet.filter(lambda x: x.quality is not None and x.quality <= maxQuality)
+            imageSet.set_sort_key('quality')
+    return imageSet.paths()
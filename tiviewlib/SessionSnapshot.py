@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from kivy.logger import Logger
+from tiviewlib.cachedir import cache_dir
+
+SNAPSHOT_VERSION = 2
+# snapshots kept, least recently used go first
+MAX_SNAPSHOTS = 50
+
+def _join(strings):
+    return np.frombuffer('\0'.join(strings).encode('utf-8', 'surrogateescape'), dtype=np.uint8)
+
+def _split(blob):
+    return bytes(blob).decode('utf-8', 'surrogateescape').split('\0')
+
+
+class SessionSnapshot:
+    """
+    The image list, viewing order and position of one invocation (cwd plus
+    arguments), saved as flat numpy arrays so a huge set comes back without
+    rescanning. Alongside go the mtimes of every directory it came from:
+    'scan' directories were read whole, 'files' ones only hold images given
+    by name. A directory whose mtime moved has had entries added or removed
+    and needs looking at again.
+    """
+
+    def __init__(self, signature, rootDir=None):
+        self.signature = json.dumps(signature)
+        self.rootDir = rootDir or cache_dir('sessions')
+        name = hashlib.sha1(self.signature.encode('utf-8', 'surrogateescape')).hexdigest()
+        self.path = os.path.join(self.rootDir, f"{name}.npz")
+
+    def load(self, imageSet):
+        """
+        Restore imageSet as saved. Returns the saved header - with 'dirs' as
+        [[dir/, mtime_ns, kind], ...] - or None if there's no usable snapshot.
+        An order sorted by something other than imageSet.sortKey, picked with
+        o or d after starting, is sorted back by imageSet.sortKey, which is
+        what the signature says and what images found later get merged by.
+        """
+        try:
+            with np.load(self.path) as data:
+                header = json.loads(bytes(data['header']))
+                if header.get('version') != SNAPSHOT_VERSION or header.get('signature') != self.signature:
+                    return None
+                names = _split(data['names']) if len(data['sizes']) else []
+                imageSet.restore(_split(data['dirNames']), data['dirIndex'], names, data['sizes'],
+                                 data['mtimes'], data['order'], header['changeType'], header['setPos'])
+                if header['sortKey'] != imageSet.sortKey and header['changeType'] != 'random':
+                    imageSet.set_sort_key(imageSet.sortKey)
+                    imageSet.set_order(header['changeType'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            Logger.warning(f"SessionSnapshot: ignoring unreadable {self.path} - {e}")
+            return None
+        # mtime is our LRU clock
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+        Logger.info(f"SessionSnapshot: restored {len(imageSet)} images from {self.path}")
+        return header
+
+    def save(self, imageSet, dirs, **extra):
+        """Write imageSet and dirs ({dir/: (mtime_ns, kind)}) out, replacing any earlier snapshot"""
+        records, order = imageSet.snapshot()
+        dirNames = {}
+        dirIndex = np.fromiter((dirNames.setdefault(r.dir, len(dirNames)) for r in records),
+                               dtype=np.int32, count=len(records))
+        header = dict(extra, version=SNAPSHOT_VERSION, signature=self.signature,
+                      sortKey=imageSet.sortKey, changeType=imageSet.changeType, setPos=imageSet.setPos,
+                      dirs=[[dirName, mtime, kind] for dirName, (mtime, kind) in dirs.items()])
+        tmpPath = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmpPath, 'wb') as f:
+                np.savez(f, header=np.frombuffer(json.dumps(header).encode('utf-8', 'surrogateescape'), dtype=np.uint8),
+                         dirNames=_join(dirNames), dirIndex=dirIndex, names=_join(r.name for r in records),
+                         sizes=np.fromiter((r.size for r in records), dtype=np.int64, count=len(records)),
+                         mtimes=np.fromiter((r.mtime for r in records), dtype=np.float64, count=len(records)),
+                         order=order)
+            os.replace(tmpPath, self.path)
+        except OSError as e:
+            Logger.error(f"SessionSnapshot: couldn't write {self.path} - {e}")
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            return
+        Logger.info(f"SessionSnapshot: saved {len(records)} images to {self.path}")
+        self.trim()
+
+    @staticmethod
+    def check_dirs(header):
+        """
+        One stat per directory the snapshot came from. Returns (unchanged,
+        rescan, refresh, gone): unchanged and refreshed directories as
+        {dir/: (mtime_ns, kind)} with their mtime now, 'scan' directories
+        that changed and need reading again, and directories that are gone.
+        A changed 'files' directory only needs its named images re-checked.
+        """
+        unchanged, refresh = {}, {}
+        rescan, gone = [], set()
+        for dirName, mtime, kind in header['dirs']:
+            try:
+                st = os.stat(dirName or '.')
+            except OSError:
+                gone.add(dirName)
+                continue
+            if st.st_mtime_ns == mtime:
+                unchanged[dirName] = (mtime, kind)
+            elif kind == 'scan':
+                rescan.append(dirName)
+            else:
+                refresh[dirName] = (st.st_mtime_ns, kind)
+        return unchanged, rescan, refresh, gone
+
+    def trim(self):
+        try:
+            snapshots = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.rootDir)
+                               if entry.name.endswith('.npz'))
+            for mtime, path in snapshots[:-MAX_SNAPSHOTS]:
+                os.remove(path)
+        except OSError as e:
+            Logger.error(f"SessionSnapshot: couldn't trim {self.rootDir} - {e}")
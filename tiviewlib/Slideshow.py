@@ -0,0 +1,110 @@
+import math
+import os
+import time
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+# showing an image this much after its tick still counts as on time, about a frame
+LATE_TOLERANCE = 0.05
+# how often to look again while waiting on a late image
+WAIT_POLL = 0.05
+# a load that never finishes (unreadable file) stops holding things up after this long
+GIVE_UP = 10
+# never read further ahead than this many images
+MAX_LOOKAHEAD = 8
+
+class Slideshow:
+    """
+    Calls advance() every interval seconds to step through imageSet in its
+    current order, but only once the next image is decoded. Decodes are
+    started as many images ahead as the cache's recent load times say are
+    needed to be ready by their tick. Ticks that had to wait count as missed,
+    along with how late they were.
+    """
+
+    def __init__(self, imageSet, imageCache, advance):
+        self.imageSet = imageSet
+        self.imageCache = imageCache
+        self.advance = advance
+        self.interval = 20
+        self.event = None
+        # when the next image is due (None for as soon as it's ready), and when the last one went up
+        self.deadline = None
+        self.shownAt = 0
+        self.shown = 0
+        self.missed = 0
+        self.totalLate = 0
+        self.worstLate = 0
+
+    @property
+    def running(self):
+        return self.event is not None
+
+    def start(self, interval):
+        """Show the next image as soon as it's ready, then one every interval seconds"""
+        self.stop()
+        self.interval = interval
+        self.shown = self.missed = 0
+        self.totalLate = self.worstLate = 0
+        self.shownAt = time.monotonic()
+        self.deadline = None
+        self._prefetch()
+        self.event = Clock.schedule_once(self._tick, 0)
+
+    def set_interval(self, interval):
+        self.interval = interval
+        if self.running:
+            self.event.cancel()
+            self.deadline = self.shownAt + interval
+            self.event = Clock.schedule_once(self._tick, max(0, self.deadline - time.monotonic()))
+
+    def stop(self):
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+
+    def summary(self):
+        if not self.missed:
+            return f"Slideshow: all {self.shown} images on time"
+        return (f"Slideshow: {self.missed} of {self.shown} images late, "
+                f"average {self.totalLate / self.missed:.2f}s, worst {self.worstLate:.2f}s")
+
+    def _next_path(self, ahead=1):
+        return self.imageSet.path_at((self.imageSet.setPos + ahead) % len(self.imageSet))
+
+    def _prefetch(self):
+        """Get decodes going for the images due before a load started now would finish"""
+        numImages = len(self.imageSet)
+        if numImages < 2:
+            return
+        lookahead = min(MAX_LOOKAHEAD, numImages - 1, math.ceil(self.imageCache.loadTime / self.interval) + 1)
+        self.imageCache.fetch([self._next_path(ahead) for ahead in range(1, lookahead + 1)])
+
+    def _tick(self, dt):
+        if len(self.imageSet) < 2:
+            self.event = None
+            return
+        now = time.monotonic()
+        path = self._next_path()
+        if not self.imageCache.ready(path):
+            if not self.imageCache.loading(path):
+                # evicted or never asked for
+                self.imageCache.fetch([path])
+            if self.imageCache.loading(path) and now - (self.deadline or self.shownAt) < GIVE_UP:
+                self.event = Clock.schedule_once(self._tick, WAIT_POLL)
+                return
+
+        late = 0 if self.deadline is None else now - self.deadline
+        self.shown += 1
+        if late > LATE_TOLERANCE:
+            self.missed += 1
+            self.totalLate += late
+            self.worstLate = max(self.worstLate, late)
+            Logger.info(f"Slideshow: {os.path.basename(path)} {late:.2f}s late, loads taking {self.imageCache.loadTime:.2f}s")
+        self.advance()
+        # a late image still gets its full interval on screen
+        self.shownAt = now
+        self.deadline = now + self.interval
+        self._prefetch()
+        self.event = Clock.schedule_once(self._tick, self.interval)
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PILImage
+from kivy.logger import Logger
+from tiviewlib.cachedir import cache_dir
+from tiviewlib.ImageDecoder import exif_orientation, to_8bit, upright
+
+# bump when thumbnails come out differently, old ones are left for trim() to clear out
+THUMB_VERSION = 2
+
+class ThumbnailCache:
+    """
+    Thumbnails on disk under the XDG cache directory, keyed by the image's
+    path, size and mtime so edited files get new ones. Generating and
+    reading them happens in a thread pool; once the directory grows past
+    budgetMB the least recently used are removed.
+    """
+
+    def __init__(self, cacheDir=None, thumbSize=256, budgetMB=512, workers=4):
+        self.cacheDir = cacheDir or cache_dir('thumbnails')
+        self.thumbSize = thumbSize
+        self.budget = int(budgetMB * 1024 * 1024)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Thumbnail')
+        self.trimLock = threading.Lock()
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.written = 0
+        self.pool.submit(self.trim)
+
+    def cache_path(self, path, st):
+        key = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\0{self.thumbSize}\0{THUMB_VERSION}"
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cacheDir, digest[:2], digest + '.jpg')
+
+    def load(self, path):
+        """Thumbnail for path as (width, height, rgba bytes), generating it if needed. Blocking."""
+        st = os.stat(path)
+        thumbPath = self.cache_path(path, st)
+        try:
+            with PILImage.open(thumbPath) as img:
+                img = img.convert('RGBA')
+            # mtime is our LRU clock
+            os.utime(thumbPath)
+        except OSError:
+            img = self._generate(path, thumbPath).convert('RGBA')
+        return img.size[0], img.size[1], img.tobytes()
+
+    def _generate(self, path, thumbPath):
+        with PILImage.open(path) as img:
+            orientation = exif_orientation(img)
+            # let JPEG decode at 1/8 scale when it can
+            img.draft('RGB', (self.thumbSize, self.thumbSize))
+            # 16-bit greyscale scaled down, as for display, not clipped to white
+            img = to_8bit(img)
+            img.thumbnail((self.thumbSize, self.thumbSize))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = upright(img, orientation)
+        os.makedirs(os.path.dirname(thumbPath), exist_ok=True)
+        # write then rename, so a half written thumbnail is never read
+        tmpPath = f"{thumbPath}.{threading.get_ident()}.tmp"
+        img.save(tmpPath, 'JPEG', quality=85)
+        os.replace(tmpPath, thumbPath)
+        self.written += os.path.getsize(thumbPath)
+        if self.written > self.budget // 10:
+            self.written = 0
+            self.pool.submit(self.trim)
+        return img
+
+    def submit(self, path, callback, isWanted=None):
+        """
+        Load a thumbnail in the pool, callback(path, result) from the worker
+        thread. isWanted(path) is asked again when the work starts, so
+        requests scrolled past in the meantime cost nothing.
+        """
+        def work():
+            if isWanted is not None and not isWanted(path):
+                callback(path, None)
+                return
+            try:
+                result = self.load(path)
+            except Exception as e:
+                Logger.warning(f"ThumbnailCache: no thumbnail for {path} - {e}")
+                result = None
+            callback(path, result)
+        return self.pool.submit(work)
+
+    def trim(self):
+        """Remove least recently used thumbnails until under budget"""
+        if not self.trimLock.acquire(blocking=False):
+            return
+        try:
+            thumbs = []
+            total = 0
+            for subDir in os.scandir(self.cacheDir):
+                if not subDir.is_dir():
+                    continue
+                for entry in os.scandir(subDir.path):
+                    st = entry.stat()
+                    thumbs.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.budget:
+                return
+            # leave some headroom so we aren't trimming after every write
+            target = int(self.budget * 0.9)
+            thumbs.sort()
+            for mtime, size, thumbPath in thumbs:
+                if total <= target:
+                    break
+                try:
+                    os.remove(thumbPath)
+                    total -= size
+                except OSError:
+                    pass
+            Logger.info(f"ThumbnailCache: trimmed {self.cacheDir} to {total / 1048576:.0f}MB")
+        except OSError as e:
+            Logger.error(f"ThumbnailCache: couldn't trim {self.cacheDir} - {e}")
+        finally:
+            self.trimLock.release()
@@ -0,0 +1,385 @@
+import hashlib
+import math
+import os
+import queue
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PILImage
+from kivy.clock import Clock
+from kivy.graphics import Color, InstructionGroup, PopMatrix, PushMatrix, Rectangle, Translate
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from tiviewlib.cachedir import cache_dir
+from tiviewlib.ImageDecoder import SWAPS_AXES, exif_orientation, to_8bit, upright, upright_size
+
+TILE_SIZE = 512
+
+def max_texture_size():
+    """Biggest texture the GL driver takes, or a conservative guess"""
+    try:
+        from kivy.graphics.opengl import glGetIntegerv, GL_MAX_TEXTURE_SIZE
+        return int(glGetIntegerv(GL_MAX_TEXTURE_SIZE)[0])
+    except Exception:
+        return 4096
+
+
+class TilePyramid:
+    """
+    An image cut into tiles at full resolution and at every halving below
+    that, down to one tile. Built on disk once by build() - the one time
+    the whole image is decoded - then read back a tile at a time. Tiles
+    and sizes are of the image turned upright as its EXIF orientation says.
+    Tile keys are (pyramid, level, tx, ty), so tiles of one image never
+    pass for another's.
+    """
+
+    def __init__(self, path, rootDir, tileSize=TILE_SIZE):
+        self.path = path
+        self.tileSize = tileSize
+        st = os.stat(path)
+        with PILImage.open(path) as img:
+            self.orientation = exif_orientation(img)
+            self.fullSize = upright_size(img.size, self.orientation)
+            self.alpha = 'A' in img.mode or 'transparency' in img.info
+        key = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\0{tileSize}\0{self.orientation}"
+        self.dir = os.path.join(rootDir, hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest())
+        self.ext = 'png' if self.alpha else 'jpg'
+        self.levels = 1
+        while max(self.level_size(self.levels - 1)) > tileSize:
+            self.levels += 1
+        self.cancelled = False
+        self.failed = False
+        self.ready = threading.Event()
+        if os.path.exists(os.path.join(self.dir, 'done')):
+            # mtime is our LRU clock
+            os.utime(self.dir)
+            self.ready.set()
+
+    def level_size(self, level):
+        scale = 2 ** level
+        return math.ceil(self.fullSize[0] / scale), math.ceil(self.fullSize[1] / scale)
+
+    def tile_counts(self, level):
+        width, height = self.level_size(level)
+        return math.ceil(width / self.tileSize), math.ceil(height / self.tileSize)
+
+    def tile_path(self, level, tx, ty, tileDir=None):
+        return os.path.join(tileDir or self.dir, f"{level}_{tx}_{ty}.{self.ext}")
+
+    def build(self):
+        """
+        Decode the image and write out every tile of every level. Blocking.
+        Pillow can't decode part of a PNG or JPEG, so the decode itself is
+        the whole file; after that it goes a row of tiles at a time, each
+        level's rows made from two of the level above, so no more than a
+        row of tiles per level is held besides the decoded image.
+        """
+        if self.ready.is_set():
+            return
+        tmpDir = f"{self.dir}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(tmpDir, exist_ok=True)
+            # per level, the top half of a row of tiles waiting for its bottom half
+            halves = [None] * self.levels
+            with PILImage.open(self.path) as img:
+                img.load()
+                for ty in range(self.tile_counts(0)[1]):
+                    if self.cancelled:
+                        return
+                    top = ty * self.tileSize
+                    self._cut_row(0, ty, self._band(img, top, min(top + self.tileSize, self.fullSize[1])),
+                                  halves, tmpDir)
+            # the last row of a level with an odd number of rows has nothing to pair with
+            for level in range(1, self.levels):
+                if halves[level] is not None:
+                    ty, band = halves[level]
+                    halves[level] = None
+                    self._cut_row(level, ty, band, halves, tmpDir)
+            open(os.path.join(tmpDir, 'done'), 'w').close()
+            # whole pyramid appears at once, so a half built one is never read
+            try:
+                os.rename(tmpDir, self.dir)
+            except OSError:
+                # someone else got there first
+                pass
+            self.ready.set()
+            Logger.info(f"TileLayer: {self.levels} levels of tiles for {self.path}")
+        except Exception as e:
+            self.failed = True
+            Logger.error(f"TileLayer: couldn't tile {self.path} - {e}")
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    def _band(self, img, top, bottom):
+        """Rows top to bottom of the upright full resolution image, ready to cut into tiles"""
+        # stored on its side, the upright image's rows are the file's columns
+        length = img.size[0] if self.orientation in SWAPS_AXES else img.size[1]
+        if self.orientation in (3, 4, 7, 8):
+            # and they're counted from the far end
+            top, bottom = length - bottom, length - top
+        if self.orientation in SWAPS_AXES:
+            box = (top, 0, bottom, img.size[1])
+        else:
+            box = (0, top, img.size[0], bottom)
+        band = upright(to_8bit(img.crop(box)), self.orientation)
+        if not self.alpha and band.mode != 'RGB':
+            band = band.convert('RGB')
+        return band
+
+    def _cut_row(self, level, ty, band, halves, tmpDir):
+        """Write row ty of level's tiles from band, and pass it on halved to make the next level's rows"""
+        for tx in range(self.tile_counts(level)[0]):
+            tile = band.crop((tx * self.tileSize, 0, min((tx + 1) * self.tileSize, band.size[0]), band.size[1]))
+            if self.alpha:
+                tile.save(self.tile_path(level, tx, ty, tmpDir), 'PNG', compress_level=1)
+            else:
+                tile.save(self.tile_path(level, tx, ty, tmpDir), 'JPEG', quality=95, subsampling=0)
+        if level + 1 == self.levels:
+            return
+        # tile rows start on even rows, so halving a row at a time comes out the same as halving the lot
+        half = band.reduce(2)
+        if ty % 2 == 0:
+            halves[level + 1] = (ty // 2, half)
+            return
+        upperTy, upper = halves[level + 1]
+        halves[level + 1] = None
+        joined = PILImage.new(half.mode, (half.size[0], upper.size[1] + half.size[1]))
+        joined.paste(upper, (0, 0))
+        joined.paste(half, (0, upper.size[1]))
+        self._cut_row(level + 1, upperTy, joined, halves, tmpDir)
+
+    def load_tile(self, level, tx, ty):
+        """(width, height, rgba bytes) of one tile. Blocking."""
+        with PILImage.open(self.tile_path(level, tx, ty)) as tile:
+            # rgb rows aren't always 4 byte aligned, which GL doesn't take kindly to
+            tile = tile.convert('RGBA')
+            return tile.size[0], tile.size[1], tile.tobytes()
+
+
+class TileLayer:
+    """
+    Draws only the tiles of a TilePyramid that are inside the ScrollView's
+    viewport, at the pyramid level matching the zoom, on top of an Image
+    widget. Tile textures live in a bounded LRU; anything not loaded yet
+    shows the widget's own (display-res) texture underneath.
+    """
+
+    def __init__(self, widget, rootDir=None, cacheMB=256, diskMB=4096, thresholdMP=32, workers=2):
+        self.widget = widget
+        self.rootDir = rootDir or cache_dir('tiles')
+        self.maxTiles = max(16, int(cacheMB * 1024 * 1024) // (TILE_SIZE * TILE_SIZE * 4))
+        self.budget = int(diskMB * 1024 * 1024)
+        self.threshold = thresholdMP * 1000000
+        self.maxTexture = None
+        self.builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='TileBuild')
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TileLoad')
+        self.pyramid = None
+        # (pyramid, level, tx, ty) -> texture
+        self.textures = OrderedDict()
+        self.wanted = set()
+        self.requested = set()
+        # (key, result) from tile workers
+        self.loaded = queue.Queue()
+        self.drawn = None
+        self.uploadEvent = None
+
+        self.translate = Translate(0, 0)
+        self.tiles = InstructionGroup()
+        widget.canvas.after.add(PushMatrix())
+        widget.canvas.after.add(self.translate)
+        widget.canvas.after.add(Color(1, 1, 1, 1))
+        widget.canvas.after.add(self.tiles)
+        widget.canvas.after.add(PopMatrix())
+        widget.bind(pos=self.update, size=self.update)
+        self.builder.submit(self.trim)
+
+    def wants(self, fullSize):
+        """Is an image this big better off tiled than as one texture"""
+        if self.maxTexture is None:
+            self.maxTexture = max_texture_size()
+        return fullSize[0] * fullSize[1] > self.threshold or max(fullSize) > self.maxTexture
+
+    def show(self, path):
+        """Start drawing path from tiles, building them in the background if needed"""
+        if self.pyramid is not None and self.pyramid.path == path:
+            return
+        self.clear()
+        try:
+            self.pyramid = TilePyramid(path, self.rootDir)
+        except Exception as e:
+            Logger.error(f"TileLayer: can't tile {path} - {e}")
+            return
+        if not self.pyramid.ready.is_set():
+            self.builder.submit(self.pyramid.build)
+            self.builder.submit(self.trim)
+            # to notice when it's done
+            self._wake()
+        self.update()
+
+    def clear(self):
+        """Back to just the widget's own texture"""
+        if self.pyramid is not None:
+            self.pyramid.cancelled = True
+            self.pyramid = None
+        if self.uploadEvent is not None:
+            Clock.unschedule(self.uploadEvent)
+            self.uploadEvent = None
+        self.textures.clear()
+        self.wanted.clear()
+        self.requested.clear()
+        self.tiles.clear()
+        self.drawn = None
+
+    def _visible(self):
+        """Level, drawn scale, image origin and visible tile ranges (with a ring of margin)"""
+        widget, pyramid = self.widget, self.pyramid
+        drawnW, drawnH = widget.norm_image_size
+        if drawnW <= 0 or drawnH <= 0:
+            return None
+        originX = widget.center_x - drawnW / 2
+        originY = widget.center_y - drawnH / 2
+        scale = drawnW / pyramid.fullSize[0]
+        # coarsest level that still has a source pixel per screen pixel
+        level = min(pyramid.levels - 1, max(0, int(math.floor(math.log2(1 / scale)))))
+        # viewport in full-res pixels, y down from the top of the image
+        view = widget.parent if widget.parent is not None else widget
+        left = (view.x - originX) / scale
+        right = (view.right - originX) / scale
+        top = (originY + drawnH - view.top) / scale
+        bottom = (originY + drawnH - view.y) / scale
+        span = pyramid.tileSize * 2 ** level
+        cols, rows = pyramid.tile_counts(level)
+        txs = range(max(0, int(left // span)), min(cols, int(right // span) + 1))
+        tys = range(max(0, int(top // span)), min(rows, int(bottom // span) + 1))
+        margin = (range(max(0, txs.start - 1), min(cols, txs.stop + 1)),
+                  range(max(0, tys.start - 1), min(rows, tys.stop + 1)))
+        return level, scale, (originX, originY), txs, tys, margin
+
+    def update(self, *args):
+        if self.pyramid is None:
+            return
+        visible = self._visible()
+        if visible is None:
+            return
+        level, scale, origin, txs, tys, margin = visible
+        # panning only moves the whole lot
+        self.translate.xy = origin
+        if not self.pyramid.ready.is_set():
+            return
+
+        # nearest the middle first, then the ring around the viewport
+        midX, midY = (txs.start + txs.stop) / 2, (tys.start + tys.stop) / 2
+        keys = sorted(((self.pyramid, level, tx, ty) for tx in margin[0] for ty in margin[1]),
+                      key=lambda k: (k[2] not in txs or k[3] not in tys, abs(k[2] - midX) + abs(k[3] - midY)))
+        self.wanted = set(keys)
+        for key in keys:
+            if key in self.textures:
+                self.textures.move_to_end(key)
+            elif key not in self.requested:
+                self.requested.add(key)
+                self.pool.submit(self._load, key)
+                self._wake()
+
+        drawKey = (level, scale, txs, tys, sum(1 for k in keys if k in self.textures))
+        if drawKey != self.drawn:
+            self.drawn = drawKey
+            self._draw(level, scale, txs, tys)
+
+    def _draw(self, level, scale, txs, tys):
+        pyramid = self.pyramid
+        span = pyramid.tileSize * 2 ** level
+        drawnH = pyramid.fullSize[1] * scale
+        self.tiles.clear()
+        for ty in tys:
+            for tx in txs:
+                texture = self.textures.get((pyramid, level, tx, ty))
+                if texture is None:
+                    continue
+                width = texture.width * 2 ** level * scale
+                height = texture.height * 2 ** level * scale
+                top = drawnH - ty * span * scale
+                self.tiles.add(Rectangle(texture=texture, pos=(tx * span * scale, top - height), size=(width, height)))
+
+    def _load(self, key):
+        # worker thread - skip anything panned away from before we got to it
+        pyramid = key[0]
+        result = None
+        if pyramid is self.pyramid and key in self.wanted:
+            try:
+                result = pyramid.load_tile(*key[1:])
+            except Exception as e:
+                Logger.warning(f"TileLayer: couldn't load tile {key[1:]} of {pyramid.path} - {e}")
+        self.loaded.put((key, result))
+
+    def _wake(self):
+        if self.uploadEvent is None:
+            self.uploadEvent = Clock.schedule_interval(self._upload_tiles, 0)
+
+    def _upload_tiles(self, dt):
+        uploaded = False
+        while True:
+            try:
+                key, result = self.loaded.get_nowait()
+            except queue.Empty:
+                break
+            self.requested.discard(key)
+            # tiles of an image we've since left
+            if key[0] is not self.pyramid or result is None:
+                continue
+            width, height, pixels = result
+            texture = Texture.create(size=(width, height), colorfmt='rgba')
+            texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
+            texture.flip_vertical()
+            self.textures[key] = texture
+            uploaded = True
+        while len(self.textures) > self.maxTiles:
+            self.textures.popitem(last=False)
+        if uploaded or (self.drawn is None and self.pyramid is not None and self.pyramid.ready.is_set()):
+            self.update()
+        building = self.pyramid is not None and not (self.pyramid.ready.is_set() or self.pyramid.failed)
+        if not self.requested and not building:
+            self.uploadEvent = None
+            return False
+
+    def memory_used(self):
+        """Bytes of tile textures held"""
+        return sum(texture.width * texture.height * 4 for texture in self.textures.values())
+
+    def shrink(self, target):
+        """Drop least recently viewed tiles, never those in view, until down to target bytes. Returns bytes freed."""
+        freed = 0
+        used = self.memory_used()
+        for key in list(self.textures):
+            if used - freed <= target:
+                break
+            if key not in self.wanted:
+                texture = self.textures.pop(key)
+                freed += texture.width * texture.height * 4
+        return freed
+
+    def trim(self):
+        """Remove least recently viewed pyramids until under budget"""
+        try:
+            pyramids = []
+            total = 0
+            for entry in os.scandir(self.rootDir):
+                if not entry.is_dir() or entry.name.endswith('.tmp'):
+                    continue
+                size = sum(tile.stat().st_size for tile in os.scandir(entry.path))
+                pyramids.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+            if total <= self.budget:
+                return
+            pyramids.sort()
+            # always keep the newest, it's probably on screen
+            for mtime, size, pyramidDir in pyramids[:-1]:
+                if total <= self.budget:
+                    break
+                shutil.rmtree(pyramidDir, ignore_errors=True)
+                total -= size
+            Logger.info(f"TileLayer: trimmed {self.rootDir} to {total / 1048576:.0f}MB")
+        except OSError as e:
+            Logger.error(f"TileLayer: couldn't trim {self.rootDir} - {e}")
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from kivy.logger import Logger
+
+# spans kept, oldest dropped first
+RING_SIZE = 8192
+# a frame taking this long is a hitch you can see
+HITCH_SECONDS = 0.05
+
+def _percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * fraction))]
+
+
+class Trace:
+    """
+    Timings from the hot paths - scanning, reading, decoding, texture upload,
+    key press to image on screen, frame hitches - kept in a ring buffer of
+    (name, start, duration, thread, detail) spans on the perf_counter clock,
+    plus event counters such as cache hits. Cheap enough to always be on, and
+    safe to add to from any thread. summary() is what the timing HUD shows,
+    dump() writes it all out as JSON or a Chrome trace.
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.spans = deque(maxlen=size)
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.frameWatchers = 0
+        self.frameEvent = None
+        self.lastFrame = None
+
+    def add(self, name, start, duration, detail=None):
+        self.spans.append((name, start, duration, threading.current_thread().name, detail))
+
+    @contextmanager
+    def span(self, name, detail=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, detail)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def watch_frames(self, on=True):
+        """Time every frame while anyone wants it, keeping the slow ones as 'frame hitch' spans"""
+        from kivy.clock import Clock
+        self.frameWatchers += 1 if on else -1
+        if self.frameWatchers > 0 and self.frameEvent is None:
+            self.lastFrame = None
+            self.frameEvent = Clock.schedule_interval(self._frame, 0)
+        elif self.frameWatchers <= 0 and self.frameEvent is not None:
+            self.frameEvent.cancel()
+            self.frameEvent = None
+
+    def _frame(self, dt):
+        now = time.perf_counter()
+        if self.lastFrame is not None and now - self.lastFrame > HITCH_SECONDS:
+            self.add('frame hitch', self.lastFrame, now - self.lastFrame)
+        self.lastFrame = now
+        self.count('frames')
+
+    def summary(self, recent=200):
+        """name -> (count, mean, p95, max) in ms, over the most recent spans of each name"""
+        durations = {}
+        for name, start, duration, thread, detail in reversed(list(self.spans)):
+            values = durations.setdefault(name, [])
+            if len(values) < recent:
+                values.append(duration * 1000)
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            summary[name] = (len(values), sum(values) / len(values), _percentile(values, 0.95), values[-1])
+        return summary
+
+    def dump(self, path, fmt='chrome'):
+        """Write everything in the ring buffer to path, as a Chrome trace or plain JSON"""
+        spans = list(self.spans)
+        with self.lock:
+            counters = dict(self.counters)
+        if fmt == 'chrome':
+            pid = os.getpid()
+            threads = {}
+            events = [{'name': name, 'cat': 'tiv', 'ph': 'X', 'pid': pid,
+                       'tid': threads.setdefault(thread, len(threads)),
+                       'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6,
+                       'args': {'detail': detail} if detail is not None else {}}
+                      for name, start, duration, thread, detail in spans]
+            events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}}
+                       for thread, tid in threads.items()]
+            events.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0,
+                           'ts': (time.perf_counter() - self.origin) * 1e6, 'args': counters})
+            data = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        else:
+            data = {'spans': [{'name': name, 'startMs': (start - self.origin) * 1000, 'durationMs': duration * 1000,
+                               'thread': thread, 'detail': detail}
+                              for name, start, duration, thread, detail in spans],
+                    'counters': counters,
+                    'summary': {name: dict(zip(('count', 'meanMs', 'p95Ms', 'maxMs'), stats))
+                                for name, stats in self.summary().items()}}
+        try:
+            with open(path, 'w') as f:
+                json.dump(data, f)
+        except OSError as e:
+            Logger.error(f"Trace: couldn't write {path} - {e}")
+            return
+        Logger.info(f"Trace: wrote {len(spans)} timings to {path}")
+
+
+# the one everything records into
+trace = Trace()
@@ -0,0 +1,8 @@
+import os
+
+def cache_dir(*parts):
+    """Directory under $XDG_CACHE_HOME (or ~/.cache) for our caches, created if needed"""
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(cacheHome, 'timeless-imgview', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path